@@ -0,0 +1,392 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import requests
+
+import load_generator
+import replay
+
+#Benchmark de punta a punta: levanta el servidor final y el intermedio en local con una
+#base de datos temporal, mide la ingesta con el generador de carga y luego la latencia de
+#las consultas con la base de datos llena a distintos tamaños.
+#Los resultados se guardan en JSON y se pueden comparar con una línea base guardada.
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FINAL_SERVER_DIR = os.path.join(ROOT_DIR, "final_server")
+INTERMEDIATE_SERVER_DIR = os.path.join(ROOT_DIR, "intermediate_server")
+
+#Puertos fijos de los servidores (el intermedio reenvía siempre a localhost:8000).
+FINAL_SERVER_URL = "http://127.0.0.1:8000"
+INTERMEDIATE_METRICS_URL = "http://127.0.0.1:9100/metrics"
+
+#Sensor reservado para medir la latencia de ingesta (fuera del rango del generador).
+SENSOR_SONDA = 32767
+#Paquetes de sonda por segundo durante la ingesta.
+SONDA_TASA = 5
+
+#Sensores y días de historia de las filas cargadas para medir consultas.
+SENSORES_CONSULTA = 100
+DIAS_CONSULTA = 90
+FILAS_POR_TRANSACCION = 20000
+
+#Las exportaciones son mucho más largas que las demás consultas: se repiten menos.
+REPETICIONES_EXPORT = 3
+
+
+def percentil(valores, q):
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(q * len(ordenados)))]
+
+
+#Lee un valor (sumando todas sus series) del texto de un endpoint /metrics.
+def leer_metrica(url, nombre):
+    total = 0.0
+    for linea in requests.get(url, timeout=5).text.splitlines():
+        if linea.startswith(nombre) and linea[len(nombre)] in " {":
+            total += float(linea.rsplit(" ", 1)[1])
+    return total
+
+
+def esperar_puerto(port, timeout=30):
+    limite = time.monotonic() + timeout
+    while time.monotonic() < limite:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"El puerto {port} no respondió en {timeout} s")
+
+
+def etiqueta_filas(filas):
+    if filas % 1_000_000 == 0:
+        return f"{filas // 1_000_000}M"
+    if filas % 1000 == 0:
+        return f"{filas // 1000}k"
+    return str(filas)
+
+
+class Servidores:
+
+    def __init__(self, db_path, args):
+        self.env = dict(os.environ, DATABASE_PATH=db_path, LOG_LEVEL="WARNING")
+        self.args = args
+        self.final = None
+        self.intermedio = None
+
+    def iniciar_final(self):
+        self.final = subprocess.Popen([sys.executable, "-m", "uvicorn", "app.final_server:app",
+                                       "--port", "8000", "--log-level", "warning"],
+                                      cwd=FINAL_SERVER_DIR, env=self.env)
+        esperar_puerto(8000)
+
+    def iniciar_intermedio(self):
+        comando = [sys.executable, "intermediate_server.py", "--modo", self.args.modo,
+                   "--workers", str(self.args.workers), "--sin-spool", "--log-level", "WARNING"]
+        if self.args.claves:
+            comando += ["--claves", os.path.abspath(self.args.claves)]
+        self.intermedio = subprocess.Popen(comando, cwd=INTERMEDIATE_SERVER_DIR, env=self.env,
+                                           stdout=subprocess.DEVNULL)
+        esperar_puerto(8080)
+        esperar_puerto(9100)
+
+    @staticmethod
+    def _detener(proceso, senal):
+        if proceso is not None and proceso.poll() is None:
+            proceso.send_signal(senal)
+            try:
+                proceso.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                proceso.kill()
+                proceso.wait()
+
+    def detener_intermedio(self):
+        #SIGINT para que entregue las lecturas que tiene en cola antes de salir.
+        self._detener(self.intermedio, signal.SIGINT)
+        self.intermedio = None
+
+    def detener_final(self):
+        self._detener(self.final, signal.SIGTERM)
+        self.final = None
+
+    def detener(self):
+        self.detener_intermedio()
+        self.detener_final()
+
+
+#Envía paquetes de un sensor reservado y mide cuánto tardan en aparecer en /readings/.
+class Sonda:
+
+    def __init__(self, claves):
+        self.contexto = claves(SENSOR_SONDA)
+        self.latencias_ms = []
+        self.enviados = 0
+        self.perdidas = 0
+        self._detener = threading.Event()
+        self._ultimo_ts = 0
+
+    def _ultima_lectura_ms(self, sesion):
+        respuesta = sesion.get(f"{FINAL_SERVER_URL}/readings/",
+                               params={"sensor_id": SENSOR_SONDA, "limit": 1}, timeout=5)
+        lecturas = respuesta.json()
+        if not lecturas:
+            return 0
+        ts = datetime.fromisoformat(lecturas[0]["timestamp"].replace("Z", "+00:00"))
+        if ts.tzinfo is None:
+            ts = ts.replace(tzinfo=timezone.utc)
+        return round(ts.timestamp() * 1000)
+
+    def _ejecutar(self):
+        sesion = requests.Session()
+        sock = socket.create_connection((load_generator.SERVER_HOST, load_generator.SERVER_PORT))
+        try:
+            while not self._detener.wait(1 / SONDA_TASA):
+                ts = max(int(time.time() * 1000), self._ultimo_ts + 1)
+                self._ultimo_ts = ts
+                inicio = time.perf_counter()
+                sock.sendall(load_generator.construir_paquete(self.contexto, SENSOR_SONDA, ts, 20.0, 1013.0, 50.0))
+                self.enviados += 1
+                #Se consulta hasta que la lectura sea visible (máximo 10 s).
+                while self._ultima_lectura_ms(sesion) < ts:
+                    if time.perf_counter() - inicio > 10:
+                        self.perdidas += 1
+                        break
+                    time.sleep(0.002)
+                else:
+                    self.latencias_ms.append((time.perf_counter() - inicio) * 1000)
+        finally:
+            sock.close()
+
+    def iniciar(self):
+        self.hilo = threading.Thread(target=self._ejecutar, daemon=True)
+        self.hilo.start()
+
+    def detener(self):
+        self._detener.set()
+        self.hilo.join()
+
+
+def medir_ingesta(args, claves):
+    if args.captura:
+        #Tráfico real capturado con intermediate_server.py --captura en lugar de la carga sintética.
+        generador = replay.Reproduccion(replay.cargar([args.captura]), velocidad=args.velocidad)
+        carga = generador.ejecutar()
+    else:
+        generador = load_generator.GeneradorCarga(sensores=args.sensores, tasa=args.tasa, modo=args.conexion,
+                                                  sensores_por_conexion=args.sensores_por_conexion,
+                                                  claves=claves, invalidas=args.invalidas, protocolo=args.protocolo,
+                                                  registros_por_frame=args.registros_por_frame)
+        carga = generador.ejecutar(args.duracion)
+    guardadas_antes = leer_metrica(f"{FINAL_SERVER_URL}/metrics", "final_readings_inserted_total")
+    sonda = Sonda(claves)
+    sonda.iniciar()
+    inicio = time.perf_counter()
+    resumen = asyncio.run(carga)
+    sonda.detener()
+
+    #Se espera a que el servidor final termine de guardar lo que quedó en cola.
+    #Los aceptados se releen: una captura reproducida a máxima velocidad termina antes
+    #de que el servidor intermedio procese todo lo que quedó en sus sockets.
+    guardadas, fin = 0.0, time.perf_counter()
+    limite = time.monotonic() + 60
+    while time.monotonic() < limite:
+        aceptados = leer_metrica(INTERMEDIATE_METRICS_URL, "intermediate_packets_accepted_total")
+        actuales = leer_metrica(f"{FINAL_SERVER_URL}/metrics", "final_readings_inserted_total") - guardadas_antes
+        if actuales != guardadas:
+            guardadas, fin = actuales, time.perf_counter()
+        elif actuales >= aceptados:
+            break
+        time.sleep(1)
+
+    print(f"[INGESTA] {resumen['enviados']} enviados, {aceptados:.0f} aceptados, {guardadas:.0f} guardados")
+    return {"ingesta_enviados_pps": resumen["lecturas_por_segundo"],
+            "ingesta_aceptados_pps": aceptados / resumen["segundos"],
+            "ingesta_guardados_pps": guardadas / (fin - inicio),
+            "ingesta_latencia_p50_ms": percentil(sonda.latencias_ms, 0.50),
+            "ingesta_latencia_p95_ms": percentil(sonda.latencias_ms, 0.95),
+            "ingesta_latencia_p99_ms": percentil(sonda.latencias_ms, 0.99),
+            "ingesta_perdidas": resumen["enviados"] + sonda.enviados - guardadas,
+            "ingesta_sonda_perdidas": sonda.perdidas}
+
+
+#Completa la base de datos hasta `filas` lecturas, escribiendo directo en las particiones.
+def poblar(filas):
+    sys.path.insert(0, FINAL_SERVER_DIR)
+    from app import migrations, models, partitions
+    from app.database import SessionLocal, engine
+    import populate_dummy_data
+
+    migrations.init_db(engine)
+    with SessionLocal() as db:
+        actuales = db.query(models.SensorReadings).count()
+        faltan = filas - actuales
+        if faltan <= 0:
+            return
+        print(f"[CONSULTAS] Cargando {faltan} lecturas...")
+        if populate_dummy_data.np is not None:
+            #Con NumPy se usa el generador masivo: el intervalo se elige para sumar ~faltan lecturas.
+            intervalo = max(1, DIAS_CONSULTA * 86400 * SENSORES_CONSULTA // faltan)
+            populate_dummy_data.generate_history(num_sensors=SENSORES_CONSULTA, days=DIAS_CONSULTA,
+                                                 interval_s=intervalo, append=True, seed=filas)
+            return
+        r = random.Random(filas)
+        inicio = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=DIAS_CONSULTA)
+        paso = timedelta(days=DIAS_CONSULTA) / faltan
+        for desde in range(0, faltan, FILAS_POR_TRANSACCION):
+            lote = [{"sensor_id": i % SENSORES_CONSULTA + 1,
+                     "timestamp": inicio + paso * i,
+                     "temperature": r.uniform(15.0, 45.0),
+                     "pressure": r.uniform(1000.0, 1035.0),
+                     "humidity": r.uniform(40.0, 85.0)}
+                    for i in range(desde, min(desde + FILAS_POR_TRANSACCION, faltan))]
+            partitions.insert_rows(db, lote)
+            db.commit()
+
+
+#Consultas medidas: (nombre, ruta, parámetros, repeticiones).
+#Cada repetición mueve end_date unos segundos para no responder desde el cache de consultas.
+def consultas(repeticiones):
+    ahora = datetime.now(timezone.utc).replace(tzinfo=None)
+    futuro = ahora + timedelta(days=1)
+    return [("readings_ultimas", "/readings/", {"limit": 100, "end_date": futuro}, repeticiones),
+            ("readings_sensor_dia", "/readings/",
+             {"sensor_id": 7, "start_date": ahora - timedelta(days=1), "end_date": futuro, "limit": 1000}, repeticiones),
+            ("stats_todo", "/readings/stats/", {"end_date": futuro}, repeticiones),
+            ("stats_sensor_semana", "/readings/stats/",
+             {"sensor_id": 7, "start_date": ahora - timedelta(days=7), "end_date": futuro}, repeticiones),
+            ("export_semana", "/readings/export",
+             {"format": "ndjson", "start_date": ahora - timedelta(days=7), "end_date": futuro}, REPETICIONES_EXPORT)]
+
+
+def medir_consultas(filas, repeticiones):
+    sesion = requests.Session()
+    resultados = {}
+    for nombre, ruta, parametros, veces in consultas(repeticiones):
+        latencias = []
+        #La primera vuelta calienta las cachés del sistema y no se cuenta.
+        for i in range(veces + 1):
+            params = dict(parametros, end_date=(parametros["end_date"] + timedelta(seconds=i)).isoformat())
+            inicio = time.perf_counter()
+            with sesion.get(f"{FINAL_SERVER_URL}{ruta}", params=params, stream=True, timeout=600) as respuesta:
+                respuesta.raise_for_status()
+                for _ in respuesta.iter_content(64 * 1024):
+                    pass
+            if i:
+                latencias.append((time.perf_counter() - inicio) * 1000)
+        etiqueta = etiqueta_filas(filas)
+        resultados[f"consulta_{etiqueta}_{nombre}_p50_ms"] = percentil(latencias, 0.50)
+        resultados[f"consulta_{etiqueta}_{nombre}_p95_ms"] = percentil(latencias, 0.95)
+        print(f"[CONSULTAS] {etiqueta} {nombre}: p50 {resultados[f'consulta_{etiqueta}_{nombre}_p50_ms']:.1f} ms")
+    return resultados
+
+
+#Compara con la línea base. Las métricas *_pps empeoran si bajan y las *_ms si suben;
+#`holgura_ms` evita marcar como regresión variaciones mínimas de consultas muy rápidas.
+def comparar(metricas, base, tolerancia, holgura_ms):
+    regresiones = []
+    for nombre, valor_base in base.items():
+        valor = metricas.get(nombre)
+        if valor is None or valor_base is None:
+            continue
+        if nombre.endswith("_pps") and valor < valor_base * (1 - tolerancia):
+            regresiones.append((nombre, valor_base, valor))
+        elif nombre.endswith("_ms") and valor > valor_base * (1 + tolerancia) + holgura_ms:
+            regresiones.append((nombre, valor_base, valor))
+    return regresiones
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de ingesta y consultas de punta a punta")
+    parser.add_argument("--sensores", type=int, default=1000)
+    parser.add_argument("--tasa", type=float, default=1.0, help="Paquetes por segundo de cada sensor")
+    parser.add_argument("--duracion", type=float, default=30.0, help="Segundos de la fase de ingesta")
+    parser.add_argument("--conexion", choices=load_generator.MODOS_CONEXION, default="persistente")
+    parser.add_argument("--sensores-por-conexion", type=int, default=1)
+    parser.add_argument("--protocolo", choices=load_generator.PROTOCOLOS, default="v1")
+    parser.add_argument("--registros-por-frame", type=int, default=32, help="Lecturas por frame v2")
+    parser.add_argument("--claves", help="Archivo JSON de claves por sensor (lo usan el generador y el servidor)")
+    parser.add_argument("--invalidas", type=float, default=0.0, help="Fracción de paquetes con firma inválida")
+    parser.add_argument("--captura", help="Reproducir esta captura (archivo o directorio) en lugar de la carga sintética")
+    parser.add_argument("--velocidad", type=float, default=1.0,
+                        help="Velocidad de reproducción de --captura (0 = lo más rápido posible)")
+    parser.add_argument("--modo", choices=["hilos", "async"], default="async", help="Modo del servidor intermedio")
+    parser.add_argument("--workers", type=int, default=1, help="Workers del servidor intermedio")
+    parser.add_argument("--filas", default="1000000,10000000",
+                        help="Tamaños de la base de datos (lecturas) para medir consultas, separados por coma")
+    parser.add_argument("--repeticiones", type=int, default=10, help="Repeticiones de cada consulta")
+    parser.add_argument("--sin-ingesta", action="store_true", help="Solo medir consultas")
+    parser.add_argument("--salida", help="Archivo JSON donde guardar los resultados")
+    parser.add_argument("--baseline", help="Línea base JSON: el benchmark falla si alguna métrica empeora")
+    parser.add_argument("--guardar-baseline", help="Guarda los resultados como nueva línea base")
+    parser.add_argument("--tolerancia", type=float, default=0.20, help="Empeoramiento relativo permitido")
+    parser.add_argument("--holgura-ms", type=float, default=2.0, help="Margen absoluto para latencias")
+    parser.add_argument("--db", help="Base de datos a usar (por defecto una temporal que se borra al terminar)")
+    args = parser.parse_args()
+
+    tamanos = sorted(int(valor) for valor in args.filas.split(",") if valor)
+    directorio = None if args.db else tempfile.TemporaryDirectory(prefix="bench_")
+    db_path = os.path.abspath(args.db) if args.db else os.path.join(directorio.name, "bench.db")
+    os.environ["DATABASE_PATH"] = db_path
+
+    claves = load_generator.cargar_claves(args.claves)
+    servidores = Servidores(db_path, args)
+    metricas = {}
+    try:
+        if not args.sin_ingesta:
+            servidores.iniciar_final()
+            servidores.iniciar_intermedio()
+            metricas.update(medir_ingesta(args, claves))
+            servidores.detener()
+
+        for filas in tamanos:
+            poblar(filas)
+            #Se reinicia el servidor final para empezar cada tamaño con el cache de consultas vacío.
+            servidores.iniciar_final()
+            metricas.update(medir_consultas(filas, args.repeticiones))
+            servidores.detener_final()
+    finally:
+        servidores.detener()
+        if directorio is not None:
+            directorio.cleanup()
+
+    resultados = {"fecha": datetime.now(timezone.utc).isoformat(),
+                  "entorno": {"python": platform.python_version(),
+                              "plataforma": platform.platform(),
+                              "cpus": os.cpu_count()},
+                  "config": {nombre: valor for nombre, valor in vars(args).items()
+                             if nombre not in ("salida", "baseline", "guardar_baseline")},
+                  "metricas": metricas}
+    texto = json.dumps(resultados, indent=2, default=str)
+    print(texto)
+    for archivo in (args.salida, args.guardar_baseline):
+        if archivo:
+            with open(archivo, "w", encoding="utf-8") as f:
+                f.write(texto)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            base = json.load(f)["metricas"]
+        regresiones = comparar(metricas, base, args.tolerancia, args.holgura_ms)
+        for nombre, antes, ahora in regresiones:
+            print(f"REGRESIÓN {nombre}: {antes:.2f} -> {ahora:.2f}")
+        if regresiones:
+            sys.exit(1)
+        print(f"Sin regresiones respecto de {args.baseline} (tolerancia {args.tolerancia:.0%})")
+
+
+if __name__ == "__main__":
+    main()
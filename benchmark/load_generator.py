@@ -0,0 +1,247 @@
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import random
+import struct
+import time
+
+#Generador de carga sintética para el servidor intermedio.
+#Simula miles de sensores que envían lecturas firmadas a una tasa configurable, como
+#paquetes v1 (SensorPacket de 54 bytes, igual que client_sensor/main.cpp) o frames v2.
+
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 8080
+
+#Clave compartida por defecto (la misma que el cliente C++ y el servidor intermedio).
+HMAC_KEY = "clave_secreta_1111"
+
+#Campos del paquete sin la firma: sensor_id, timestamp_ms, temperatura, presión, humedad.
+CAMPOS = struct.Struct('<hQfff')
+
+#Frame v2 (ver intermediate_server.py): cabecera, registros y una firma para todo el frame.
+MAGIC_V2 = b"\xa5\xfa"
+VERSION_V2 = 2
+CABECERA_V2 = struct.Struct('<2sBhH')
+REGISTRO_V2 = struct.Struct('<Qfff')
+
+PROTOCOLOS = ("v1", "v2")
+
+#Máximo de paquetes que una conexión arma y escribe de una vez.
+LOTE_MAX = 256
+
+#Modos de conexión:
+# persistente: cada conexión queda abierta y envía paquetes seguidos (como los sensores reales).
+# por-paquete: una conexión nueva por paquete, como hace client_sensor/main.cpp.
+MODOS_CONEXION = ("persistente", "por-paquete")
+
+
+#Crea el estado HMAC-SHA256 ya inicializado con la clave (igual que key_registry).
+def _contexto(clave):
+    return hmac.new(clave.encode(), digestmod=hashlib.sha256)
+
+
+#Devuelve una función sensor_id -> contexto HMAC.
+#`archivo` tiene el formato de intermediate_server/sensor_keys.json; de cada sensor se usa
+#la primera clave (la nueva, si está rotando). Sin archivo todos usan `clave`.
+def cargar_claves(archivo=None, clave=HMAC_KEY):
+    por_sensor = {}
+    por_defecto = _contexto(clave)
+    if archivo:
+        with open(archivo, encoding="utf-8") as f:
+            config = json.load(f)
+        for sensor_id, claves in config.get("sensors", {}).items():
+            claves = [claves] if isinstance(claves, str) else claves
+            por_sensor[int(sensor_id)] = _contexto(claves[0])
+        default = config.get("default")
+        if default:
+            por_defecto = _contexto(default if isinstance(default, str) else default[0])
+    return lambda sensor_id: por_sensor.get(sensor_id, por_defecto)
+
+
+#Arma un paquete completo (campos + firma HMAC-SHA256 de los campos).
+def construir_paquete(contexto, sensor_id, timestamp_ms, temperature, pressure, humidity):
+    campos = CAMPOS.pack(sensor_id, timestamp_ms, temperature, pressure, humidity)
+    h = contexto.copy()
+    h.update(campos)
+    return campos + h.digest()
+
+
+#Arma un frame v2 con las lecturas (timestamp_ms, temperatura, presión, humedad) de un sensor.
+def construir_frame_v2(contexto, sensor_id, lecturas):
+    frame = bytearray(CABECERA_V2.pack(MAGIC_V2, VERSION_V2, sensor_id, len(lecturas)))
+    for lectura in lecturas:
+        frame += REGISTRO_V2.pack(*lectura)
+    h = contexto.copy()
+    h.update(frame)
+    return bytes(frame + h.digest())
+
+
+class GeneradorCarga:
+
+    def __init__(self, sensores=1000, primer_sensor=1, tasa=1.0, modo="persistente",
+                 sensores_por_conexion=1, claves=None, invalidas=0.0,
+                 protocolo="v1", registros_por_frame=32,
+                 host=SERVER_HOST, port=SERVER_PORT):
+        self.sensores = list(range(primer_sensor, primer_sensor + sensores))
+        if self.sensores[-1] > 32767:
+            raise ValueError("sensor_id es int16: el último sensor no puede superar 32767")
+        #Paquetes por segundo de cada sensor (0 = lo más rápido posible).
+        self.tasa = tasa
+        self.modo = modo
+        self.sensores_por_conexion = max(1, sensores_por_conexion)
+        self.claves = claves or cargar_claves()
+        #Fracción de paquetes firmados con una clave incorrecta (deben rechazarse).
+        self.invalidas = invalidas
+        self._clave_invalida = _contexto("clave_invalida")
+        #En v2 cada sensor acumula lecturas y envía un frame al juntar registros_por_frame.
+        self.protocolo = protocolo
+        self.registros_por_frame = registros_por_frame
+        self._pendientes = {}
+        self.host = host
+        self.port = port
+        #El servidor rechaza timestamps repetidos, así que se lleva el último de cada sensor.
+        self._ultimo_ts = {}
+        self._random = random.Random(0)
+        #Estadísticas
+        self.enviados = 0
+        self.errores = 0
+
+    def _contexto_firma(self, sensor_id):
+        if self.invalidas and self._random.random() < self.invalidas:
+            return self._clave_invalida
+        return self.claves(sensor_id)
+
+    #Lectura aleatoria de un sensor, con timestamp estrictamente creciente.
+    def lectura(self, sensor_id):
+        ts = max(int(time.time() * 1000), self._ultimo_ts.get(sensor_id, 0) + 1)
+        self._ultimo_ts[sensor_id] = ts
+        r = self._random
+        return ts, r.uniform(15.0, 45.0), r.uniform(1000.0, 1035.0), r.uniform(40.0, 85.0)
+
+    #Bytes a enviar por una lectura nueva del sensor: un paquete v1, o en v2 un frame
+    #cuando el sensor completa registros_por_frame lecturas (si no, b"").
+    def paquete(self, sensor_id):
+        if self.protocolo == "v1":
+            return construir_paquete(self._contexto_firma(sensor_id), sensor_id, *self.lectura(sensor_id))
+        pendientes = self._pendientes.setdefault(sensor_id, [])
+        pendientes.append(self.lectura(sensor_id))
+        if len(pendientes) < self.registros_por_frame:
+            return b""
+        del self._pendientes[sensor_id]
+        return construir_frame_v2(self._contexto_firma(sensor_id), sensor_id, pendientes)
+
+    #Envía los paquetes de un grupo de sensores por una conexión hasta `fin`.
+    async def _conexion(self, sensores, fin):
+        loop = asyncio.get_running_loop()
+        tasa_grupo = self.tasa * len(sensores)
+        inicio = loop.time()
+        enviados = 0
+        writer = None
+
+        while loop.time() < fin:
+            if tasa_grupo:
+                #Paquetes que ya deberían haberse enviado según la tasa (sin acumular deriva).
+                pendientes = int((loop.time() - inicio) * tasa_grupo) - enviados
+                if pendientes <= 0:
+                    await asyncio.sleep(min(1 / tasa_grupo, max(fin - loop.time(), 0)))
+                    continue
+                pendientes = min(pendientes, LOTE_MAX)
+            else:
+                pendientes = LOTE_MAX
+
+            paquetes = [self.paquete(sensores[(enviados + i) % len(sensores)]) for i in range(pendientes)]
+            paquetes = [paquete for paquete in paquetes if paquete]
+            #Lecturas incluidas en lo que se envía (en v2 las que aún esperan su frame no cuentan).
+            lecturas = len(paquetes) * (self.registros_por_frame if self.protocolo == "v2" else 1)
+            try:
+                if self.modo == "persistente":
+                    if writer is None:
+                        _, writer = await asyncio.open_connection(self.host, self.port)
+                    writer.write(b"".join(paquetes))
+                    #drain() espera si el servidor no alcanza a leer (contrapresión de TCP).
+                    await writer.drain()
+                else:
+                    for paquete in paquetes:
+                        _, w = await asyncio.open_connection(self.host, self.port)
+                        w.write(paquete)
+                        await w.drain()
+                        w.close()
+                        await w.wait_closed()
+            except OSError:
+                self.errores += lecturas
+                writer = None
+                await asyncio.sleep(0.1)
+            else:
+                self.enviados += lecturas
+            enviados += pendientes
+
+        if writer is not None:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+    async def _progreso(self, fin, cada=1.0):
+        anterior = 0
+        while time.monotonic() < fin:
+            await asyncio.sleep(cada)
+            print(f"[CARGA] {self.enviados - anterior:.0f} lecturas/s, {self.enviados} enviadas, {self.errores} errores")
+            anterior = self.enviados
+
+    #Corre la carga durante `duracion` segundos y devuelve un resumen.
+    async def ejecutar(self, duracion, progreso=True):
+        loop = asyncio.get_running_loop()
+        fin = loop.time() + duracion
+        grupos = [self.sensores[i:i + self.sensores_por_conexion]
+                  for i in range(0, len(self.sensores), self.sensores_por_conexion)]
+        inicio = time.perf_counter()
+        tareas = [self._conexion(grupo, fin) for grupo in grupos]
+        if progreso:
+            tareas.append(self._progreso(time.monotonic() + duracion))
+        await asyncio.gather(*tareas)
+        segundos = time.perf_counter() - inicio
+        return {"sensores": len(self.sensores),
+                "conexiones": len(grupos),
+                "modo": self.modo,
+                "protocolo": self.protocolo,
+                "enviados": self.enviados,
+                "errores": self.errores,
+                "segundos": segundos,
+                "lecturas_por_segundo": self.enviados / segundos if segundos else 0.0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generador de carga de sensores para el servidor intermedio")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--puerto", type=int, default=SERVER_PORT)
+    parser.add_argument("--sensores", type=int, default=1000, help="Cantidad de sensores simulados")
+    parser.add_argument("--primer-sensor", type=int, default=1, help="sensor_id del primer sensor")
+    parser.add_argument("--tasa", type=float, default=1.0,
+                        help="Paquetes por segundo de cada sensor (0 = lo más rápido posible)")
+    parser.add_argument("--duracion", type=float, default=30.0, help="Segundos de carga")
+    parser.add_argument("--conexion", choices=MODOS_CONEXION, default="persistente")
+    parser.add_argument("--sensores-por-conexion", type=int, default=1,
+                        help="Sensores que comparten cada conexión persistente")
+    parser.add_argument("--protocolo", choices=PROTOCOLOS, default="v1",
+                        help="v1: un paquete por lectura; v2: frames con varias lecturas y una firma")
+    parser.add_argument("--registros-por-frame", type=int, default=32, help="Lecturas por frame v2 (máximo 1024)")
+    parser.add_argument("--claves", help="Archivo JSON de claves por sensor (formato de sensor_keys.json)")
+    parser.add_argument("--clave", default=HMAC_KEY, help="Clave para los sensores sin clave propia")
+    parser.add_argument("--invalidas", type=float, default=0.0,
+                        help="Fracción de paquetes con firma inválida (0 a 1)")
+    args = parser.parse_args()
+
+    generador = GeneradorCarga(sensores=args.sensores, primer_sensor=args.primer_sensor, tasa=args.tasa,
+                               modo=args.conexion, sensores_por_conexion=args.sensores_por_conexion,
+                               claves=cargar_claves(args.claves, args.clave), invalidas=args.invalidas,
+                               protocolo=args.protocolo, registros_por_frame=args.registros_por_frame,
+                               host=args.host, port=args.puerto)
+    resumen = asyncio.run(generador.ejecutar(args.duracion))
+    print(json.dumps(resumen, indent=2))
+
+
+if __name__ == "__main__":
+    main()
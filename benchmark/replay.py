@@ -0,0 +1,240 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+import load_generator
+
+#Reproduce capturas del servidor intermedio (intermediate_server.py --captura) contra un
+#servidor intermedio: cada conexión capturada se abre de nuevo y envía los mismos bytes con
+#los mismos intervalos, a la velocidad original, N veces más rápido o lo más rápido posible.
+#Así se conservan los patrones reales de conexión de cada sensor (persistente, una por
+#paquete, varios sensores por conexión) y las ráfagas, para comparar versiones del servidor.
+#Las firmas se envían tal como llegaron: el servidor debe usar las mismas claves y empezar con
+#la ventana anti-repetición vacía (recién iniciado), si no rechaza los paquetes como repetidos.
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "intermediate_server"))
+import capture
+
+#Conexiones reproducidas a la vez como máximo. Las siguientes esperan (y se registran como atrasadas).
+MAX_CONEXIONES = 1000
+
+
+#Conexión capturada: peer original, horas de apertura y cierre (ns) y frames (hora, bytes).
+class ConexionCapturada:
+    __slots__ = ("peer", "apertura", "cierre", "frames")
+
+    def __init__(self, apertura):
+        self.peer = None
+        self.apertura = apertura
+        self.cierre = None
+        self.frames = []
+
+
+#Lecturas y sensor de un frame capturado (v1 o v2); (0, None) si está incompleto o no es válido.
+def contenido(frame):
+    if frame[:2] == load_generator.MAGIC_V2:
+        if len(frame) < load_generator.CABECERA_V2.size:
+            return 0, None
+        _, _, sensor_id, cantidad = load_generator.CABECERA_V2.unpack_from(frame)
+        completo = len(frame) == load_generator.CABECERA_V2.size + cantidad * load_generator.REGISTRO_V2.size + 32
+        return (cantidad, sensor_id) if completo else (0, None)
+    if len(frame) < load_generator.CAMPOS.size + 32:
+        return 0, None
+    return 1, load_generator.CAMPOS.unpack_from(frame)[0]
+
+
+#Lee las capturas de `rutas` (archivos o directorios) y devuelve sus conexiones ordenadas por apertura.
+def cargar(rutas):
+    conexiones = {}
+    for archivo in capture.archivos_captura(rutas):
+        for llegada, clave, tipo, datos in capture.leer_captura(archivo):
+            conexion = conexiones.get(clave)
+            if conexion is None:
+                #Si el archivo con la apertura se borró por el límite de disco, empieza en su primer registro.
+                conexion = conexiones[clave] = ConexionCapturada(llegada)
+            if tipo == capture.CONEXION:
+                conexion.peer = bytes(datos).decode()
+                conexion.apertura = llegada
+            elif tipo == capture.DATOS:
+                conexion.frames.append((llegada, datos))
+            elif tipo == capture.CIERRE:
+                conexion.cierre = llegada
+    for conexion in conexiones.values():
+        #Las que seguían abiertas al terminar la captura se cierran tras su último frame.
+        if conexion.cierre is None:
+            conexion.cierre = conexion.frames[-1][0] if conexion.frames else conexion.apertura
+    return sorted(conexiones.values(), key=lambda conexion: conexion.apertura)
+
+
+#Resumen de una captura sin enviarla.
+def describir(conexiones):
+    frames = [datos for conexion in conexiones for _, datos in conexion.frames]
+    lecturas = 0
+    sensores = set()
+    for frame in frames:
+        cantidad, sensor_id = contenido(frame)
+        lecturas += cantidad
+        if sensor_id is not None:
+            sensores.add(sensor_id)
+    resumen = {"conexiones": len(conexiones),
+               "peers": len({conexion.peer.rsplit(":", 1)[0] for conexion in conexiones if conexion.peer}),
+               "sensores": len(sensores),
+               "frames": len(frames),
+               "lecturas": lecturas,
+               "bytes": sum(len(frame) for frame in frames)}
+    if conexiones:
+        inicio = conexiones[0].apertura
+        fin = max(conexion.cierre for conexion in conexiones)
+        resumen["desde"] = datetime.fromtimestamp(inicio / 1e9, tz=timezone.utc).isoformat()
+        resumen["hasta"] = datetime.fromtimestamp(fin / 1e9, tz=timezone.utc).isoformat()
+        resumen["duracion_s"] = (fin - inicio) / 1e9
+    return resumen
+
+
+class Reproduccion:
+
+    def __init__(self, conexiones, velocidad=1.0, max_conexiones=MAX_CONEXIONES,
+                 host=load_generator.SERVER_HOST, port=load_generator.SERVER_PORT):
+        self.conexiones = conexiones
+        #Factor de velocidad respecto de la captura (0 = lo más rápido posible).
+        self.velocidad = velocidad
+        self.max_conexiones = max_conexiones
+        self.host = host
+        self.port = port
+        self._origen = conexiones[0].apertura if conexiones else 0
+        self._t0 = 0.0
+        #Estadísticas
+        self.enviados = 0
+        self.errores = 0
+        self.frames = 0
+        self.bytes = 0
+        #Atraso (s) de cada escritura respecto de la hora que le corresponde según la captura.
+        #Crece si el servidor no alcanza a leer y TCP frena los envíos.
+        self.atrasos = []
+
+    #Hora del loop en que corresponde reproducir un evento capturado en `llegada` (ns).
+    def _hora(self, llegada):
+        if not self.velocidad:
+            return self._t0
+        return self._t0 + (llegada - self._origen) / 1e9 / self.velocidad
+
+    async def _esperar(self, llegada):
+        espera = self._hora(llegada) - asyncio.get_running_loop().time()
+        if espera > 0:
+            await asyncio.sleep(espera)
+
+    #Reproduce una conexión: abre, envía cada frame a su hora y cierra a la hora capturada.
+    async def _conexion(self, conexion, semaforo):
+        loop = asyncio.get_running_loop()
+        frames = conexion.frames
+        writer = None
+        i = 0
+        try:
+            _, writer = await asyncio.open_connection(self.host, self.port)
+            while i < len(frames):
+                await self._esperar(frames[i][0])
+                #Los frames que ya deberían haberse enviado salen juntos en una sola escritura.
+                ahora = loop.time()
+                j = i + 1
+                while j < len(frames) and self._hora(frames[j][0]) <= ahora:
+                    j += 1
+                lote = [datos for _, datos in frames[i:j]]
+                if self.velocidad:
+                    self.atrasos.append(ahora - self._hora(frames[i][0]))
+                writer.write(b"".join(lote))
+                #drain() espera si el servidor no alcanza a leer (contrapresión de TCP).
+                await writer.drain()
+                self.enviados += sum(contenido(frame)[0] for frame in lote)
+                self.frames += len(lote)
+                self.bytes += sum(len(frame) for frame in lote)
+                i = j
+            await self._esperar(conexion.cierre)
+        except OSError:
+            self.errores += sum(contenido(datos)[0] for _, datos in frames[i:])
+        finally:
+            if writer is not None:
+                writer.close()
+                try:
+                    await writer.wait_closed()
+                except OSError:
+                    pass
+            semaforo.release()
+
+    async def _progreso(self, terminado, cada=1.0):
+        anterior = 0
+        while not terminado.is_set():
+            try:
+                await asyncio.wait_for(terminado.wait(), cada)
+            except asyncio.TimeoutError:
+                print(f"[REPLAY] {self.enviados - anterior:.0f} lecturas/s, {self.enviados} enviadas, "
+                      f"{self.errores} errores")
+                anterior = self.enviados
+
+    #Reproduce toda la captura y devuelve un resumen (mismas claves que GeneradorCarga.ejecutar).
+    async def ejecutar(self, progreso=True):
+        loop = asyncio.get_running_loop()
+        self._t0 = loop.time()
+        semaforo = asyncio.Semaphore(self.max_conexiones)
+        terminado = asyncio.Event()
+        monitor = asyncio.create_task(self._progreso(terminado)) if progreso else None
+        tareas = set()
+        inicio = time.perf_counter()
+        #Las conexiones se abren en el orden capturado; con el semáforo no hay más de max_conexiones a la vez.
+        for conexion in self.conexiones:
+            await self._esperar(conexion.apertura)
+            await semaforo.acquire()
+            tarea = asyncio.create_task(self._conexion(conexion, semaforo))
+            tareas.add(tarea)
+            tarea.add_done_callback(tareas.discard)
+        await asyncio.gather(*tareas)
+        segundos = time.perf_counter() - inicio
+        terminado.set()
+        if monitor is not None:
+            await monitor
+
+        atrasos = sorted(self.atrasos)
+        resumen = {"conexiones": len(self.conexiones),
+                   "velocidad": self.velocidad or "max",
+                   "frames": self.frames,
+                   "bytes": self.bytes,
+                   "enviados": self.enviados,
+                   "errores": self.errores,
+                   "segundos": segundos,
+                   "lecturas_por_segundo": self.enviados / segundos if segundos else 0.0}
+        if atrasos:
+            for nombre, q in (("p50", 0.50), ("p99", 0.99)):
+                resumen[f"atraso_{nombre}_ms"] = atrasos[min(len(atrasos) - 1, int(q * len(atrasos)))] * 1000
+            resumen["atraso_max_ms"] = atrasos[-1] * 1000
+        return resumen
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reproduce capturas de tráfico contra el servidor intermedio")
+    parser.add_argument("capturas", nargs="+",
+                        help="Archivos .cap o directorios de captura (p. ej. intermediate_server/capturas)")
+    parser.add_argument("--host", default=load_generator.SERVER_HOST)
+    parser.add_argument("--puerto", type=int, default=load_generator.SERVER_PORT)
+    parser.add_argument("--velocidad", type=float, default=1.0,
+                        help="Factor de velocidad respecto de la captura (0 = lo más rápido posible)")
+    parser.add_argument("--max-conexiones", type=int, default=MAX_CONEXIONES,
+                        help="Conexiones abiertas a la vez como máximo")
+    parser.add_argument("--info", action="store_true", help="Solo mostrar el resumen de la captura")
+    args = parser.parse_args()
+
+    conexiones = cargar(args.capturas)
+    print(json.dumps(describir(conexiones), indent=2))
+    if args.info or not conexiones:
+        return
+    reproduccion = Reproduccion(conexiones, velocidad=args.velocidad, max_conexiones=args.max_conexiones,
+                                host=args.host, port=args.puerto)
+    resumen = asyncio.run(reproduccion.ejecutar())
+    print(json.dumps(resumen, indent=2))
+
+
+if __name__ == "__main__":
+    main()
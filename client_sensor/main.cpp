@@ -33,6 +33,31 @@ struct SensorPacket { //structura que representa un paquete de datos del sensor.
 };
 #pragma pack(pop) // Restaura la configuración de empaquetado original del compilador.
 
+/**
+ * @brief Protocolo v2: un frame agrupa varias lecturas del mismo sensor con una sola firma.
+ * Formato: FrameHeaderV2 + N x ReadingV2 + firma HMAC-SHA256 (32 bytes) de todo lo anterior.
+ * El servidor intermedio lo distingue de un SensorPacket por los dos bytes de `magic`.
+ */
+#pragma pack(push, 1)
+struct FrameHeaderV2 {
+    unsigned char magic[2];       // 2 bytes: 0xA5 0xFA
+    uint8_t version;              // 1 byte : versión del protocolo (2)
+    int16_t sensor_id;            // 2 bytes: Identificador del sensor
+    uint16_t count;               // 2 bytes: Cantidad de lecturas en el frame
+};
+
+struct ReadingV2 {
+    uint64_t timestamp_ms;        // 8 bytes
+    float temperature;            // 4 bytes
+    float pressure;               // 4 bytes
+    float humidity;               // 4 bytes
+};
+#pragma pack(pop)
+
+const unsigned char MAGIC_V2[2] = {0xA5, 0xFA};
+const uint8_t VERSION_V2 = 2;
+const int MAX_LECTURAS_V2 = 1024; // Máximo de lecturas por frame aceptado por el servidor
+
 //constantes de configuración del cliente sensor
 // Estas constantes definen la IP y el puerto del servidor intermedio, la clave HMAC
 // y el ID del sensor. Se usan para establecer la conexión y firmar los datos.
@@ -100,7 +125,95 @@ void calcular_hmac(const SensorPacket& packet, unsigned char* firma_resultante)
 }
 
 
-int main() {
+/**
+ * @brief Firma HMAC-SHA256 de un buffer completo (usada para los frames v2).
+ */
+void calcular_hmac_buffer(const unsigned char* datos, size_t largo, unsigned char* firma_resultante) {
+    unsigned int len_firma = 32;
+    HMAC(EVP_sha256(), HMAC_KEY.c_str(), HMAC_KEY.length(), datos, largo, firma_resultante, &len_firma);
+}
+
+/**
+ * @brief Arma un frame v2 con las lecturas acumuladas: cabecera, lecturas y firma al final.
+ */
+std::vector<unsigned char> construir_frame_v2(const std::vector<ReadingV2>& lecturas) {
+    FrameHeaderV2 header;
+    memcpy(header.magic, MAGIC_V2, sizeof(header.magic));
+    header.version = VERSION_V2;
+    header.sensor_id = SENSOR_ID;
+    header.count = static_cast<uint16_t>(lecturas.size());
+
+    size_t largo_datos = sizeof(header) + lecturas.size() * sizeof(ReadingV2);
+    std::vector<unsigned char> frame(largo_datos + 32);
+    memcpy(frame.data(), &header, sizeof(header));
+    memcpy(frame.data() + sizeof(header), lecturas.data(), lecturas.size() * sizeof(ReadingV2));
+    calcular_hmac_buffer(frame.data(), largo_datos, frame.data() + largo_datos);
+    return frame;
+}
+
+/**
+ * @brief Abre una conexión TCP con el servidor intermedio, envía los bytes y la cierra.
+ * @return true si se enviaron todos los bytes.
+ */
+bool enviar_al_servidor(const unsigned char* datos, size_t largo) {
+    // Creamos un descriptor de socket. AF_INET para IPv4, SOCK_STREAM para TCP.
+    int sock = socket(AF_INET, SOCK_STREAM, 0);
+    if (sock == -1) {
+        std::cerr << "Error: No se pudo crear el socket." << std::endl;
+        return false;
+    }
+
+    // Configuramos la estructura con la dirección del servidor.
+    sockaddr_in server_addr;
+    server_addr.sin_family = AF_INET; // Familia de direcciones IPv4
+    // Convertimos el puerto a "Network Byte Order" (Big Endian).
+    server_addr.sin_port = htons(SERVER_PORT);
+    // Convertimos la IP de texto a formato binario de red.
+    inet_pton(AF_INET, SERVER_IP, &server_addr.sin_addr);
+
+    if (connect(sock, (struct sockaddr*)&server_addr, sizeof(server_addr)) < 0) {
+        std::cerr << "Error: Fallo en la conexión al servidor." << std::endl;
+        closesocket(sock);
+        return false;
+    }
+
+    std::cout << "Conectado al servidor. Enviando " << largo << " bytes." << std::endl;
+
+    // send() puede enviar menos bytes de los pedidos (frames grandes): se repite hasta terminar.
+    size_t enviados = 0;
+    while (enviados < largo) {
+        ssize_t n = send(sock, (const char*)datos + enviados, largo - enviados, 0);
+        if (n <= 0) {
+            std::cerr << "Error: Fallo al enviar los datos." << std::endl;
+            closesocket(sock);
+            return false;
+        }
+        enviados += static_cast<size_t>(n);
+    }
+
+    // Cerramos la conexión después de enviar los datos.
+    closesocket(sock);
+    return true;
+}
+
+
+int main(int argc, char* argv[]) {
+    // --- 0. OPCIONES ---
+    // --lote N: acumula N lecturas y las envía juntas en un frame v2 (una sola firma y conexión).
+    // Sin la opción (o con N = 1) se envía un SensorPacket v1 por lectura, como siempre.
+    int lote = 1;
+    for (int i = 1; i < argc; i++) {
+        if (std::string(argv[i]) == "--lote" && i + 1 < argc) {
+            lote = std::stoi(argv[++i]);
+        }
+    }
+    if (lote < 1 || lote > MAX_LECTURAS_V2) {
+        std::cerr << "Error: --lote debe estar entre 1 y " << MAX_LECTURAS_V2 << std::endl;
+        return 1;
+    }
+    std::vector<ReadingV2> pendientes; // Lecturas acumuladas para el próximo frame v2
+    pendientes.reserve(lote);
+
     // --- 1. CONFIGURACIÓN DEL GENERADOR DE DATOS ALEATORIOS ---
     // Usamos el motor de generación Mersenne Twister, que es de alta calidad.
     std::random_device rd; // Dispositivo aleatorio para obtener una semilla única.
@@ -114,6 +227,9 @@ int main() {
     std::cout << "Cliente Sensor C++ iniciado" << std::endl;
     std::cout << "Intentando conectar a " << SERVER_IP << ":" << SERVER_PORT << std::endl;
     std::cout << "Enviando datos cada 5 segundos..." << std::endl;
+    if (lote > 1) {
+        std::cout << "Protocolo v2: frames de " << lote << " lecturas." << std::endl;
+    }
 
     // Este bucle se ejecuta indefinidamente, simulando un sensor que nunca se apaga.
     while (true) {
@@ -130,6 +246,22 @@ int main() {
         packet.pressure = static_cast<float>(press_dist(gen));
         packet.humidity = static_cast<float>(hum_dist(gen));
 
+        // --- 3b. PROTOCOLO v2: ACUMULAR Y ENVIAR EL FRAME AL COMPLETAR EL LOTE ---
+        if (lote > 1) {
+            pendientes.push_back({packet.timestamp_ms, packet.temperature, packet.pressure, packet.humidity});
+            std::cout << "Lectura " << pendientes.size() << "/" << lote << " acumulada." << std::endl;
+            if (static_cast<int>(pendientes.size()) == lote) {
+                std::vector<unsigned char> frame = construir_frame_v2(pendientes);
+                if (enviar_al_servidor(frame.data(), frame.size())) {
+                    std::cout << "Frame v2 enviado exitosamente (" << lote << " lecturas)." << std::endl;
+                }
+                // Si el envío falla el frame se descarta, igual que un paquete v1.
+                pendientes.clear();
+            }
+            std::this_thread::sleep_for(std::chrono::seconds(5));
+            continue;
+        }
+
         // --- 4. CALCULAR Y ASIGNAR LA FIRMA ---
         calcular_hmac(packet, packet.signature); // Calculamos la firma y la guardamos en `packet.signature`.
 
@@ -144,46 +276,11 @@ int main() {
 
 
         // --- 5. LÓGICA DE RED (CLIENTE TCP) ---
-        // Creamos un descriptor de socket. AF_INET para IPv4, SOCK_STREAM para TCP.
-        int sock = socket(AF_INET, SOCK_STREAM, 0); // Creamos el socket para la conexión TCP.
-        // Verificamos si el socket se creó correctamente.
-        if (sock == -1) { // Si el socket es -1, significa que hubo un error al crearlo.
-            std::cerr << "Error: No se pudo crear el socket." << std::endl;
-            std::this_thread::sleep_for(std::chrono::seconds(5)); // Esperar antes de reintentar
-            continue; // Saltar al siguiente ciclo del bucle
-        }
-
-        // Configuramos la estructura con la dirección del servidor.
-        sockaddr_in server_addr;
-        server_addr.sin_family = AF_INET; // Familia de direcciones IPv4
-        // Convertimos el puerto a "Network Byte Order" (Big Endian).
-        server_addr.sin_port = htons(SERVER_PORT);
-        // Convertimos la IP de texto a formato binario de red.
-        inet_pton(AF_INET, SERVER_IP, &server_addr.sin_addr);
-
-        // Intentamos establecer la conexión con el servidor.
-        // Si connect falla, cerramos el socket y esperamos 5 segundos antes de reintentar.
-        
-        if (connect(sock, (struct sockaddr*)&server_addr, sizeof(server_addr)) < 0) {
-            std::cerr << "Error: Fallo en la conexión al servidor." << std::endl;
-            closesocket(sock); // Cerramos el socket si la conexión falla.
-            std::this_thread::sleep_for(std::chrono::seconds(5)); // Esperamos antes de reintentar.
-            continue;
-        }
-        
-        std::cout << "Conectado al servidor. Enviando paquete de " << sizeof(packet) << " bytes." << std::endl;
-
-        // Enviamos la estructura completa como un flujo de bytes.
-        // Se envía la dirección de memoria de `packet` y su tamaño total.
-        if (send(sock, (const char*)&packet, sizeof(packet), 0) < 0) {
-            std::cerr << "Error: Fallo al enviar los datos." << std::endl;
-        } else {
+        // Se envía la estructura completa como un flujo de bytes, en una conexión nueva.
+        if (enviar_al_servidor((const unsigned char*)&packet, sizeof(packet))) {
             std::cout << "Paquete enviado exitosamente." << std::endl;
         }
 
-        // Cerramos la conexión después de enviar los datos.
-        closesocket(sock);
-
         // --- 6. ESPERAR ANTES DE LA PRÓXIMA LECTURA ---
         std::this_thread::sleep_for(std::chrono::seconds(5));
     }
@@ -0,0 +1,361 @@
+# Motor de reglas de alerta evaluado al guardar lecturas
+# Las reglas (tabla alert_rules) se evaluan en crud.create_readings_bulk, dentro de la
+# misma transaccion que inserta las lecturas, con estado O(1) por regla y sensor:
+#   range: la metrica sale de [min_value, max_value]
+#   rate:  la metrica cambia mas de max_rate unidades por segundo respecto de la lectura anterior
+#   stale: el sensor no envia lecturas por timeout_s segundos (se revisa cada ALERT_STALE_CHECK_S)
+# Con violations/window una regla se abre con N violaciones entre las ultimas M lecturas
+# (ventana de bits) y se cierra cuando las ultimas M la cumplen. Cada apertura y cierre
+# se guarda en la tabla alerts y se publica en GET /alerts/live.
+#
+# El estado vive en memoria del proceso y se reconstruye al iniciar desde las alertas
+# abiertas y sensor_state; con varios workers cada uno evalua las ventanas de las lecturas
+# que recibe. Lo que comparten va por la base de datos: un indice unico parcial deja una
+# sola alerta abierta por regla y sensor (un worker que llega tarde sigue la existente),
+# 'stale' mira la ultima lectura de sensor_state y las reglas se releen en cada revision.
+import json
+import os
+from datetime import datetime, timezone
+from itertools import chain
+from typing import Optional
+from sqlalchemy import select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+from . import live, metrics, models, schemas
+
+# Cada cuantos segundos se revisan las reglas 'stale'.
+ALERT_STALE_CHECK_S = float(os.getenv("ALERT_STALE_CHECK_S", 5))
+# Maximo de alertas devueltas por GET /alerts.
+ALERTS_MAX_LIMIT = 1000
+
+Rule = schemas.AlertRule
+
+
+class RuleState:
+    # Estado de una regla para un sensor: las ultimas `window` evaluaciones como
+    # bits (1 = violacion), cuantas de ellas son violaciones y la alerta abierta.
+    # Solo existe mientras haya violaciones en la ventana o una alerta abierta.
+    __slots__ = ("bits", "count", "alert")
+
+    def __init__(self, bits: int = 0, count: int = 0, alert: Optional[dict] = None):
+        self.bits = bits
+        self.count = count
+        self.alert = alert
+
+    def push(self, violated: bool, window: int):
+        # Entra la evaluacion nueva y sale la mas antigua, sin recorrer la ventana.
+        oldest = (self.bits >> (window - 1)) & 1
+        self.bits = ((self.bits << 1) | violated) & ((1 << window) - 1)
+        self.count += violated - oldest
+
+
+class Evaluation:
+    # Cambios de una evaluacion, sin aplicar al motor: copias del estado de las
+    # reglas tocadas (None = se borra), ultimas lecturas, hora de llegada y las
+    # aperturas y cierres escritos. Se aplican con RuleEngine.apply() tras el commit,
+    # asi un rollback (o el reintento de un lote) no deja ids ni ventanas a medias.
+    __slots__ = ("states", "latest", "last_seen", "events")
+
+    def __init__(self):
+        self.states: dict[tuple[int, int], Optional[RuleState]] = {}
+        self.latest: dict[int, tuple[datetime, dict]] = {}
+        self.last_seen: dict[int, datetime] = {}
+        self.events: list[tuple[str, dict]] = []
+
+
+def _utcnow() -> datetime:
+    # Misma convencion que las lecturas: hora UTC guardada sin zona horaria
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _describe(rule: Rule, value: float) -> str:
+    if rule.kind == "range":
+        low = "-inf" if rule.min_value is None else f"{rule.min_value:g}"
+        high = "inf" if rule.max_value is None else f"{rule.max_value:g}"
+        return f"{rule.metric} out of range: {value:g} (allowed {low} to {high})"
+    if rule.kind == "rate":
+        return f"{rule.metric} changing {value:+.4g}/s (max {rule.max_rate:g}/s)"
+    return f"no readings for {value:.0f} s (timeout {rule.timeout_s:g} s)"
+
+
+class RuleEngine:
+    def __init__(self):
+        self.rules: dict[int, Rule] = {}
+        self.states: dict[tuple[int, int], RuleState] = {}
+        # Reglas por sensor y reglas de todos los sensores (sensor_id NULL)
+        self._by_sensor: dict[int, list[Rule]] = {}
+        self._all: list[Rule] = []
+        # Ultima lectura de cada sensor (para 'rate') y hora UTC en que llego a este
+        # proceso (para 'stale', junto con la de sensor_state)
+        self.latest: dict[int, tuple[datetime, dict]] = {}
+        self.last_seen: dict[int, datetime] = {}
+        # Sin load() (p. ej. scripts que insertan lecturas) no se evalua nada
+        self.loaded = False
+
+    def load(self, db: Session):
+        # Reglas, alertas abiertas y ultima lectura de cada sensor desde la base de datos.
+        self.rules = {row.id: Rule.model_validate(row) for row in db.query(models.AlertRule)}
+        self._index()
+        self.states = {}
+        for row in db.query(models.Alert).filter(models.Alert.closed_at.is_(None)):
+            rule = self.rules.get(row.rule_id)
+            if rule is None:
+                continue
+            # Se asume la ventana llena de violaciones: cierra tras `window` lecturas que cumplen
+            alert = schemas.Alert.model_validate(row).model_dump()
+            self.states[(rule.id, row.sensor_id)] = RuleState((1 << rule.window) - 1, rule.window, alert)
+        now = _utcnow()
+        self.latest = {}
+        self.last_seen = {}
+        for state in db.query(models.SensorState):
+            self.latest[state.sensor_id] = (state.last_timestamp,
+                                            {"temperature": state.last_temperature,
+                                             "pressure": state.last_pressure,
+                                             "humidity": state.last_humidity})
+            # Tras reiniciar, cada sensor tiene un timeout completo para volver a reportar
+            self.last_seen[state.sensor_id] = now
+        for rule in self.rules.values():
+            if rule.sensor_id is not None:
+                self.last_seen.setdefault(rule.sensor_id, now)
+        self.loaded = True
+
+    def _index(self):
+        self._by_sensor = {}
+        self._all = []
+        for rule in self.rules.values():
+            if rule.sensor_id is None:
+                self._all.append(rule)
+            else:
+                self._by_sensor.setdefault(rule.sensor_id, []).append(rule)
+
+    def add_rule(self, rule: Rule):
+        self.rules[rule.id] = rule
+        self._index()
+        if rule.sensor_id is not None:
+            self.last_seen.setdefault(rule.sensor_id, _utcnow())
+
+    def remove_rule(self, rule_id: int):
+        self.rules.pop(rule_id, None)
+        self._index()
+        for key in [key for key in self.states if key[0] == rule_id]:
+            del self.states[key]
+
+    def open_alerts(self) -> int:
+        return sum(1 for state in self.states.values() if state.alert is not None)
+
+    def _open(self, state: RuleState, rule: Rule, sensor_id: int, opened_at: datetime,
+              value: float, reading_id: Optional[int] = None) -> tuple[str, dict]:
+        state.alert = {"id": None, "rule_id": rule.id, "sensor_id": sensor_id,
+                       "opened_at": opened_at, "closed_at": None,
+                       "reading_id": reading_id, "value": value, "message": _describe(rule, value)}
+        return "open", state.alert
+
+    def _close(self, state: RuleState, closed_at: datetime) -> tuple[str, dict]:
+        alert, state.alert = state.alert, None
+        alert["closed_at"] = closed_at
+        return "close", alert
+
+    def _state(self, changes: Evaluation, key: tuple[int, int]) -> Optional[RuleState]:
+        # Copia del estado de la regla para el sensor, la primera vez que se toca.
+        if key not in changes.states:
+            state = self.states.get(key)
+            changes.states[key] = None if state is None else \
+                RuleState(state.bits, state.count, dict(state.alert) if state.alert is not None else None)
+        return changes.states[key]
+
+    def _evaluate(self, readings: list[dict], changes: Evaluation) -> list[tuple[str, dict]]:
+        # Evalua en memoria sobre copias, sin esperar a la base de datos: el estado
+        # del motor no cambia aunque otra tarea del event loop corra mientras se escribe.
+        ops = []
+        now = _utcnow()
+        for reading in readings:
+            sensor_id = reading["sensor_id"]
+            timestamp = reading["timestamp"].replace(tzinfo=None)
+            changes.last_seen[sensor_id] = now
+            previous = changes.latest.get(sensor_id, self.latest.get(sensor_id))
+            for rule in chain(self._by_sensor.get(sensor_id, ()), self._all):
+                key = (rule.id, sensor_id)
+                state = self._state(changes, key)
+                if rule.kind == "stale":
+                    if state is not None:
+                        ops.append(self._close(state, timestamp))
+                        changes.states[key] = None
+                    continue
+                if rule.kind == "range":
+                    value = reading[rule.metric]
+                    violated = ((rule.min_value is not None and value < rule.min_value) or
+                                (rule.max_value is not None and value > rule.max_value))
+                else:
+                    # 'rate' compara con la lectura anterior; las que llegan desordenadas no cuentan
+                    if previous is None or timestamp <= previous[0]:
+                        continue
+                    value = (reading[rule.metric] - previous[1][rule.metric]) / (timestamp - previous[0]).total_seconds()
+                    violated = abs(value) > rule.max_rate
+                if state is None:
+                    if not violated:
+                        continue
+                    state = changes.states[key] = RuleState()
+                state.push(violated, rule.window)
+                if state.alert is None and state.count >= rule.violations:
+                    ops.append(self._open(state, rule, sensor_id, timestamp, value, reading["id"]))
+                elif state.alert is not None and state.count == 0:
+                    ops.append(self._close(state, timestamp))
+                if state.count == 0 and state.alert is None:
+                    changes.states[key] = None
+            if previous is None or timestamp > previous[0]:
+                changes.latest[sensor_id] = (timestamp, reading)
+        return ops
+
+    def _execute(self, db: Session, ops: list[tuple[str, dict]], changes: Evaluation) -> Evaluation:
+        # Guarda aperturas y cierres; los eventos se aplican y publican tras el commit.
+        for action, alert in ops:
+            if action == "open":
+                if alert["rule_id"] not in self.rules:
+                    # La regla se borro mientras tanto
+                    continue
+                values = {name: value for name, value in alert.items() if name != "id"}
+                alert["id"] = db.execute(sqlite_insert(models.Alert).values(**values)
+                                         .on_conflict_do_nothing(index_elements=["rule_id", "sensor_id"],
+                                                                 index_where=models.Alert.closed_at.is_(None))
+                                         .returning(models.Alert.id)).scalar_one_or_none()
+                if alert["id"] is None:
+                    # Otro worker ya la abrio: se sigue esa alerta, sin volver a publicarla
+                    existing = db.execute(select(models.Alert).where(models.Alert.rule_id == alert["rule_id"],
+                                                                     models.Alert.sensor_id == alert["sensor_id"],
+                                                                     models.Alert.closed_at.is_(None))).scalar_one()
+                    alert.update(schemas.Alert.model_validate(existing).model_dump())
+                    continue
+            else:
+                # Si la apertura aun no se escribio, se insertara ya con closed_at
+                if alert["id"] is not None:
+                    # Si otro worker ya la cerro, queda su hora de cierre
+                    db.execute(update(models.Alert)
+                               .where(models.Alert.id == alert["id"], models.Alert.closed_at.is_(None))
+                               .values(closed_at=alert["closed_at"]))
+            changes.events.append((action, dict(alert)))
+        return changes
+
+    def record(self, db: Session, readings: list[dict]) -> Evaluation:
+        """
+        Evalua las reglas con lecturas recien insertadas (diccionarios con su id).
+        No hace commit ni cambia el motor: se llama dentro de la transaccion de la
+        insercion y, despues del commit, los cambios se aplican con apply() y los
+        eventos que devuelve se publican con publish().
+        """
+        changes = Evaluation()
+        if not self.loaded:
+            return changes
+        return self._execute(db, self._evaluate(readings, changes), changes)
+
+    def apply(self, changes: Evaluation) -> list[tuple[str, dict]]:
+        # Aplica una evaluacion ya confirmada y devuelve sus eventos.
+        for key, state in changes.states.items():
+            if state is None:
+                self.states.pop(key, None)
+            elif key[0] in self.rules:
+                # Si la regla se borro mientras se escribia, su estado no vuelve
+                self.states[key] = state
+        for sensor_id, latest in changes.latest.items():
+            current = self.latest.get(sensor_id)
+            if current is None or latest[0] > current[0]:
+                self.latest[sensor_id] = latest
+        self.last_seen.update(changes.last_seen)
+        for action, _ in changes.events:
+            (metrics.ALERTS_OPENED if action == "open" else metrics.ALERTS_CLOSED).inc()
+        return changes.events
+
+    def sync_rules(self, db: Session):
+        # Las reglas creadas o borradas desde otro worker (no se modifican, solo se crean y borran).
+        rules = {row.id: Rule.model_validate(row) for row in db.query(models.AlertRule)}
+        for rule_id in self.rules.keys() - rules.keys():
+            self.remove_rule(rule_id)
+        for rule_id in rules.keys() - self.rules.keys():
+            self.add_rule(rules[rule_id])
+
+    def check_stale(self, db: Session) -> Evaluation:
+        # Abre las alertas 'stale' de sensores sin lecturas recientes y cierra las de los
+        # que volvieron a enviar. La ultima lectura sale de sensor_state, que ven todos los
+        # workers, o de la hora de llegada a este proceso si es posterior (o si el proceso
+        # acaba de iniciar). El caller hace commit y aplica los cambios con apply().
+        self.sync_rules(db)
+        changes = Evaluation()
+        ops = []
+        stale = [rule for rule in self.rules.values() if rule.kind == "stale"]
+        if not stale:
+            return changes
+        now = _utcnow()
+        last = dict(db.execute(select(models.SensorState.sensor_id, models.SensorState.last_timestamp)).all())
+        for sensor_id, seen in self.last_seen.items():
+            if sensor_id not in last or seen > last[sensor_id]:
+                last[sensor_id] = seen
+        for rule in stale:
+            sensors = last if rule.sensor_id is None else (rule.sensor_id,)
+            for sensor_id in sensors:
+                silent = (now - last.get(sensor_id, now)).total_seconds()
+                key = (rule.id, sensor_id)
+                if silent > rule.timeout_s and key not in self.states:
+                    state = changes.states[key] = RuleState()
+                    ops.append(self._open(state, rule, sensor_id, now, round(silent, 3)))
+                elif silent <= rule.timeout_s and key in self.states:
+                    # Las lecturas del sensor llegaron a otro worker
+                    ops.append(self._close(self._state(changes, key), now))
+                    changes.states[key] = None
+        return self._execute(db, ops, changes)
+
+    def publish(self, events: list[tuple[str, dict]]):
+        messages = []
+        for action, alert in events:
+            payload = {"event": action, **alert}
+            for name in ("opened_at", "closed_at"):
+                if payload[name] is not None:
+                    payload[name] = payload[name].isoformat()
+            messages.append((alert["sensor_id"], alert["id"], json.dumps(payload)))
+        broker.publish_messages(messages)
+
+
+def create_rule(db: Session, rule: schemas.AlertRuleCreate) -> Rule:
+    row = models.AlertRule(**rule.model_dump())
+    db.add(row)
+    db.commit()
+    created = Rule.model_validate(row)
+    rule_engine.add_rule(created)
+    return created
+
+
+def get_rules(db: Session) -> list[Rule]:
+    return [Rule.model_validate(row) for row in db.query(models.AlertRule).order_by(models.AlertRule.id)]
+
+
+def delete_rule(db: Session, rule_id: int) -> bool:
+    # Primero se saca del motor para que no abra nuevas alertas; sus alertas
+    # abiertas se cierran con la hora actual y se publica su cierre.
+    row = db.get(models.AlertRule, rule_id)
+    if row is None:
+        return False
+    rule_engine.remove_rule(rule_id)
+    closed_at = _utcnow()
+    is_open = (models.Alert.rule_id == rule_id, models.Alert.closed_at.is_(None))
+    closed = [schemas.Alert.model_validate(alert).model_dump() for alert in db.query(models.Alert).filter(*is_open)]
+    db.execute(update(models.Alert).where(*is_open).values(closed_at=closed_at))
+    db.delete(row)
+    db.commit()
+    for alert in closed:
+        alert["closed_at"] = closed_at
+        metrics.ALERTS_CLOSED.inc()
+    rule_engine.publish([("close", alert) for alert in closed])
+    return True
+
+
+def get_alerts(db: Session, sensor_id: Optional[int] = None, open: Optional[bool] = None,
+               limit: int = 100) -> list[models.Alert]:
+    query = db.query(models.Alert)
+    if sensor_id is not None:
+        query = query.filter(models.Alert.sensor_id == sensor_id)
+    if open is not None:
+        query = query.filter(models.Alert.closed_at.is_(None) if open else models.Alert.closed_at.is_not(None))
+    return query.order_by(models.Alert.opened_at.desc(), models.Alert.id.desc()).limit(limit).all()
+
+
+rule_engine = RuleEngine()
+# Stream SSE de aperturas y cierres de alertas
+broker = live.LiveBroker()
@@ -0,0 +1,518 @@
+# Archivo comprimido de lecturas antiguas
+# Las lecturas anteriores a ARCHIVE_AFTER_DAYS dias se mueven de las particiones a
+# bloques por sensor y dia (tabla sensor_reading_blocks). Cada bloque guarda las
+# columnas comprimidas en `data`:
+#   id y timestamp: delta-of-delta (con cadencia fija casi todos los valores son 0)
+#   metricas: XOR de los bits de cada valor (float64) con los del anterior. Valores
+#   parecidos comparten signo, exponente y los primeros bits de la mantisa, pero como
+#   llegan redondeados a 2 decimales (no son float32) el resto de la mantisa cambia:
+#   quedan unos 6-7 bytes por valor y unos 22-24 bytes por lectura con id y timestamp
+# Cada valor codificado se guarda como sus bytes distintos de cero, precedidos de un
+# byte de control con los bytes en cero descartados a la derecha y los que se guardan.
+# La fila del bloque tiene ademas una cabecera (cantidad, rango de tiempo y
+# minimo/maximo/media/M2 por metrica) con la que las consultas descartan bloques
+# sin descomprimirlos. Media y M2 (suma de los cuadrados de las diferencias con la
+# media) se combinan entre bloques sin perder precision, igual que en sensor_state.
+#
+# crud.get_filtered_readings, stats.get_filtered_stats y export leen los bloques
+# junto con las particiones, y sensor_state.rebuild_state y rollups.rebuild_rollups
+# suman sus cabeceras y lecturas, asi archivar no cambia ninguna respuesta. Requiere NumPy.
+import os
+import struct
+from datetime import datetime, timedelta
+from typing import Iterator, Optional
+from sqlalchemy import String, and_, delete, func, insert, select, type_coerce
+from sqlalchemy.orm import Session
+from . import hot, models, partitions
+from .database import SessionLocal
+
+try:
+    import numpy as np
+except ImportError:  # NumPy es opcional: sin el no se archiva ni se leen bloques
+    np = None
+
+# Dias de lecturas que se quedan en las particiones; las anteriores se archivan
+# cada RETENTION_INTERVAL_S mientras corre el servidor (None = no se archiva solo).
+ARCHIVE_AFTER_DAYS = int(os.environ["ARCHIVE_AFTER_DAYS"]) if os.getenv("ARCHIVE_AFTER_DAYS") else None
+# Lecturas que se mueven por transaccion: acota cuanto espera el escritor de la API.
+ARCHIVE_CHUNK_ROWS = 200_000
+# Bloques leidos por vuelta al recorrerlos.
+ARCHIVE_FETCH_BLOCKS = 64
+
+METRICS = hot.METRICS
+Block = models.SensorReadingBlock
+
+BLOCK_HEADER = struct.Struct("<I")   # lecturas del bloque
+STREAM_HEADER = struct.Struct("<I")  # bytes de datos de cada columna (sin los de control)
+DAY = timedelta(days=1)
+
+
+def _require_numpy():
+    if np is None:
+        raise RuntimeError("The readings archive requires numpy (pip install numpy)")
+
+
+def _pack(values) -> bytes:
+    # Cada valor de 64 bits se guarda sin sus bytes en cero de los extremos. El byte
+    # de control lleva en el nibble alto los bytes bajos descartados y en el bajo los guardados.
+    raw = values.astype("<u8").view(np.uint8).reshape(-1, 8)
+    nonzero = raw != 0
+    used = nonzero.any(axis=1)
+    low = np.where(used, nonzero.argmax(axis=1), 0)
+    length = np.where(used, 8 - nonzero[:, ::-1].argmax(axis=1) - low, 0)
+    positions = np.arange(8)
+    keep = (positions >= low[:, None]) & (positions < (low + length)[:, None])
+    payload = raw[keep]
+    controls = ((low << 4) | length).astype(np.uint8)
+    return STREAM_HEADER.pack(len(payload)) + controls.tobytes() + payload.tobytes()
+
+
+def _unpack(data: bytes, offset: int, count: int):
+    # Inversa de _pack; devuelve los valores (uint64) y la posicion siguiente.
+    (size,) = STREAM_HEADER.unpack_from(data, offset)
+    offset += STREAM_HEADER.size
+    controls = np.frombuffer(data, np.uint8, count, offset).astype(np.int64)
+    offset += count
+    low, length = controls >> 4, controls & 0xF
+    positions = np.arange(8)
+    keep = (positions >= low[:, None]) & (positions < (low + length)[:, None])
+    raw = np.zeros((count, 8), np.uint8)
+    raw[keep] = np.frombuffer(data, np.uint8, size, offset)
+    return raw.reshape(-1).view("<u8"), offset + size
+
+
+def _encode_ints(values) -> bytes:
+    # Delta-of-delta: el primer valor, la primera diferencia y luego el cambio de
+    # cada diferencia. En zigzag, asi los valores chicos negativos tambien ocupan pocos bytes.
+    deltas = np.diff(values, prepend=0)
+    dod = deltas.copy()
+    dod[2:] = np.diff(deltas[1:])
+    return _pack((dod << 1) ^ (dod >> 63))
+
+
+def _decode_ints(data: bytes, offset: int, count: int):
+    zigzag, offset = _unpack(data, offset, count)
+    dod = (zigzag >> np.uint64(1)).astype(np.int64) ^ -(zigzag & np.uint64(1)).astype(np.int64)
+    deltas = dod.copy()
+    deltas[1:] = np.cumsum(dod[1:])
+    return np.cumsum(deltas), offset
+
+
+def _encode_floats(values) -> bytes:
+    bits = values.astype(np.float64).view(np.uint64)
+    xor = bits.copy()
+    xor[1:] ^= bits[:-1]
+    return _pack(xor)
+
+
+def _decode_floats(data: bytes, offset: int, count: int):
+    xor, offset = _unpack(data, offset, count)
+    return np.bitwise_xor.accumulate(xor).view(np.float64), offset
+
+
+def encode_block(columns: dict) -> bytes:
+    """
+    Comprime las columnas de un bloque (id y timestamp en microsegundos como
+    int64, metricas como float64), ordenadas por (timestamp, id).
+    """
+    data = [BLOCK_HEADER.pack(len(columns["id"])),
+            _encode_ints(columns["id"]),
+            _encode_ints(columns["timestamp"])]
+    data += [_encode_floats(columns[metric]) for metric in METRICS]
+    return b"".join(data)
+
+
+def decode_block(data: bytes) -> dict:
+    (count,) = BLOCK_HEADER.unpack_from(data)
+    offset = BLOCK_HEADER.size
+    columns = {}
+    columns["id"], offset = _decode_ints(data, offset, count)
+    columns["timestamp"], offset = _decode_ints(data, offset, count)
+    for metric in METRICS:
+        columns[metric], offset = _decode_floats(data, offset, count)
+    return columns
+
+
+def _header(sensor_id: int, day: int, columns: dict) -> dict:
+    row = {"sensor_id": sensor_id, "day": day,
+           "count": len(columns["id"]),
+           "first_timestamp": hot.from_micros(int(columns["timestamp"][0])),
+           "last_timestamp": hot.from_micros(int(columns["timestamp"][-1])),
+           "data": encode_block(columns)}
+    for metric in METRICS:
+        values = columns[metric]
+        row[f"{metric}_min"] = float(values.min())
+        row[f"{metric}_max"] = float(values.max())
+        row[f"{metric}_mean"], row[f"{metric}_m2"] = _moments(values)
+    return row
+
+
+def _moments(values) -> tuple:
+    # Media y M2 (suma de los cuadrados de las desviaciones a la media)
+    mean = values.mean()
+    return float(mean), float(np.dot(values - mean, values - mean))
+
+
+def _sorted(columns: dict) -> dict:
+    order = np.lexsort((columns["id"], columns["timestamp"]))
+    return {name: values[order] for name, values in columns.items()}
+
+
+def _archive_sensors(db: Session, table, day_start: datetime, first_sensor: int, last_sensor: int) -> int:
+    # Mueve las lecturas del dia de los sensores [first_sensor, last_sensor] a sus
+    # bloques (combinandolas con un bloque existente si llegaron lecturas tardias).
+    in_range = and_(table.c.timestamp >= day_start, table.c.timestamp < day_start + DAY,
+                    table.c.sensor_id >= first_sensor, table.c.sensor_id <= last_sensor)
+    stmt = select(table.c.id, table.c.sensor_id, type_coerce(table.c.timestamp, String),
+                  *(table.c[metric] for metric in METRICS))\
+        .where(in_range)\
+        .order_by(table.c.sensor_id, table.c.timestamp, table.c.id)
+    rows = db.execute(stmt).all()
+    if not rows:
+        return 0
+    ids, sensor_ids, timestamps, *values = zip(*rows)
+    sensor_ids = np.array(sensor_ids, np.int64)
+    columns = {"id": np.array(ids, np.int64),
+               "timestamp": np.array(timestamps, "datetime64[us]").astype(np.int64)}
+    columns.update((metric, np.array(column, np.float64)) for metric, column in zip(METRICS, values))
+
+    day = int((day_start - hot.EPOCH).total_seconds())
+    existing = {sensor_id: data for sensor_id, data in db.execute(
+        select(Block.sensor_id, Block.data)
+        .where(Block.day == day, Block.sensor_id >= first_sensor, Block.sensor_id <= last_sensor))}
+    blocks = []
+    bounds = np.flatnonzero(np.diff(sensor_ids)) + 1
+    for first, last in zip(np.r_[0, bounds], np.r_[bounds, len(sensor_ids)]):
+        sensor_id = int(sensor_ids[first])
+        block = {name: values[first:last] for name, values in columns.items()}
+        if sensor_id in existing:
+            old = decode_block(existing[sensor_id])
+            block = _sorted({name: np.concatenate((old[name], block[name])) for name in block})
+        blocks.append(_header(sensor_id, day, block))
+
+    if existing:
+        db.execute(delete(Block).where(Block.day == day, Block.sensor_id.in_(list(existing))))
+    db.execute(insert(Block), blocks)
+    # Solo se borran las lecturas leidas: el SELECT corre fuera de la transaccion de
+    # escritura, asi que una lectura tardia pudo guardarse despues. Los ids de cada
+    # particion son AUTOINCREMENT (crecientes), y esa lectura queda para la proxima vuelta.
+    db.execute(delete(table).where(in_range, table.c.id <= int(columns["id"].max())))
+    return len(rows)
+
+
+def archive_readings(db: Session, before: datetime) -> int:
+    """
+    Mueve a bloques las lecturas de los dias anteriores al de `before`. Cada tanda
+    de ARCHIVE_CHUNK_ROWS lecturas (sensores completos de un dia) se escribe y borra
+    de su particion en una transaccion. Devuelve cuantas lecturas se archivaron.
+    """
+    _require_numpy()
+    cutoff = datetime(before.year, before.month, before.day)
+    moved = 0
+    for name in partitions.partitions_in_range(db, None, cutoff):
+        table = partitions.partition_table(name)
+        day = db.execute(select(func.min(table.c.timestamp)).where(table.c.timestamp < cutoff)).scalar()
+        while day is not None:
+            day_start = datetime(day.year, day.month, day.day)
+            in_day = and_(table.c.timestamp >= day_start, table.c.timestamp < day_start + DAY)
+            counts = db.execute(select(table.c.sensor_id, func.count())
+                                .where(in_day)
+                                .group_by(table.c.sensor_id)
+                                .order_by(table.c.sensor_id)).all()
+            # Tandas de sensores consecutivos con hasta ARCHIVE_CHUNK_ROWS lecturas
+            first, rows = None, 0
+            for index, (sensor_id, count) in enumerate(counts):
+                if first is None:
+                    first = sensor_id
+                rows += count
+                if rows >= ARCHIVE_CHUNK_ROWS or index == len(counts) - 1:
+                    moved += _archive_sensors(db, table, day_start, first, sensor_id)
+                    db.commit()
+                    first, rows = None, 0
+            day = db.execute(select(func.min(table.c.timestamp))
+                             .where(table.c.timestamp >= day_start + DAY, table.c.timestamp < cutoff)).scalar()
+    return moved
+
+
+def archive_old_readings(now: Optional[datetime] = None) -> int:
+    # Archiva lo anterior a ARCHIVE_AFTER_DAYS dias con su propia sesion (se llama
+    # desde un hilo para no bloquear el event loop mientras comprime).
+    if ARCHIVE_AFTER_DAYS is None:
+        return 0
+    now = now or partitions.utcnow()
+    with SessionLocal() as db:
+        return archive_readings(db, now - timedelta(days=ARCHIVE_AFTER_DAYS))
+
+
+def apply_retention(db: Session, now: Optional[datetime] = None) -> int:
+    # Borra los bloques de dias fuera del periodo de retencion de las particiones. No hace commit.
+    cutoff = partitions.retention_cutoff(now)
+    if cutoff is None:
+        return 0
+    day = int((cutoff - hot.EPOCH).total_seconds())
+    return db.execute(delete(Block).where(Block.day < day)).rowcount
+
+
+def _conditions(filters: dict) -> list:
+    # Descarta por la cabecera los bloques que no pueden tener lecturas que cumplan los filtros.
+    conditions = []
+    if filters.get("sensor_id") is not None:
+        conditions.append(Block.sensor_id == filters["sensor_id"])
+    if filters.get("start_date") is not None:
+        conditions.append(Block.last_timestamp >= filters["start_date"])
+    if filters.get("end_date") is not None:
+        conditions.append(Block.first_timestamp <= filters["end_date"])
+    for metric, low, high in hot.FILTERS:
+        if filters.get(low) is not None:
+            conditions.append(getattr(Block, f"{metric}_max") >= filters[low])
+        if filters.get(high) is not None:
+            conditions.append(getattr(Block, f"{metric}_min") <= filters[high])
+    return conditions
+
+
+def _mask(columns: dict, filters: dict):
+    ts = columns["timestamp"]
+    mask = np.ones(len(ts), bool)
+    if filters.get("start_date") is not None:
+        mask &= ts >= hot.to_micros(filters["start_date"])
+    if filters.get("end_date") is not None:
+        mask &= ts <= hot.to_micros(filters["end_date"])
+    for metric, low, high in hot.FILTERS:
+        if filters.get(low) is not None:
+            mask &= columns[metric] >= filters[low]
+        if filters.get(high) is not None:
+            mask &= columns[metric] <= filters[high]
+    return mask
+
+
+def _covers(block, filters: dict) -> bool:
+    # El bloque cumple los filtros entero: su cabecera sirve de total sin descomprimirlo.
+    if filters.get("start_date") is not None and block.first_timestamp < filters["start_date"].replace(tzinfo=None):
+        return False
+    if filters.get("end_date") is not None and block.last_timestamp > filters["end_date"].replace(tzinfo=None):
+        return False
+    for metric, low, high in hot.FILTERS:
+        if filters.get(low) is not None and getattr(block, f"{metric}_min") < filters[low]:
+            return False
+        if filters.get(high) is not None and getattr(block, f"{metric}_max") > filters[high]:
+            return False
+    return True
+
+
+def get_readings(db: Session, needed: int, cursor=None, newer_than: Optional[datetime] = None,
+                 **filters) -> list:
+    """
+    Las `needed` lecturas archivadas mas recientes (timestamp desc, id desc) que
+    cumplen los filtros, despues del cursor. Con `newer_than` solo se miran
+    bloques con lecturas desde ese momento (las demas no entrarian en la pagina).
+    """
+    conditions = _conditions(filters)
+    if cursor is not None:
+        conditions.append(Block.first_timestamp <= cursor[0])
+    if newer_than is not None:
+        conditions.append(Block.last_timestamp >= newer_than)
+    stmt = select(Block.sensor_id, Block.last_timestamp, Block.data)\
+        .where(*conditions)\
+        .order_by(Block.last_timestamp.desc())
+    page = None
+    for sensor_id, last_timestamp, data in db.execute(stmt.execution_options(yield_per=ARCHIVE_FETCH_BLOCKS)):
+        # Bloques ordenados por su ultima lectura: si ya no puede entrar ninguna, se termina
+        if page is not None and len(page["id"]) >= needed and hot.to_micros(last_timestamp) < page["timestamp"][-1]:
+            break
+        _require_numpy()
+        columns = decode_block(data)
+        mask = _mask(columns, filters)
+        if cursor is not None:
+            cursor_ts = hot.to_micros(cursor[0])
+            mask &= (columns["timestamp"] < cursor_ts) | ((columns["timestamp"] == cursor_ts) & (columns["id"] < cursor[1]))
+        if not mask.any():
+            continue
+        columns = {name: values[mask] for name, values in columns.items()}
+        columns["sensor_id"] = np.full(len(columns["id"]), sensor_id, np.int64)
+        if page is not None:
+            columns = {name: np.concatenate((page[name], values)) for name, values in columns.items()}
+        order = np.lexsort((columns["id"], columns["timestamp"]))[::-1][:needed]
+        page = {name: values[order] for name, values in columns.items()}
+    if page is None:
+        return []
+    values = zip(*(page[name].tolist() for name in ("id", "sensor_id", "timestamp") + METRICS))
+    return [hot.HotReading(reading_id, sensor_id, hot.from_micros(ts), *metrics)
+            for reading_id, sensor_id, ts, *metrics in values]
+
+
+class BlockSelection:
+    """
+    Bloques archivados que pueden tener lecturas de una consulta de estadisticas
+    (solo sus cabeceras). Los que cumplen los filtros enteros aportan su cabecera
+    a los totales; los demas, y todos para los percentiles, se descomprimen y filtran.
+    """
+
+    def __init__(self, db: Session, filters: dict, blocks: list):
+        self.db = db
+        self.filters = filters
+        self.blocks = blocks
+
+    def _filtered(self, data: bytes) -> dict:
+        _require_numpy()
+        columns = decode_block(data)
+        mask = _mask(columns, self.filters)
+        return {metric: columns[metric][mask] for metric in METRICS}
+
+    def totals(self, group_by_sensor: bool) -> Iterator[tuple]:
+        # (clave, cantidad, medias, M2, minimos, maximos) de cada bloque con
+        # lecturas, en el formato de stats.Totals.add.
+        for block in self.blocks:
+            key = block.sensor_id if group_by_sensor else None
+            if _covers(block, self.filters):
+                yield (key, block.count,
+                       [getattr(block, f"{metric}_mean") for metric in METRICS],
+                       [getattr(block, f"{metric}_m2") for metric in METRICS],
+                       [getattr(block, f"{metric}_min") for metric in METRICS],
+                       [getattr(block, f"{metric}_max") for metric in METRICS])
+                continue
+            data = self.db.execute(select(Block.data)
+                                   .where(Block.sensor_id == block.sensor_id, Block.day == block.day)).scalar_one()
+            columns = self._filtered(data)
+            if len(columns[METRICS[0]]):
+                means, m2s = zip(*(_moments(columns[metric]) for metric in METRICS))
+                yield (key, len(columns[METRICS[0]]), means, m2s,
+                       [float(columns[metric].min()) for metric in METRICS],
+                       [float(columns[metric].max()) for metric in METRICS])
+
+    def values(self, group_by_sensor: bool) -> Iterator[tuple]:
+        # (clave, valores de cada metrica) de cada bloque, para los percentiles.
+        stmt = select(Block.sensor_id, Block.data).where(*_conditions(self.filters))
+        for sensor_id, data in self.db.execute(stmt.execution_options(yield_per=ARCHIVE_FETCH_BLOCKS)):
+            columns = self._filtered(data)
+            if len(columns[METRICS[0]]):
+                yield (sensor_id if group_by_sensor else None,
+                       [columns[metric].tolist() for metric in METRICS])
+
+
+def select_blocks(db: Session, filters: dict) -> Optional[BlockSelection]:
+    # None si ningun bloque puede cumplir los filtros (sin archivo, no cuesta mas que una consulta).
+    header = [column for column in Block.__table__.columns if column.name != "data"]
+    blocks = db.execute(select(*header).where(*_conditions(filters))).all()
+    return BlockSelection(db, filters, blocks) if blocks else None
+
+
+def has_blocks(db: Session, filters: dict) -> bool:
+    return db.execute(select(Block.sensor_id).where(*_conditions(filters)).limit(1)).first() is not None
+
+
+def iter_rows(db: Session, filters: dict) -> Iterator[tuple]:
+    """
+    Lecturas archivadas que cumplen los filtros en orden cronologico, como tuplas
+    (id, sensor_id, timestamp, temperature, pressure, humidity). Los bloques de un
+    dia no se solapan con los de otro, asi que basta ordenar dia por dia.
+    """
+    stmt = select(Block.day, Block.sensor_id, Block.data)\
+        .where(*_conditions(filters))\
+        .order_by(Block.day)
+    day_blocks, current = [], None
+    for day, sensor_id, data in db.execute(stmt.execution_options(yield_per=ARCHIVE_FETCH_BLOCKS)):
+        if day != current and day_blocks:
+            yield from _day_rows(day_blocks, filters)
+            day_blocks = []
+        current = day
+        day_blocks.append((sensor_id, data))
+    if day_blocks:
+        yield from _day_rows(day_blocks, filters)
+
+
+def _day_rows(blocks: list, filters: dict) -> Iterator[tuple]:
+    _require_numpy()
+    parts = []
+    for sensor_id, data in blocks:
+        columns = decode_block(data)
+        mask = _mask(columns, filters)
+        columns = {name: values[mask] for name, values in columns.items()}
+        columns["sensor_id"] = np.full(len(columns["id"]), sensor_id, np.int64)
+        parts.append(columns)
+    columns = _sorted({name: np.concatenate([part[name] for part in parts]) for name in parts[0]})
+    for reading_id, sensor_id, ts, *metrics in zip(*(columns[name].tolist()
+                                                     for name in ("id", "sensor_id", "timestamp") + METRICS)):
+        yield (reading_id, sensor_id, hot.from_micros(ts), *metrics)
+
+
+def state_rows(db: Session) -> list[dict]:
+    """
+    Estado de cada sensor con lecturas archivadas, en el formato de sensor_state:
+    cantidad, minimos, maximos, medias y M2 salen de las cabeceras sin descomprimir
+    y la ultima lectura del bloque mas nuevo. Los bloques se combinan como en
+    sensor_state: M2 es la suma de los M2 mas n * (media del bloque - media)^2.
+    """
+    count = func.sum(Block.count)
+    columns = [Block.sensor_id, count.label("count"), func.min(Block.first_timestamp).label("first_timestamp"),
+               func.max(Block.day).label("last_day")]
+    for metric in METRICS:
+        columns += [func.min(getattr(Block, f"{metric}_min")).label(f"{metric}_min"),
+                    func.max(getattr(Block, f"{metric}_max")).label(f"{metric}_max"),
+                    (func.sum(Block.count * getattr(Block, f"{metric}_mean")) / count).label(f"{metric}_mean")]
+    totals = select(*columns).group_by(Block.sensor_id).subquery()
+    m2s = []
+    for metric in METRICS:
+        delta = getattr(Block, f"{metric}_mean") - totals.c[f"{metric}_mean"]
+        m2s.append(func.sum(getattr(Block, f"{metric}_m2") + Block.count * delta * delta).label(f"{metric}_m2"))
+    stmt = select(totals, *m2s).join(Block, Block.sensor_id == totals.c.sensor_id).group_by(totals.c.sensor_id)
+
+    rows = []
+    for header in db.execute(stmt).mappings():
+        data = db.execute(select(Block.data)
+                          .where(Block.sensor_id == header["sensor_id"], Block.day == header["last_day"])).scalar_one()
+        _require_numpy()
+        # Los bloques se guardan ordenados: la ultima fila es la ultima lectura
+        last = {name: values[-1].item() for name, values in decode_block(data).items()}
+        row = {"sensor_id": header["sensor_id"], "count": header["count"],
+               "first_timestamp": header["first_timestamp"],
+               "last_id": last["id"], "last_timestamp": hot.from_micros(last["timestamp"])}
+        for metric in METRICS:
+            row[f"last_{metric}"] = last[metric]
+            for suffix in ("min", "max", "mean", "m2"):
+                row[f"{metric}_{suffix}"] = header[f"{metric}_{suffix}"]
+        rows.append(row)
+    return rows
+
+
+def rollup_rows(db: Session, buckets: dict) -> Iterator[list]:
+    """
+    Agregados por intervalo (formato de sensor_reading_rollups) de las lecturas
+    archivadas, una lista por bloque. `buckets` es rollups.BUCKETS; ningun intervalo
+    pasa de un dia, asi que cada agregado sale de un solo bloque.
+    """
+    stmt = select(Block.sensor_id, Block.data).order_by(Block.sensor_id, Block.day)
+    for sensor_id, data in db.execute(stmt.execution_options(yield_per=ARCHIVE_FETCH_BLOCKS)):
+        _require_numpy()
+        columns = decode_block(data)
+        seconds = columns["timestamp"] // 1_000_000
+        rows = []
+        for bucket, size in buckets.items():
+            starts = seconds - seconds % size
+            # Las lecturas estan ordenadas por tiempo: cada intervalo es un tramo contiguo
+            edges = np.concatenate(([0], np.flatnonzero(np.diff(starts)) + 1))
+            counts = np.diff(np.append(edges, len(starts)))
+            parts = {"bucket_start": starts[edges].tolist(), "count": counts.tolist()}
+            for metric in METRICS:
+                values = columns[metric]
+                parts[f"{metric}_sum"] = np.add.reduceat(values, edges).tolist()
+                parts[f"{metric}_min"] = np.minimum.reduceat(values, edges).tolist()
+                parts[f"{metric}_max"] = np.maximum.reduceat(values, edges).tolist()
+            names = list(parts)
+            rows += [{"sensor_id": sensor_id, "bucket": bucket, **dict(zip(names, values))}
+                     for values in zip(*parts.values())]
+        yield rows
+
+
+def summary(db: Session) -> dict:
+    row = db.execute(select(func.count(), func.coalesce(func.sum(Block.count), 0),
+                            func.coalesce(func.sum(func.length(Block.data)), 0),
+                            func.min(Block.first_timestamp), func.max(Block.last_timestamp))).one()
+    blocks, readings, nbytes, first, last = row
+    return {"enabled": ARCHIVE_AFTER_DAYS is not None,
+            "after_days": ARCHIVE_AFTER_DAYS,
+            "blocks": blocks,
+            "readings": readings,
+            "bytes": nbytes,
+            "bytes_per_reading": nbytes / readings if readings else None,
+            "first_timestamp": first.isoformat() if first else None,
+            "last_timestamp": last.isoformat() if last else None}
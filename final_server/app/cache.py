@@ -0,0 +1,138 @@
+# Cache de resultados de consultas
+# Guarda la respuesta ya serializada de /readings/, /readings/stats/ y
+# /readings/series por conjunto de filtros normalizado (LRU acotado).
+# Cada insercion incrementa el contador de generacion de sus sensores; una
+# entrada solo es valida si la generacion con la que se calculo sigue vigente,
+# asi no hace falta buscar ni borrar entradas al insertar. La misma generacion
+# forma el ETag, por lo que If-None-Match se resuelve sin tocar la base de datos.
+import hashlib
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Iterable, Optional
+
+# Numero maximo de respuestas guardadas.
+CACHE_MAX_ENTRIES = int(os.getenv("QUERY_CACHE_MAX_ENTRIES", 512))
+# Segundos de vida de una entrada. Los contadores son por proceso: con varios
+# workers de uvicorn, las inserciones recibidas por otro worker no invalidan este
+# cache, y el TTL acota ese retraso. 0 = hasta que una insercion la invalide
+# (solo sirve con un worker).
+CACHE_TTL_S = float(os.getenv("QUERY_CACHE_TTL_S", 5)) or None
+
+
+class CachedResponse:
+    def __init__(self, token: str, body: bytes, headers: dict):
+        self.token = token
+        self.body = body
+        self.headers = headers
+
+
+class QueryCache:
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, ttl: Optional[float] = CACHE_TTL_S):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Identifica a este proceso en los ETag: tras reiniciar los contadores
+        # vuelven a cero y un ETag viejo no debe coincidir.
+        self.instance = uuid.uuid4().hex[:8]
+        self.epoch = 0
+        self.generation = 0
+        self.sensor_generations = {}
+        # Estadisticas
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.not_modified = 0
+
+    @staticmethod
+    def key(endpoint: str, params: dict) -> str:
+        # Mismos filtros en distinto orden o formato producen la misma clave.
+        parts = [endpoint]
+        for name in sorted(params):
+            value = params[name]
+            if value is None:
+                continue
+            if isinstance(value, datetime):
+                value = value.isoformat()
+            elif isinstance(value, float):
+                value = repr(value)
+            parts.append(f"{name}={value}")
+        return "&".join(parts)
+
+    def token(self, sensor_id: Optional[int] = None) -> str:
+        # Generacion de la que depende una consulta: la de su sensor si filtra
+        # por uno, o la global (cualquier insercion) si no.
+        with self._lock:
+            generation = self.generation if sensor_id is None else self.sensor_generations.get(sensor_id, 0)
+        token = f"{self.epoch}.{generation}"
+        if self.ttl is not None:
+            # Con TTL, el token cambia en cada ventana: vence la entrada y tambien el ETag
+            token += f".{int(time.monotonic() // self.ttl)}"
+        return token
+
+    def etag(self, key: str, token: str) -> str:
+        digest = hashlib.blake2b(key.encode(), digest_size=8).hexdigest()
+        return f'W/"{self.instance}-{token}-{digest}"'
+
+    def not_modified_for(self, if_none_match: Optional[str], etag: str) -> bool:
+        # True si el cliente ya tiene esta version (responder 304).
+        if not if_none_match:
+            return False
+        candidates = [value.strip() for value in if_none_match.split(",")]
+        if etag in candidates or "*" in candidates:
+            with self._lock:
+                self.not_modified += 1
+            return True
+        return False
+
+    def get(self, key: str, token: str) -> Optional[CachedResponse]:
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry.token == token:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            if entry is not None:
+                # Invalidada por una insercion (o vencida por TTL)
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: str, token: str, body: bytes, headers: dict):
+        with self._lock:
+            self.entries[key] = CachedResponse(token, body, headers)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def bump(self, sensor_ids: Iterable[int]):
+        # Llamado tras cada commit de lecturas nuevas.
+        with self._lock:
+            self.generation += 1
+            for sensor_id in sensor_ids:
+                self.sensor_generations[sensor_id] = self.sensor_generations.get(sensor_id, 0) + 1
+
+    def invalidate_all(self):
+        # Para cambios que no son inserciones (p. ej. borrar particiones por retencion).
+        with self._lock:
+            self.epoch += 1
+            self.entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"entries": len(self.entries),
+                    "max_entries": self.max_entries,
+                    "hits": self.hits,
+                    "misses": self.misses,
+                    "evictions": self.evictions,
+                    "not_modified": self.not_modified,
+                    "hit_ratio": self.hits / lookups if lookups else None}
+
+
+query_cache = QueryCache()
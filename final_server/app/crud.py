@@ -1,14 +1,46 @@
 # Database operations (Create, Read, Update, Delete)
+import base64
+import json
 from typing import Optional
 from datetime import datetime
+from sqlalchemy import and_, or_
 from sqlalchemy.orm import Session
-from . import models, schemas
+from . import alerts, archive, cache, hot, live, models, partitions, rollups, schemas, sensor_state
 
-def get_readings(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.SensorReadings)\
-        .order_by(models.SensorReadings.timestamp.desc())\
-        .offset(skip)\
-        .limit(limit).all()
+Cursor = tuple[datetime, int]
+
+def encode_cursor(reading: models.SensorReadings) -> str:
+    # Cursor opaco con la posicion (timestamp, id) de la ultima lectura de la pagina.
+    raw = json.dumps([reading.timestamp.isoformat(), reading.id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Cursor:
+    # Lanza ValueError si el cursor no es valido.
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        timestamp, reading_id = json.loads(raw)
+        return datetime.fromisoformat(timestamp), int(reading_id)
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+def _after_cursor(cursor: Cursor, source=models.SensorReadings):
+    # Lecturas posteriores al cursor en orden (timestamp desc, id desc).
+    # La primera condicion acota el rango del indice; la segunda resuelve empates.
+    timestamp, reading_id = cursor
+    return and_(source.timestamp <= timestamp,
+                or_(source.timestamp < timestamp,
+                    source.id < reading_id))
+
+def _page(query, skip: int, limit: int, cursor: Optional[Cursor], source=models.SensorReadings):
+    # Con cursor, cada pagina cuesta lo mismo sin importar su profundidad;
+    # sin cursor se mantiene el modo offset por compatibilidad.
+    query = query.order_by(source.timestamp.desc(), source.id.desc())
+    if cursor is not None:
+        return query.filter(_after_cursor(cursor, source)).limit(limit).all()
+    return query.offset(skip).limit(limit).all()
+
+def get_readings(db: Session, skip: int = 0, limit: int = 100, cursor: Optional[Cursor] = None):
+    return _page(db.query(models.SensorReadings), skip, limit, cursor)
 
 def get_readings_by_sensor_id(db: Session, sensor_id: int):
     return db.query(models.SensorReadings)\
@@ -16,6 +48,40 @@ def get_readings_by_sensor_id(db: Session, sensor_id: int):
         .order_by(models.SensorReadings.timestamp.desc())\
         .all()
 
+def reading_filters(sensor_id: Optional[int] = None,
+                    start_date: Optional[datetime] = None,
+                    end_date: Optional[datetime] = None,
+                    min_temp: Optional[float] = None,
+                    max_temp: Optional[float] = None,
+                    min_pres: Optional[float] = None,
+                    max_pres: Optional[float] = None,
+                    min_humi: Optional[float] = None,
+                    max_humi: Optional[float] = None,
+                    source=models.SensorReadings):
+    # Traduce los filtros de la API a condiciones SQL, compartidas por las consultas
+    # de lecturas y de estadisticas. `source` es la vista o una entidad de
+    # partitions.readings_source() con las mismas columnas.
+    conditions = []
+    if sensor_id is not None:
+        conditions.append(source.sensor_id == sensor_id)
+    if start_date is not None:
+        conditions.append(source.timestamp >= start_date)
+    if end_date is not None:
+        conditions.append(source.timestamp <= end_date)
+    if min_temp is not None:
+        conditions.append(source.temperature >= min_temp)
+    if max_temp is not None:
+        conditions.append(source.temperature <= max_temp)
+    if min_pres is not None:
+        conditions.append(source.pressure >= min_pres)
+    if max_pres is not None:
+        conditions.append(source.pressure <= max_pres)
+    if min_humi is not None:
+        conditions.append(source.humidity >= min_humi)
+    if max_humi is not None:
+        conditions.append(source.humidity <= max_humi)
+    return conditions
+
 def get_filtered_readings(db: Session,
                           skip: int,
                           limit: int,
@@ -27,33 +93,61 @@ def get_filtered_readings(db: Session,
                           min_pres: Optional[float] = None,
                           max_pres: Optional[float] = None,
                           min_humi: Optional[float] = None,
-                          max_humi: Optional[float] = None):
-    query = db.query(models.SensorReadings)
+                          max_humi: Optional[float] = None,
+                          cursor: Optional[Cursor] = None):
+    # Se recorren las particiones del rango de la mas nueva a la mas antigua y se
+    # para en cuanto la pagina esta completa: la pagina mas reciente solo toca el mes actual.
+    if cursor is not None:
+        # El cursor es naive (hora de pared, como se guarda); end_date puede traer zona horaria
+        end_date = min(end_date.replace(tzinfo=None), cursor[0]) if end_date is not None else cursor[0]
+    needed = limit if cursor is not None else skip + limit
+    readings = []
+    for name in reversed(partitions.partitions_in_range(db, start_date, end_date)):
+        source = partitions.partition_entity(name)
+        query = db.query(source)\
+            .filter(*reading_filters(sensor_id, start_date, end_date,
+                                     min_temp, max_temp, min_pres, max_pres, min_humi, max_humi,
+                                     source=source))
+        readings += _page(query, 0, needed - len(readings), cursor, source)
+        if len(readings) >= needed:
+            break
 
-    if sensor_id is not None:
-        query = query.filter(models.SensorReadings.sensor_id == sensor_id)
-    if start_date is not None:
-        query = query.filter(models.SensorReadings.timestamp >= start_date)
-    if end_date is not None:
-        query = query.filter(models.SensorReadings.timestamp <= end_date)
-    if min_temp is not None:
-        query = query.filter(models.SensorReadings.temperature >= min_temp)
-    if max_temp is not None:
-        query = query.filter(models.SensorReadings.temperature <= max_temp)
-    if min_pres is not None:
-        query = query.filter(models.SensorReadings.pressure >= min_pres)
-    if max_pres is not None:
-        query = query.filter(models.SensorReadings.pressure <= max_pres)
-    if min_humi is not None:
-        query = query.filter(models.SensorReadings.humidity >= min_humi)
-    if max_humi is not None:
-        query = query.filter(models.SensorReadings.humidity <= max_humi)
+    # Lecturas archivadas: en general son anteriores a las particiones, pero pueden
+    # haber llegado lecturas tardias, asi que se mezclan las que podrian entrar en la pagina.
+    newer_than = readings[needed - 1].timestamp if len(readings) >= needed else None
+    archived = archive.get_readings(db, needed, cursor, newer_than,
+                                    sensor_id=sensor_id, start_date=start_date, end_date=end_date,
+                                    min_temp=min_temp, max_temp=max_temp, min_pres=min_pres,
+                                    max_pres=max_pres, min_humi=min_humi, max_humi=max_humi)
+    if archived:
+        readings = sorted(readings + archived, key=lambda reading: (reading.timestamp, reading.id),
+                          reverse=True)[:needed]
 
-    return query.order_by(models.SensorReadings.timestamp.desc()).offset(skip).limit(limit).all()
+    return readings if cursor is not None else readings[skip:]
 
 def create_reading(db:Session, reading: schemas.SensorReadingCreate):
-    db_reading = models.SensorReadings(**reading.model_dump())
-    db.add(db_reading)
+    # La vista sensor_readings es de solo lectura: se inserta en la particion del mes.
+    reading_id = create_readings_bulk(db, [reading])[0]
+    return db.get(models.SensorReadings, reading_id)
+
+def create_readings_bulk(db: Session, readings: list[schemas.SensorReadingCreate]) -> list[int]:
+    # Inserta todas las lecturas en una sola transaccion con un INSERT de Core (executemany)
+    # por particion mensual, evitando crear un objeto ORM y hacer flush/refresh por cada fila.
+    if not readings:
+        return []
+    rows = [reading.model_dump() for reading in readings]
+    ids = partitions.insert_rows(db, rows)
+    inserted = [{"id": reading_id, **row} for reading_id, row in zip(ids, rows)]
+    rollups.update_rollups(db, rows)
+    sensor_state.update_state(db, inserted)
+    evaluation = alerts.rule_engine.record(db, inserted)
     db.commit()
-    db.refresh(db_reading)
-    return db_reading
\ No newline at end of file
+    # Las alertas cambian el motor solo si la transaccion se confirmo
+    events = alerts.rule_engine.apply(evaluation)
+    # La capa caliente se actualiza antes de invalidar el cache, para que una
+    # consulta con la nueva generacion ya encuentre las lecturas en memoria
+    hot.hot_tier.add(inserted)
+    cache.query_cache.bump({row["sensor_id"] for row in rows})
+    live.broker.publish(inserted)
+    alerts.rule_engine.publish(events)
+    return list(ids)
@@ -0,0 +1,153 @@
+# Exportacion masiva de lecturas en streaming
+# Las filas se leen por bloques desde un cursor de la base de datos (sin objetos
+# ORM ni validacion Pydantic por fila) y cada bloque se codifica y envia apenas
+# esta listo, asi la memoria usada no depende del tamano del resultado.
+import csv
+import heapq
+import io
+import json
+from itertools import chain, islice
+from sqlalchemy import select
+from . import archive, crud, partitions
+from .database import SessionLocal
+
+try:
+    import pyarrow as pa
+except ImportError:  # Arrow es opcional: solo se necesita para format=arrow
+    pa = None
+
+# Filas leidas de la base de datos (y codificadas) por bloque.
+EXPORT_CHUNK = 5000
+
+COLUMNS = ("id", "sensor_id", "timestamp", "temperature", "pressure", "humidity")
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+
+def format_from_accept(accept: str):
+    # Devuelve el primer formato soportado que aparezca en el header Accept.
+    for part in accept.split(","):
+        media_type = part.split(";")[0].strip()
+        for name, supported in MEDIA_TYPES.items():
+            if media_type == supported:
+                return name
+    return None
+
+
+def _select(source, conditions: list):
+    # Orden cronologico: el indice (sensor_id, timestamp) evita ordenar en memoria.
+    return select(*(getattr(source, column) for column in COLUMNS))\
+        .where(*conditions)\
+        .order_by(source.timestamp, source.id)
+
+
+def _iter_chunks(filters: dict):
+    # La sesion vive dentro del generador: el streaming continua despues de que
+    # termina la funcion del endpoint.
+    # Las particiones mensuales no se solapan, asi que recorrerlas en orden una por
+    # una da el orden cronologico total sin ordenar la union completa.
+    with SessionLocal() as db:
+        chunks = _partition_chunks(db, filters)
+        if not archive.has_blocks(db, filters):
+            yield from chunks
+            return
+        # Con lecturas archivadas se mezclan los dos flujos ya ordenados por (timestamp, id)
+        rows = heapq.merge(chain.from_iterable(chunks), archive.iter_rows(db, filters),
+                           key=lambda row: (row[2], row[0]))
+        while True:
+            chunk = list(islice(rows, EXPORT_CHUNK))
+            if not chunk:
+                return
+            yield chunk
+
+
+def _partition_chunks(db, filters: dict):
+    names = partitions.partitions_in_range(db, filters.get("start_date"), filters.get("end_date"))
+    for name in names:
+        source = partitions.partition_entity(name)
+        conditions = crud.reading_filters(**filters, source=source)
+        result = db.execute(_select(source, conditions).execution_options(yield_per=EXPORT_CHUNK))
+        for rows in result.partitions():
+            yield rows
+
+
+def _ndjson(filters: dict):
+    for rows in _iter_chunks(filters):
+        lines = []
+        for row in rows:
+            record = dict(zip(COLUMNS, row))
+            record["timestamp"] = record["timestamp"].isoformat()
+            lines.append(json.dumps(record))
+        yield ("\n".join(lines) + "\n").encode()
+
+
+def _csv(filters: dict):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for rows in _iter_chunks(filters):
+        for row in rows:
+            writer.writerow((row[0], row[1], row[2].isoformat(), row[3], row[4], row[5]))
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+class _ChunkSink:
+    # Destino de escritura para el writer de Arrow que acumula los bytes
+    # de cada record batch hasta que se envian.
+    def __init__(self):
+        self.parts = []
+        self.closed = False
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self) -> bytes:
+        data = b"".join(self.parts)
+        self.parts = []
+        return data
+
+
+def _arrow(filters: dict):
+    schema = pa.schema([("id", pa.int64()),
+                        ("sensor_id", pa.int32()),
+                        ("timestamp", pa.timestamp("us")),
+                        ("temperature", pa.float64()),
+                        ("pressure", pa.float64()),
+                        ("humidity", pa.float64())])
+    sink = _ChunkSink()
+    writer = pa.ipc.new_stream(sink, schema)
+    yield sink.take()
+    for rows in _iter_chunks(filters):
+        columns = list(zip(*rows))
+        batch = pa.record_batch([pa.array(values, type=field.type)
+                                 for values, field in zip(columns, schema)], schema=schema)
+        writer.write_batch(batch)
+        yield sink.take()
+    writer.close()
+    yield sink.take()
+
+
+ENCODERS = {"ndjson": _ndjson, "csv": _csv, "arrow": _arrow}
+
+
+def stream_readings(filters: dict, fmt: str):
+    """
+    Devuelve un generador de bytes con las lecturas que cumplen los filtros
+    (argumentos de crud.reading_filters), codificadas en `fmt` ('ndjson', 'csv' o 'arrow').
+    """
+    return ENCODERS[fmt](filters)
@@ -1,19 +1,98 @@
 import os
-import pandas as pd
-from typing import Optional, Dict, Any
+import json
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, Any, Literal
 from datetime import datetime
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Query, Request, Response
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from . import crud, models, schemas
-from .database import SessionLocal, engine
+from fastapi.concurrency import run_in_threadpool
+from pydantic import TypeAdapter, ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import alerts, archive, cache, crud, export, hot, live, metrics, migrations, partitions, rollups, schemas, sensor_state, stats
+from .database import AsyncSessionLocal, SessionLocal, async_engine, engine
+from .writer import writer
+
+# Nivel de log configurable con la variable de entorno LOG_LEVEL (INFO por defecto)
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(),
+                    format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+log = logging.getLogger(__name__)
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 STATIC_DIR = os.path.join(BASE_DIR, "static")
-models.Base.metadata.create_all(bind=engine)
-app = FastAPI()
+
+# Numero maximo de lecturas aceptadas por POST /readings/batch.
+# Lotes mas grandes se rechazan con 413; el cliente debe dividirlos.
+MAX_BATCH_SIZE = 5000
+migrations.init_db(engine)
+with SessionLocal() as _db:
+    rollups.ensure_rollups(_db)
+    sensor_state.ensure_state(_db)
+    # Precarga las lecturas recientes en la capa caliente en memoria
+    hot.hot_tier.warm(_db)
+    # Reglas de alerta, alertas abiertas y ultima lectura de cada sensor
+    alerts.rule_engine.load(_db)
+
+async def retention_loop():
+    # Borra periodicamente las particiones mensuales fuera del periodo de retencion.
+    while True:
+        try:
+            async with AsyncSessionLocal() as db:
+                dropped = await db.run_sync(partitions.apply_retention)
+                await db.run_sync(archive.apply_retention)
+                await db.commit()
+            if dropped:
+                cache.query_cache.invalidate_all()
+                log.info("[RETENCION] Particiones borradas: %s", ", ".join(dropped))
+        except Exception as e:
+            # Otro worker puede estar aplicando la misma retencion; se reintenta en la siguiente vuelta
+            log.warning("[RETENCION] Error aplicando retencion: %s", e)
+        await asyncio.sleep(partitions.RETENTION_INTERVAL_S)
+
+async def archive_loop():
+    # Mueve las lecturas de mas de ARCHIVE_AFTER_DAYS dias a bloques comprimidos.
+    # Corre en un hilo con su propia sesion: comprimir no debe frenar el event loop.
+    while True:
+        try:
+            moved = await asyncio.to_thread(archive.archive_old_readings)
+            if moved:
+                log.info("[ARCHIVO] %d lecturas archivadas", moved)
+        except Exception as e:
+            log.warning("[ARCHIVO] Error archivando lecturas: %s", e)
+        await asyncio.sleep(partitions.RETENTION_INTERVAL_S)
+
+async def stale_alerts_loop():
+    # Abre las alertas de las reglas 'stale' para los sensores que dejaron de enviar lecturas.
+    while True:
+        await asyncio.sleep(alerts.ALERT_STALE_CHECK_S)
+        try:
+            async with AsyncSessionLocal() as db:
+                evaluation = await db.run_sync(alerts.rule_engine.check_stale)
+                await db.commit()
+            alerts.rule_engine.publish(alerts.rule_engine.apply(evaluation))
+        except Exception as e:
+            log.warning("[ALERTAS] Error revisando sensores sin lecturas: %s", e)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Tarea unica que serializa y agrupa las escrituras
+    writer.start()
+    retention = asyncio.create_task(retention_loop()) if partitions.RETENTION_MONTHS else None
+    archiving = asyncio.create_task(archive_loop()) if archive.ARCHIVE_AFTER_DAYS is not None else None
+    stale_alerts = asyncio.create_task(stale_alerts_loop())
+    yield
+    stale_alerts.cancel()
+    for task in (retention, archiving):
+        if task is not None:
+            task.cancel()
+    await writer.stop()
+    await async_engine.dispose()
+
+app = FastAPI(lifespan=lifespan)
 app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
 
 origins = [
@@ -29,14 +108,53 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
-def get_db():
-    db = SessionLocal()
-    try:
+# Serializadores de las respuestas que se guardan en cache (ya codificadas en JSON)
+READINGS_JSON = TypeAdapter(list[schemas.SensorReading])
+SERIES_JSON = TypeAdapter(list[schemas.SeriesPoint])
+STATS_JSON = TypeAdapter(Dict[str, Any])
+
+async def cached_query(request: Request, endpoint: str, params: dict, compute):
+    """
+    Responde desde el cache de consultas si los datos no cambiaron.
+
+    `compute` es una corrutina que devuelve (cuerpo JSON, headers extra) y solo se
+    ejecuta si no hay una entrada vigente. Si el cliente envia If-None-Match con el
+    ETag actual se responde 304 sin consultar la base de datos.
+    """
+    key = cache.query_cache.key(endpoint, params)
+    token = cache.query_cache.token(params.get("sensor_id"))
+    etag = cache.query_cache.etag(key, token)
+    # no-cache: el navegador guarda la respuesta pero la revalida con If-None-Match
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if cache.query_cache.not_modified_for(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    entry = cache.query_cache.get(key, token)
+    if entry is None:
+        start = time.perf_counter()
+        body, extra_headers = await compute()
+        metrics.QUERY_SECONDS[endpoint].observe(time.perf_counter() - start)
+        cache.query_cache.put(key, token, body, extra_headers)
+    else:
+        body, extra_headers = entry.body, entry.headers
+    return Response(content=body, media_type="application/json", headers={**extra_headers, **headers})
+
+async def get_db():
+    # Sesion asincrona para lecturas cortas; las consultas de crud se ejecutan con run_sync
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
+
+async def run_query(function, *args, **kwargs):
+    # Consultas que pueden recorrer muchas filas (/readings/, /readings/stats/,
+    # /readings/series): run_sync las correria en el hilo del event loop y frenaria al
+    # escritor y a los streams, asi que van al threadpool con una sesion sincrona propia.
+    def run():
+        with SessionLocal() as db:
+            return function(db, *args, **kwargs)
+    return await run_in_threadpool(run)
 
 @app.get("/", response_class=HTMLResponse)
 async def read_root():
@@ -44,12 +162,69 @@ async def read_root():
         return HTMLResponse(content=f.read(), status_code=200)
 
 @app.post("/readings/", response_model=schemas.SensorReading)
-def create_reading(reading: schemas.SensorReadingCreate, db: Session = Depends(get_db)):
-    return crud.create_reading(db=db, reading=reading)
+async def create_reading(reading: schemas.SensorReadingCreate):
+    ids = await writer.submit([reading])
+    return schemas.SensorReading(id=ids[0], **reading.model_dump())
+
+@app.post("/readings/batch", response_model=schemas.SensorReadingBatchResult)
+async def create_readings_batch(request: Request):
+    # Acepta una lista JSON de lecturas, o NDJSON (una lectura por linea) si el
+    # Content-Type es application/x-ndjson. Maximo MAX_BATCH_SIZE lecturas por peticion.
+    # Las lecturas validas se insertan en una sola transaccion; las invalidas se
+    # reportan por indice en "results" sin afectar al resto del lote.
+    body = await request.body()
+    content_type = request.headers.get("content-type", "")
+
+    if "ndjson" in content_type:
+        lines = [line for line in body.splitlines() if line.strip()]
+        items = []
+        for line in lines:
+            try:
+                items.append(json.loads(line))
+            except json.JSONDecodeError as e:
+                items.append(e)
+    else:
+        try:
+            items = json.loads(body)
+        except json.JSONDecodeError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid JSON: {e}")
+        if not isinstance(items, list):
+            raise HTTPException(status_code=422, detail="Expected a JSON list of readings")
+
+    if len(items) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413,
+                            detail=f"Batch too large: {len(items)} readings (max {MAX_BATCH_SIZE})")
+
+    results = []
+    valid = []
+    valid_idx = []
+    for i, item in enumerate(items):
+        if isinstance(item, Exception):
+            results.append(schemas.SensorReadingBatchItem(index=i, status="error", error=f"Invalid JSON: {item}"))
+            continue
+        try:
+            valid.append(schemas.SensorReadingCreate.model_validate(item))
+            valid_idx.append(i)
+            results.append(None)
+        except ValidationError as e:
+            message = "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+            results.append(schemas.SensorReadingBatchItem(index=i, status="error", error=message))
+
+    if len(valid) < len(items):
+        metrics.BATCH_ITEMS_REJECTED.inc(len(items) - len(valid))
+    ids = await writer.submit(valid)
+    for i, reading_id in zip(valid_idx, ids):
+        results[i] = schemas.SensorReadingBatchItem(index=i, status="ok", id=reading_id)
+
+    return schemas.SensorReadingBatchResult(inserted=len(ids),
+                                            failed=len(items) - len(ids),
+                                            results=results)
 
 @app.get("/readings/", response_model=list[schemas.SensorReading])
-def read_readings(skip: int = 0,
+async def read_readings(request: Request,
+                  skip: int = 0,
                   limit: int = 100,
+                  cursor: Optional[str] = None,
                   sensor_id: Optional[int] = None,
                   start_date: Optional[datetime] = None,
                   end_date: Optional[datetime] = None,
@@ -58,22 +233,107 @@ def read_readings(skip: int = 0,
                   min_pres: Optional[float] = None,
                   max_pres: Optional[float] = None,
                   min_humi: Optional[float] = None,
-                  max_humi: Optional[float] = None,
-                  db: Session = Depends(get_db)):
-    readings = crud.get_filtered_readings(db, skip = skip, limit = limit,
-                                          sensor_id = sensor_id,
-                                          start_date = start_date,
-                                          end_date = end_date,
-                                          min_temp = min_temp,
-                                          max_temp = max_temp,
-                                          min_pres = min_pres,
-                                          max_pres = max_pres,
-                                          min_humi = min_humi,
-                                          max_humi = max_humi)
-    return readings
+                  max_humi: Optional[float] = None):
+    # Paginacion por cursor: si la pagina esta completa, el header X-Next-Cursor
+    # trae el cursor de la siguiente; se pasa como ?cursor=... (skip se ignora).
+    try:
+        after = crud.decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    filters = dict(sensor_id = sensor_id,
+                   start_date = start_date,
+                   end_date = end_date,
+                   min_temp = min_temp,
+                   max_temp = max_temp,
+                   min_pres = min_pres,
+                   max_pres = max_pres,
+                   min_humi = min_humi,
+                   max_humi = max_humi)
+
+    def query(db):
+        # Primero la capa caliente en memoria; si la pagina no cae en su ventana, SQLite
+        readings = hot.hot_tier.readings(skip, limit, cursor = after, **filters)
+        if readings is None:
+            readings = crud.get_filtered_readings(db, skip = skip, limit = limit, cursor = after, **filters)
+        return readings
+
+    async def compute():
+        readings = await run_query(query)
+        headers = {}
+        if readings and len(readings) == limit:
+            headers["X-Next-Cursor"] = crud.encode_cursor(readings[-1])
+        return READINGS_JSON.dump_json(READINGS_JSON.validate_python(readings, from_attributes=True)), headers
+
+    return await cached_query(request, "readings",
+                              {"skip": skip, "limit": limit, "cursor": cursor, **filters}, compute)
+
+@app.get("/readings/live")
+async def live_readings(sensor_id: list[int] = Query(default=[])):
+    # Stream Server-Sent Events con cada lectura apenas se guarda.
+    # Se puede repetir sensor_id para filtrar varios sensores; sin filtro llegan todas.
+    # Si el cliente no consume a tiempo se descartan las mas antiguas y se envia
+    # un evento "dropped" con la cantidad perdida.
+    subscriber = live.broker.subscribe(sensor_id)
+    return StreamingResponse(live.broker.events(subscriber),
+                             media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+@app.get("/readings/export")
+def export_readings(request: Request,
+                    format: Optional[Literal["ndjson", "csv", "arrow"]] = None,
+                    sensor_id: Optional[int] = None,
+                    start_date: Optional[datetime] = None,
+                    end_date: Optional[datetime] = None,
+                    min_temp: Optional[float] = None,
+                    max_temp: Optional[float] = None,
+                    min_pres: Optional[float] = None,
+                    max_pres: Optional[float] = None,
+                    min_humi: Optional[float] = None,
+                    max_humi: Optional[float] = None):
+    # Exporta todas las lecturas filtradas en orden cronologico, en streaming.
+    # El formato se elige con ?format= o, si no se indica, con el header Accept (NDJSON por defecto).
+    fmt = format or export.format_from_accept(request.headers.get("accept", "")) or "ndjson"
+    if fmt == "arrow" and export.pa is None:
+        raise HTTPException(status_code=501, detail="Arrow export requires pyarrow to be installed")
+
+    filters = dict(sensor_id = sensor_id,
+                   start_date = start_date,
+                   end_date = end_date,
+                   min_temp = min_temp,
+                   max_temp = max_temp,
+                   min_pres = min_pres,
+                   max_pres = max_pres,
+                   min_humi = min_humi,
+                   max_humi = max_humi)
+
+    return StreamingResponse(export.stream_readings(filters, fmt),
+                             media_type=export.MEDIA_TYPES[fmt])
+
+@app.get("/readings/series", response_model=list[schemas.SeriesPoint])
+async def read_series(request: Request,
+                bucket: Literal["1m", "5m", "1h", "1d"] = "1h",
+                sensor_id: Optional[int] = None,
+                start_date: Optional[datetime] = None,
+                end_date: Optional[datetime] = None):
+    # Serie temporal agregada por intervalo, leida de las tablas de rollups.
+    params = dict(bucket = bucket,
+                  sensor_id = sensor_id,
+                  start_date = start_date,
+                  end_date = end_date)
+
+    async def compute():
+        series = await run_query(rollups.get_series, bucket,
+                                 sensor_id = sensor_id,
+                                 start_date = start_date,
+                                 end_date = end_date)
+        return SERIES_JSON.dump_json(SERIES_JSON.validate_python(series)), {}
+
+    return await cached_query(request, "series", params, compute)
 
 @app.get("/readings/stats/", response_model=Dict[str, Any])
-def get_reading_stats(sensor_id: Optional[int] = None,
+async def get_reading_stats(request: Request,
+                  sensor_id: Optional[int] = None,
                   start_date: Optional[datetime] = None,
                   end_date: Optional[datetime] = None,
                   min_temp: Optional[float] = None,
@@ -82,32 +342,118 @@ def get_reading_stats(sensor_id: Optional[int] = None,
                   max_pres: Optional[float] = None,
                   min_humi: Optional[float] = None,
                   max_humi: Optional[float] = None,
-                  db: Session = Depends(get_db)):
+                  group_by: Optional[Literal["sensor_id"]] = None,
+                  percentiles: bool = True):
+    # Las agregaciones se calculan en SQL sobre todas las filas filtradas.
+    # Los percentiles (25%/50%/75%) son aproximados si hay mas de stats.SAMPLE_SIZE filas
+    # (menos al agrupar por sensor: los reservorios de todos los grupos suman stats.SAMPLE_TOTAL);
+    # percentiles=false los omite y evita recorrer el resultado.
+    filters = dict(sensor_id = sensor_id,
+                   start_date = start_date,
+                   end_date = end_date,
+                   min_temp = min_temp,
+                   max_temp = max_temp,
+                   min_pres = min_pres,
+                   max_pres = max_pres,
+                   min_humi = min_humi,
+                   max_humi = max_humi)
+
+    def query(db):
+        # Con start_date dentro de la ventana de la capa caliente no se consulta SQLite
+        result = hot.hot_tier.stats(filters,
+                                    group_by_sensor = group_by == "sensor_id",
+                                    percentiles = percentiles)
+        if result is None:
+            result = stats.get_filtered_stats(db, filters,
+                                              group_by_sensor = group_by == "sensor_id",
+                                              percentiles = percentiles)
+        return result
+
+    async def compute():
+        return STATS_JSON.dump_json(await run_query(query)), {}
+
+    return await cached_query(request, "stats",
+                              {"group_by": group_by, "percentiles": percentiles, **filters}, compute)
+
+@app.get("/sensors", response_model=list[schemas.SensorState])
+async def read_sensors(db: AsyncSession = Depends(get_db)):
+    # Ultima lectura y estadisticas de toda la historia de cada sensor,
+    # leidas de la tabla sensor_state (una fila por sensor).
+    return await db.run_sync(sensor_state.get_states)
+
+@app.get("/sensors/{sensor_id}", response_model=schemas.SensorState)
+async def read_sensor(sensor_id: int, db: AsyncSession = Depends(get_db)):
+    state = await db.run_sync(sensor_state.get_state, sensor_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail="Sensor not found")
+    return state
+
+@app.get("/alerts", response_model=list[schemas.Alert])
+async def read_alerts(sensor_id: Optional[int] = None,
+                      open: Optional[bool] = None,
+                      limit: int = Query(default=100, ge=1, le=alerts.ALERTS_MAX_LIMIT),
+                      db: AsyncSession = Depends(get_db)):
+    # Alertas mas recientes primero; open=true solo las abiertas, open=false solo las cerradas.
+    return await db.run_sync(alerts.get_alerts, sensor_id = sensor_id, open = open, limit = limit)
 
-    readings = crud.get_filtered_readings(db, skip = 0, limit = 10000,
-                                          sensor_id = sensor_id,
-                                          start_date = start_date,
-                                          end_date = end_date,
-                                          min_temp = min_temp,
-                                          max_temp = max_temp,
-                                          min_pres = min_pres,
-                                          max_pres = max_pres,
-                                          min_humi = min_humi,
-                                          max_humi = max_humi)
+@app.get("/alerts/live")
+async def live_alerts(sensor_id: list[int] = Query(default=[])):
+    # Stream Server-Sent Events con cada apertura ("event": "open") y cierre
+    # ("event": "close") de alertas; se filtra por sensor igual que /readings/live.
+    subscriber = alerts.broker.subscribe(sensor_id)
+    return StreamingResponse(alerts.broker.events(subscriber),
+                             media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
 
-    df = pd.DataFrame([reading.__dict__ for reading in readings])
-    df = df.drop(columns=['_sa_instance_state'], errors='ignore')
-    number_col = ['temperature', 'pressure', 'humidity']
-    df_num = df[number_col]
-    stats_df = df_num.describe()
-    stats = {
-        'count': len(df),
-        'stats': stats_df.to_dict()
-    }
+@app.get("/alerts/rules", response_model=list[schemas.AlertRule])
+async def read_alert_rules(db: AsyncSession = Depends(get_db)):
+    return await db.run_sync(alerts.get_rules)
 
-    return stats
+@app.post("/alerts/rules", response_model=schemas.AlertRule)
+async def create_alert_rule(rule: schemas.AlertRuleCreate, db: AsyncSession = Depends(get_db)):
+    # La regla se aplica desde la siguiente lectura guardada
+    return await db.run_sync(alerts.create_rule, rule)
 
+@app.delete("/alerts/rules/{rule_id}")
+async def delete_alert_rule(rule_id: int, db: AsyncSession = Depends(get_db)):
+    # Borra la regla y cierra sus alertas abiertas
+    if not await db.run_sync(alerts.delete_rule, rule_id):
+        raise HTTPException(status_code=404, detail="Rule not found")
+    return {"deleted": rule_id}
 
+@app.get("/cache/stats", response_model=Dict[str, Any])
+async def get_cache_stats():
+    # Aciertos, fallos y desalojos del cache de consultas, para dimensionarlo
+    # (QUERY_CACHE_MAX_ENTRIES).
+    return cache.query_cache.stats()
 
+@app.get("/hot/stats", response_model=Dict[str, Any])
+async def get_hot_tier_stats():
+    # Estado de la capa caliente: ventana cubierta, lecturas y memoria usada
+    # (acotada por HOT_TIER_MAX_READINGS), y consultas respondidas desde ella.
+    return hot.hot_tier.stats_summary()
 
+@app.get("/archive/stats", response_model=Dict[str, Any])
+async def get_archive_stats():
+    # Bloques y lecturas archivadas, bytes que ocupan y rango de fechas cubierto.
+    return await run_query(archive.summary)
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    # Metricas en formato de texto de Prometheus: latencia de inserciones y
+    # consultas, lecturas guardadas y rechazadas, y contadores del cache.
+    # Son de este proceso; con varios workers de uvicorn cada uno tiene las suyas.
+    cache_stats = cache.query_cache.stats()
+    extra = [("final_cache_hits_total", "counter", "Consultas respondidas desde el cache", cache_stats["hits"]),
+             ("final_cache_misses_total", "counter", "Consultas que fueron a la base de datos", cache_stats["misses"]),
+             ("final_cache_not_modified_total", "counter", "Respuestas 304 por If-None-Match", cache_stats["not_modified"]),
+             ("final_cache_evictions_total", "counter", "Entradas desalojadas del cache", cache_stats["evictions"]),
+             ("final_cache_entries", "gauge", "Entradas guardadas en el cache", cache_stats["entries"]),
+             ("final_write_transactions_total", "counter", "Transacciones hechas por el escritor", writer.transactions)]
+    hot_stats = hot.hot_tier.stats_summary()
+    extra += [("final_hot_tier_hits_total", "counter", "Consultas respondidas desde la capa caliente", hot_stats["hits"]),
+              ("final_hot_tier_misses_total", "counter", "Consultas que la capa caliente envio a SQL", hot_stats["misses"]),
+              ("final_hot_tier_readings", "gauge", "Lecturas guardadas en la capa caliente", hot_stats["readings"]),
+              ("final_hot_tier_bytes", "gauge", "Memoria usada por la capa caliente", hot_stats["bytes"]),
+              ("final_alerts_open", "gauge", "Alertas abiertas", alerts.rule_engine.open_alerts())]
+    return PlainTextResponse(metrics.render(extra), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,454 @@
+# Capa caliente en memoria con las lecturas recientes
+# Cada sensor tiene un buffer circular en columnas (arreglos NumPy) con sus
+# lecturas de las ultimas HOT_TIER_HOURS horas. Se llena al insertar y se
+# precarga desde la base de datos al iniciar. Las consultas de /readings/ y
+# /readings/stats/ que caen completas en esa ventana se responden aqui con
+# mascaras vectorizadas, sin pasar por SQLite ni crear objetos ORM; las demas
+# devuelven None y se resuelven en SQL como siempre.
+#
+# La capa es de cada proceso: con varios workers de uvicorn un worker no ve lo
+# que insertan los otros y responderia sin esas lecturas. Por eso viene desactivada
+# y se activa con HOT_TIER_HOURS solo cuando el servidor corre con un worker.
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from sqlalchemy import String, select, type_coerce
+from sqlalchemy.orm import Session
+from . import partitions, stats
+
+try:
+    import numpy as np
+except ImportError:  # NumPy es opcional: sin el todas las consultas van a SQL
+    np = None
+
+# Horas de lecturas recientes que se mantienen en memoria (0 = desactivada).
+HOT_TIER_HOURS = float(os.getenv("HOT_TIER_HOURS", 0))
+# Maximo de lecturas en memoria sumando todos los sensores. Cada lectura ocupa
+# HOT_TIER_ROW_BYTES, asi que el valor por defecto limita la capa a ~80 MB.
+HOT_TIER_MAX_READINGS = int(os.getenv("HOT_TIER_MAX_READINGS", 2_000_000))
+# Capacidad inicial del buffer de un sensor; se duplica mientras quepa en el maximo.
+HOT_TIER_INITIAL_CAPACITY = 64
+# Cada cuantos segundos se liberan los buffers de sensores sin lecturas en la ventana
+# y se achican los que guardan lecturas que ya salieron de ella.
+HOT_TIER_SWEEP_S = 60
+
+METRICS = stats.METRICS
+# id y timestamp (int64, microsegundos) mas las metricas (float64)
+HOT_TIER_ROW_BYTES = 8 * (2 + len(METRICS))
+
+# Filtros de rango de la API por metrica
+FILTERS = (("temperature", "min_temp", "max_temp"),
+           ("pressure", "min_pres", "max_pres"),
+           ("humidity", "min_humi", "max_humi"))
+
+EPOCH = datetime(1970, 1, 1)
+# Limite inferior "sin lecturas expulsadas"
+NO_EVICTIONS = -(1 << 62)
+
+
+def to_micros(ts: datetime) -> int:
+    # Igual que SQLite, se usa la hora "de pared" del datetime sin la zona horaria.
+    return (ts.replace(tzinfo=None) - EPOCH) // timedelta(microseconds=1)
+
+
+def from_micros(micros: int) -> datetime:
+    return EPOCH + timedelta(microseconds=micros)
+
+
+class SensorRing:
+    """
+    Buffer circular de las lecturas de un sensor, una columna por campo.
+
+    Las filas validas son las primeras `size`; cuando esta lleno, `start` es la
+    mas antigua en orden de llegada (la siguiente que se sobrescribe). Las
+    lecturas no se guardan ordenadas: las consultas ordenan lo que seleccionan.
+    """
+
+    def __init__(self, capacity: int):
+        self.columns = {"id": np.empty(capacity, np.int64), "timestamp": np.empty(capacity, np.int64)}
+        for metric in METRICS:
+            self.columns[metric] = np.empty(capacity, np.float64)
+        self.size = 0
+        self.start = 0
+        # Mayor timestamp expulsado: todas las lecturas posteriores estan en el buffer.
+        self.evicted = NO_EVICTIONS
+        # Mayor timestamp recibido (para saltear el buffer en consultas de otro rango)
+        self.newest = NO_EVICTIONS
+
+    @property
+    def capacity(self) -> int:
+        return len(self.columns["id"])
+
+    def nbytes(self) -> int:
+        return sum(column.nbytes for column in self.columns.values())
+
+    def view(self) -> dict:
+        return {name: column[:self.size] for name, column in self.columns.items()}
+
+    def grow(self, capacity: int):
+        order = (self.start + np.arange(self.size)) % self.capacity
+        for name, column in self.columns.items():
+            grown = np.empty(capacity, column.dtype)
+            grown[:self.size] = column[order]
+            self.columns[name] = grown
+        self.start = 0
+
+    def trim(self, window_start: int) -> int:
+        # Deja solo las lecturas desde window_start (en orden de llegada) en un buffer
+        # del tamano justo, potencia de 2. Devuelve la capacidad nueva.
+        order = (self.start + np.arange(self.size)) % self.capacity
+        timestamps = self.columns["timestamp"][order]
+        old = timestamps < window_start
+        if old.any():
+            self.evicted = max(self.evicted, int(timestamps[old].max()))
+        keep = order[~old]
+        capacity = HOT_TIER_INITIAL_CAPACITY
+        while capacity < len(keep):
+            capacity *= 2
+        for name, column in self.columns.items():
+            trimmed = np.empty(capacity, column.dtype)
+            trimmed[:len(keep)] = column[keep]
+            self.columns[name] = trimmed
+        self.size = len(keep)
+        self.start = 0
+        return capacity
+
+    def extend(self, rows: dict, n: int):
+        # Si llegan mas filas que la capacidad solo se guardan las ultimas.
+        self.newest = max(self.newest, int(rows["timestamp"].max()))
+        capacity = self.capacity
+        if n > capacity:
+            self.evicted = max(self.evicted, int(rows["timestamp"][:n - capacity].max()))
+            rows = {name: values[n - capacity:] for name, values in rows.items()}
+            n = capacity
+        overflow = self.size + n - capacity
+        if overflow > 0:
+            evicted = (self.start + np.arange(overflow)) % capacity
+            self.evicted = max(self.evicted, int(self.columns["timestamp"][evicted].max()))
+        positions = (self.start + self.size + np.arange(n)) % capacity
+        for name, column in self.columns.items():
+            column[positions] = rows[name]
+        if overflow > 0:
+            self.start = (self.start + overflow) % capacity
+        self.size = min(capacity, self.size + n)
+
+
+class Selection:
+    """
+    Vista de solo lectura sobre los buffers de varios sensores, como si fueran
+    una sola tabla. Las columnas se concatenan solo cuando hacen falta enteras
+    (para las mascaras); las demas se leen solo en las filas elegidas.
+    """
+
+    def __init__(self, rings: dict):
+        self.sensor_ids = np.fromiter(rings, np.int64, len(rings))
+        self.views = [ring.view() for ring in rings.values()]
+        self.offsets = np.cumsum([0] + [ring.size for ring in rings.values()])
+        self._columns = {}
+
+    def column(self, name: str):
+        if name not in self._columns:
+            if name == "sensor_id":
+                self._columns[name] = np.repeat(self.sensor_ids, np.diff(self.offsets))
+            elif self.views:
+                self._columns[name] = np.concatenate([view[name] for view in self.views])
+            else:
+                self._columns[name] = np.empty(0, np.int64 if name in ("id", "timestamp") else np.float64)
+        return self._columns[name]
+
+    def take(self, name: str, rows):
+        # Valores de la columna en `rows` (indices crecientes), sin concatenar la columna.
+        if name in self._columns or len(self.views) <= 1:
+            return self.column(name)[rows] if self.views else self.column(name)[:0]
+        bounds = np.searchsorted(rows, self.offsets)
+        if name == "sensor_id":
+            return np.repeat(self.sensor_ids, np.diff(bounds))
+        out = np.empty(len(rows), self.views[0][name].dtype)
+        for index in np.flatnonzero(np.diff(bounds)):
+            first, last = bounds[index], bounds[index + 1]
+            out[first:last] = self.views[index][name][rows[first:last] - self.offsets[index]]
+        return out
+
+
+class HotReading:
+    # Lectura devuelta por la capa caliente; tiene los mismos atributos que
+    # models.SensorReadings para serializarla y armar el cursor igual.
+    __slots__ = ("id", "sensor_id", "timestamp", "temperature", "pressure", "humidity")
+
+    def __init__(self, id, sensor_id, timestamp, temperature, pressure, humidity):
+        self.id = id
+        self.sensor_id = sensor_id
+        self.timestamp = timestamp
+        self.temperature = temperature
+        self.pressure = pressure
+        self.humidity = humidity
+
+
+class HotTier:
+    def __init__(self, hours: float = HOT_TIER_HOURS, max_readings: int = HOT_TIER_MAX_READINGS):
+        self.enabled = np is not None and hours > 0
+        self.window = int(hours * 3600 * 1_000_000)
+        self.max_readings = max_readings
+        self.rings = {}
+        # Lecturas anteriores a esto nunca se cargaron (se fija al precargar).
+        self.loaded_from = None
+        self.capacity = 0
+        # Mayor timestamp de las lecturas que no se guardaron por falta de espacio para
+        # un buffer nuevo. Las expulsiones de cada buffer se llevan en el buffer.
+        self.refused = NO_EVICTIONS
+        self._next_sweep = 0
+        self._lock = threading.Lock()
+        # Estadisticas: consultas respondidas aqui y enviadas a SQL
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _now() -> int:
+        return to_micros(datetime.now(timezone.utc))
+
+    def _floor(self) -> int:
+        # Desde aqui (inclusive) todas las lecturas pasaron por la capa.
+        return max(self.loaded_from, self._now() - self.window)
+
+    def warm(self, db: Session):
+        """
+        Carga las lecturas de la ventana desde las particiones, en orden
+        cronologico. Debe llamarse una vez al iniciar, antes de recibir lecturas.
+        """
+        if not self.enabled:
+            return
+        start = self._now() - self.window
+        self.loaded_from = start
+        start_date = from_micros(start)
+        for name in partitions.partitions_in_range(db, start_date, None):
+            source = partitions.partition_entity(name)
+            # El timestamp se lee como texto y NumPy lo convierte de una vez por bloque
+            stmt = select(source.id, source.sensor_id, type_coerce(source.timestamp, String),
+                          *(getattr(source, metric) for metric in METRICS))\
+                .where(source.timestamp >= start_date)\
+                .order_by(source.timestamp)
+            result = db.execute(stmt.execution_options(yield_per=stats.STREAM_CHUNK))
+            for chunk in result.partitions():
+                ids, sensor_ids, timestamps, *values = zip(*chunk)
+                columns = {"id": np.array(ids, np.int64),
+                           "timestamp": np.array(timestamps, "datetime64[us]").astype(np.int64)}
+                columns.update((metric, np.array(column, np.float64)) for metric, column in zip(METRICS, values))
+                self._add_columns(np.array(sensor_ids, np.int64), columns, start)
+
+    def add(self, readings: list[dict]):
+        # Lecturas recien confirmadas (diccionarios con su id). Las que ya estan
+        # fuera de la ventana no se guardan.
+        if not self.enabled or not readings or self.loaded_from is None:
+            return
+        columns = {"id": np.fromiter((r["id"] for r in readings), np.int64, len(readings)),
+                   "timestamp": np.fromiter((to_micros(r["timestamp"]) for r in readings), np.int64, len(readings))}
+        for metric in METRICS:
+            columns[metric] = np.fromiter((r[metric] for r in readings), np.float64, len(readings))
+        sensor_ids = np.fromiter((r["sensor_id"] for r in readings), np.int64, len(readings))
+        self._add_columns(sensor_ids, columns, self._now() - self.window)
+
+    def _add_columns(self, sensor_ids, columns: dict, window_start: int):
+        keep = columns["timestamp"] >= window_start
+        if not keep.all():
+            sensor_ids = sensor_ids[keep]
+            columns = {name: values[keep] for name, values in columns.items()}
+        # Agrupa por sensor manteniendo el orden de llegada dentro de cada uno
+        order = np.argsort(sensor_ids, kind="stable")
+        sensor_ids = sensor_ids[order]
+        columns = {name: values[order] for name, values in columns.items()}
+        bounds = np.flatnonzero(np.diff(sensor_ids)) + 1
+        with self._lock:
+            now = self._now()
+            if now >= self._next_sweep:
+                self._sweep(now - self.window)
+                self._next_sweep = now + HOT_TIER_SWEEP_S * 1_000_000
+            for first, last in zip(np.r_[0, bounds], np.r_[bounds, len(sensor_ids)]):
+                if first == last:
+                    continue
+                self._extend(int(sensor_ids[first]), {name: values[first:last] for name, values in columns.items()},
+                             last - first, window_start)
+
+    def _extend(self, sensor_id: int, rows: dict, n: int, window_start: int):
+        ring = self.rings.get(sensor_id)
+        if ring is None:
+            capacity = HOT_TIER_INITIAL_CAPACITY
+            while capacity < n and self.capacity + capacity * 2 <= self.max_readings:
+                capacity *= 2
+            if self.capacity + capacity > self.max_readings:
+                # Sin espacio para otro sensor: sus lecturas no quedan en la capa
+                self.refused = max(self.refused, int(rows["timestamp"].max()))
+                return
+            ring = self.rings[sensor_id] = SensorRing(capacity)
+            # Lecturas anteriores del sensor pudieron quedar fuera por falta de espacio
+            ring.evicted = self.refused
+            self.capacity += capacity
+        # Crece solo si se perderian lecturas que siguen dentro de la ventana
+        while ring.size + n > ring.capacity and self.capacity + ring.capacity <= self.max_readings \
+                and (ring.size < ring.capacity or ring.columns["timestamp"][ring.start] >= window_start):
+            self.capacity += ring.capacity
+            ring.grow(ring.capacity * 2)
+        ring.extend(rows, n)
+
+    def _sweep(self, window_start: int):
+        # Libera los buffers de sensores sin lecturas en la ventana y achica los que
+        # guardan lecturas viejas, para que ese espacio pueda crecer en los sensores activos.
+        for sensor_id, ring in list(self.rings.items()):
+            if ring.newest < window_start:
+                self.capacity -= ring.capacity
+                del self.rings[sensor_id]
+            elif ring.size and ring.columns["timestamp"][:ring.size].min() < window_start:
+                capacity = ring.capacity
+                self.capacity += ring.trim(window_start) - capacity
+
+    def _evicted(self) -> int:
+        # Limite de expulsiones de una consulta de todos los sensores: todos los buffers
+        # deben tener sus lecturas desde ahi. Las expulsiones salen de la ventana con el tiempo.
+        return max([self.refused] + [ring.evicted for ring in self.rings.values()])
+
+    def _select(self, sensor_id: Optional[int], filters: dict):
+        """
+        Lecturas de la capa que cumplen los filtros, como (Selection, filas), y
+        el limite inferior desde el que la capa tiene todas las lecturas. Las
+        filas anteriores a ese limite se excluyen: ahi la capa esta incompleta.
+        Debe llamarse con el lock tomado.
+        """
+        if sensor_id is not None:
+            ring = self.rings.get(sensor_id)
+            rings = {sensor_id: ring} if ring is not None else {}
+            # Un sensor sin buffer puede haber quedado fuera por falta de espacio
+            evicted = ring.evicted if ring is not None else self.refused
+        else:
+            rings = self.rings
+            evicted = self._evicted()
+        lower = max(self._floor(), evicted + 1)
+        # Solo se concatenan los buffers con lecturas desde el inicio del rango pedido
+        start = lower
+        if filters.get("start_date") is not None:
+            start = max(start, to_micros(filters["start_date"]))
+        selection = Selection({key: ring for key, ring in rings.items() if ring.newest >= start})
+
+        ts = selection.column("timestamp")
+        mask = ts >= lower
+        if filters.get("start_date") is not None:
+            mask &= ts >= to_micros(filters["start_date"])
+        if filters.get("end_date") is not None:
+            mask &= ts <= to_micros(filters["end_date"])
+        for metric, low, high in FILTERS:
+            if filters.get(low) is not None:
+                mask &= selection.column(metric) >= filters[low]
+            if filters.get(high) is not None:
+                mask &= selection.column(metric) <= filters[high]
+        return selection, np.flatnonzero(mask), lower
+
+    def _complete(self, filters: dict, lower: int) -> bool:
+        # El rango pedido esta entero en memoria si empieza dentro de la ventana.
+        return filters.get("start_date") is not None and to_micros(filters["start_date"]) >= lower
+
+    def readings(self, skip: int, limit: int, cursor=None, **filters) -> Optional[list]:
+        """
+        Misma pagina que crud.get_filtered_readings (timestamp desc, id desc), o
+        None si no se puede asegurar desde memoria. Sin start_date (p. ej. "las
+        ultimas 100") se responde si la pagina se completa dentro de la ventana.
+        """
+        if not self.enabled or self.loaded_from is None:
+            return None
+        needed = limit if cursor is not None else skip + limit
+        with self._lock:
+            selection, rows, lower = self._select(filters.get("sensor_id"), filters)
+            ts = selection.column("timestamp")[rows]
+            if cursor is not None:
+                cursor_ts = to_micros(cursor[0])
+                after = ts < cursor_ts
+                tied = np.flatnonzero(ts == cursor_ts)
+                after[tied] = selection.take("id", rows[tied]) < cursor[1]
+                rows, ts = rows[after], ts[after]
+            if len(rows) < needed and not self._complete(filters, lower):
+                self.misses += 1
+                return None
+            self.hits += 1
+
+            if len(rows) > needed:
+                # Solo las filas con timestamp entre los `needed` mayores (empates incluidos)
+                kth = np.partition(ts, len(ts) - needed)[len(ts) - needed]
+                rows = rows[ts >= kth]
+            page = {name: selection.take(name, rows) for name in ("id", "timestamp", "sensor_id") + METRICS}
+        order = np.lexsort((page["id"], page["timestamp"]))[::-1][:needed]
+        if cursor is None:
+            order = order[skip:]
+        values = zip(*(page[name][order].tolist() for name in ("id", "sensor_id", "timestamp") + METRICS))
+        return [HotReading(reading_id, sensor_id, from_micros(ts), *metrics)
+                for reading_id, sensor_id, ts, *metrics in values]
+
+    def stats(self, filters: dict, group_by_sensor: bool = False, percentiles: bool = True) -> Optional[dict]:
+        """
+        Mismo resultado que stats.get_filtered_stats, o None si el rango no esta
+        completo en memoria (requiere start_date dentro de la ventana). Aqui los
+        percentiles son exactos.
+        """
+        if not self.enabled or self.loaded_from is None:
+            return None
+        with self._lock:
+            selection, rows, lower = self._select(filters.get("sensor_id"), filters)
+            if not self._complete(filters, lower):
+                self.misses += 1
+                return None
+            self.hits += 1
+            columns = {name: selection.take(name, rows) for name in ("sensor_id",) + METRICS}
+        count = len(rows)
+
+        if group_by_sensor:
+            groups = []
+            if count:
+                order = np.argsort(columns["sensor_id"], kind="stable")
+                sensor_ids = columns["sensor_id"][order]
+                bounds = np.flatnonzero(np.diff(sensor_ids)) + 1
+                for first, last in zip(np.r_[0, bounds], np.r_[bounds, count]):
+                    groups.append({"sensor_id": int(sensor_ids[first]),
+                                   "count": int(last - first),
+                                   "stats": self._metric_stats(columns, order[first:last], percentiles)})
+            return {"count": count, "groups": groups}
+
+        if count == 0:
+            return {"count": 0, "stats": {}}
+        return {"count": count, "stats": self._metric_stats(columns, slice(None), percentiles)}
+
+    @staticmethod
+    def _metric_stats(columns: dict, rows, percentiles: bool) -> dict:
+        result = {}
+        for metric in METRICS:
+            values = columns[metric][rows]
+            count = len(values)
+            result[metric] = {"count": count,
+                              "mean": float(values.mean()),
+                              "std": float(values.std(ddof=1)) if count > 1 else None,
+                              "min": float(values.min()),
+                              "max": float(values.max())}
+            if percentiles:
+                quantiles = np.quantile(values, list(stats.PERCENTILES.values()))
+                for label, value in zip(stats.PERCENTILES, quantiles):
+                    result[metric][label] = float(value)
+        return result
+
+    def stats_summary(self) -> dict:
+        with self._lock:
+            readings = int(sum(ring.size for ring in self.rings.values()))
+            nbytes = sum(ring.nbytes() for ring in self.rings.values())
+            covered_from = self._floor() if self.loaded_from is not None else None
+            evicted = self._evicted()
+            if covered_from is not None and evicted != NO_EVICTIONS:
+                covered_from = max(covered_from, evicted + 1)
+            return {"enabled": self.enabled,
+                    "window_hours": self.window / 3_600_000_000,
+                    "sensors": len(self.rings),
+                    "readings": readings,
+                    "capacity": self.capacity,
+                    "max_readings": self.max_readings,
+                    "bytes": nbytes,
+                    "max_bytes": self.max_readings * HOT_TIER_ROW_BYTES,
+                    "covered_from": from_micros(covered_from).isoformat() if covered_from is not None else None,
+                    "hits": self.hits,
+                    "misses": self.misses}
+
+
+hot_tier = HotTier()
@@ -0,0 +1,106 @@
+# Difusion en vivo de las lecturas recien insertadas (Server-Sent Events)
+# crud publica cada lectura al hacer commit; cada suscriptor tiene una cola
+# acotada y, si no la consume a tiempo, se descartan sus mensajes mas antiguos.
+import asyncio
+import json
+import threading
+from typing import Iterable, Optional
+
+# Mensajes pendientes por suscriptor antes de empezar a descartar.
+LIVE_BUFFER = 1000
+# Segundos sin lecturas tras los cuales se envia un comentario para mantener viva la conexion.
+LIVE_KEEPALIVE_S = 15
+
+
+class Subscriber:
+    def __init__(self, sensor_ids: Optional[set]):
+        # None = todos los sensores
+        self.sensor_ids = sensor_ids
+        self.queue = asyncio.Queue(maxsize=LIVE_BUFFER)
+        # Mensajes descartados desde el ultimo aviso al cliente
+        self.dropped = 0
+
+    def offer(self, sensor_id: int, message: str):
+        if self.sensor_ids is not None and sensor_id not in self.sensor_ids:
+            return
+        if self.queue.full():
+            # Politica para consumidores lentos: se pierde el mensaje mas antiguo
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(message)
+
+
+class LiveBroker:
+    def __init__(self):
+        self.subscribers = set()
+        self.loop = None
+        self._lock = threading.Lock()
+
+    def subscribe(self, sensor_ids: Iterable[int] = ()) -> Subscriber:
+        # Se llama desde el event loop; se guarda para publicar desde otros hilos.
+        self.loop = asyncio.get_running_loop()
+        subscriber = Subscriber(set(sensor_ids) or None)
+        with self._lock:
+            self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        with self._lock:
+            self.subscribers.discard(subscriber)
+
+    def publish(self, readings: list[dict]):
+        """
+        Encola las lecturas para todos los suscriptores interesados.
+
+        Puede llamarse desde cualquier hilo (los endpoints sync corren en el
+        threadpool); la entrega ocurre en el event loop.
+        """
+        if not self.subscribers or self.loop is None:
+            return
+        messages = []
+        for reading in readings:
+            payload = dict(reading)
+            # Mismo formato que devuelve GET /readings/ (hora guardada, sin zona horaria)
+            payload["timestamp"] = payload["timestamp"].replace(tzinfo=None).isoformat()
+            messages.append((reading["sensor_id"], reading["id"], json.dumps(payload)))
+        self.publish_messages(messages)
+
+    def publish_messages(self, messages: list[tuple[int, int, str]]):
+        # Mensajes ya serializados (sensor_id, id del evento, JSON); lo usan otros
+        # streams como el de alertas.
+        if not self.subscribers or self.loop is None:
+            return
+        try:
+            self.loop.call_soon_threadsafe(self._deliver, messages)
+        except RuntimeError:
+            # El loop ya se cerro (apagado del servidor)
+            pass
+
+    def _deliver(self, messages):
+        with self._lock:
+            subscribers = list(self.subscribers)
+        for sensor_id, reading_id, payload in messages:
+            message = f"id: {reading_id}\ndata: {payload}\n\n"
+            for subscriber in subscribers:
+                subscriber.offer(sensor_id, message)
+
+    async def events(self, subscriber: Subscriber):
+        # Generador del stream SSE de un suscriptor.
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    message = await asyncio.wait_for(subscriber.queue.get(), timeout=LIVE_KEEPALIVE_S)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if subscriber.dropped:
+                    # Avisa al cliente que perdio lecturas, para que se resincronice
+                    yield f"event: dropped\ndata: {subscriber.dropped}\n\n"
+                    subscriber.dropped = 0
+                yield message
+        finally:
+            self.unsubscribe(subscriber)
+
+
+broker = LiveBroker()
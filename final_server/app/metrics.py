@@ -0,0 +1,106 @@
+# Metricas del servidor final en formato de texto de Prometheus (GET /metrics)
+# Son contadores en memoria del proceso: con varios workers de uvicorn cada uno
+# expone los suyos y Prometheus debe sumarlos (o usarse un solo worker).
+import bisect
+import threading
+from typing import Optional
+
+# Limites de los buckets de latencia (segundos), de 100 us a 10 s.
+BUCKETS_S = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+             0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_metrics = []
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels.items()) + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Optional[dict] = None):
+        self.name = name
+        self.help = help
+        self.labels = labels or {}
+        self.value = 0.0
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+    def lines(self) -> list[str]:
+        return [f"{self.name}{_labels(self.labels)} {self.value:g}"]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Optional[dict] = None, buckets: tuple = BUCKETS_S):
+        self.name = name
+        self.help = help
+        self.labels = labels or {}
+        self.buckets = buckets
+        # Un contador por bucket mas el de +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            self.sum += seconds
+            self.count += 1
+
+    def lines(self) -> list[str]:
+        with self._lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        lines = []
+        cumulative = 0
+        for limit, amount in zip(self.buckets + ("+Inf",), counts):
+            cumulative += amount
+            labels = dict(self.labels, le=limit if isinstance(limit, str) else f"{limit:g}")
+            lines.append(f"{self.name}_bucket{_labels(labels)} {cumulative}")
+        lines.append(f"{self.name}_sum{_labels(self.labels)} {total:.9g}")
+        lines.append(f"{self.name}_count{_labels(self.labels)} {count}")
+        return lines
+
+
+def render(extra: Optional[list[tuple[str, str, str, float]]] = None) -> str:
+    """
+    Texto de todas las metricas en el formato de exposicion de Prometheus.
+    `extra` son valores que se leen al momento (nombre, tipo, ayuda, valor),
+    p. ej. los contadores que ya llevan el cache o el escritor.
+    """
+    lines = []
+    seen = set()
+    for metric in _metrics:
+        if metric.name not in seen:
+            seen.add(metric.name)
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.lines())
+    for name, kind, help, value in extra or []:
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.append(f"{name} {value:g}")
+    return "\n".join(lines) + "\n"
+
+
+# Metricas del servidor final
+DB_INSERT_SECONDS = Histogram("final_db_insert_seconds", "Duracion de cada transaccion de insercion de lecturas")
+QUERY_SECONDS = {endpoint: Histogram("final_query_seconds", "Duracion de las consultas a la base de datos (sin cache)",
+                                     labels={"endpoint": endpoint})
+                 for endpoint in ("readings", "stats", "series")}
+
+READINGS_INSERTED = Counter("final_readings_inserted_total", "Lecturas guardadas en la base de datos")
+BATCH_ITEMS_REJECTED = Counter("final_batch_items_rejected_total", "Lecturas invalidas rechazadas en POST /readings/batch")
+WRITE_ERRORS = Counter("final_write_errors_total", "Transacciones de insercion que fallaron")
+ALERTS_OPENED = Counter("final_alerts_opened_total", "Alertas abiertas por el motor de reglas")
+ALERTS_CLOSED = Counter("final_alerts_closed_total", "Alertas cerradas por el motor de reglas")
@@ -0,0 +1,46 @@
+# Migraciones simples para bases de datos app.db existentes
+# create_all() solo crea tablas nuevas; los cambios de esquema sobre tablas que
+# ya existen se aplican aqui con sentencias idempotentes.
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from . import models, partitions
+
+MIGRATIONS = [
+    # Alertas abiertas duplicadas (varios workers antes de ix_alerts_open): queda la mas antigua
+    "UPDATE alerts SET closed_at = opened_at WHERE closed_at IS NULL AND id NOT IN "
+    "(SELECT min(id) FROM alerts WHERE closed_at IS NULL GROUP BY rule_id, sensor_id)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_alerts_open ON alerts (rule_id, sensor_id) WHERE closed_at IS NULL",
+]
+
+
+def init_db(engine: Engine):
+    # Crea las tablas (excepto las vistas), aplica las migraciones y prepara las particiones.
+    tables = [table for table in models.Base.metadata.sorted_tables if not table.info.get("is_view")]
+    models.Base.metadata.create_all(bind=engine, tables=tables)
+    run_migrations(engine)
+
+
+def run_migrations(engine: Engine):
+    with engine.begin() as conn:
+        for statement in MIGRATIONS:
+            conn.execute(text(statement))
+        _block_moments(conn)
+        # La tabla unica sensor_readings se convierte en particiones mensuales + vista.
+        # Su indice (sensor_id, timestamp) ahora existe en cada particion.
+        partitions.setup(conn)
+
+
+def _block_moments(conn):
+    # Las cabeceras de los bloques archivados guardaban suma y suma de cuadrados; ahora
+    # guardan media y M2. En bloques ya archivados M2 sale de sum_sq - sum^2 / n (lo
+    # que se guardo); los que se vuelven a escribir al llegar lecturas tardias se recalculan.
+    columns = {row[1] for row in conn.execute(text("PRAGMA table_info(sensor_reading_blocks)"))}
+    for metric in ("temperature", "pressure", "humidity"):
+        if f"{metric}_sum_sq" not in columns:
+            continue
+        conn.execute(text(f"ALTER TABLE sensor_reading_blocks ADD COLUMN {metric}_mean FLOAT NOT NULL DEFAULT 0"))
+        conn.execute(text(f"ALTER TABLE sensor_reading_blocks ADD COLUMN {metric}_m2 FLOAT NOT NULL DEFAULT 0"))
+        conn.execute(text(f"UPDATE sensor_reading_blocks SET {metric}_mean = {metric}_sum / count, "
+                          f"{metric}_m2 = max({metric}_sum_sq - {metric}_sum * {metric}_sum / count, 0.0)"))
+        conn.execute(text(f"ALTER TABLE sensor_reading_blocks DROP COLUMN {metric}_sum"))
+        conn.execute(text(f"ALTER TABLE sensor_reading_blocks DROP COLUMN {metric}_sum_sq"))
@@ -1,16 +1,18 @@
 # SQLAlchemy data
 
-from sqlalchemy import Boolean, Column, DateTime, Integer, Float
+from sqlalchemy import Boolean, Column, DateTime, Integer, Float, LargeBinary, String, Index
 
 from .database import Base
 
 
 class SensorReadings(Base):
     """
-    Representa una unica lectura de un sensor almacenada en la tabla 'sensor_readings'.
+    Representa una unica lectura de un sensor, leida de la vista 'sensor_readings'.
 
     Esta clase es un modelo ORM de SQLAlchemy que mapea los objetos de Python
-    a las filas de la tabla de la base de datos.
+    a las filas de la base de datos. Las lecturas se guardan en tablas mensuales
+    (ver partitions.py) y la vista las une; por eso este modelo es de solo
+    lectura y no lo crea create_all().
 
     Atributos:
         id (Integer): Primary key auto-incremental.
@@ -23,8 +25,189 @@ class SensorReadings(Base):
     __tablename__ = "sensor_readings"
 
     id = Column(Integer, primary_key=True)
-    sensor_id = Column(Integer, nullable=False, index=True)
-    timestamp = Column(DateTime, nullable=False, index=True)
+    sensor_id = Column(Integer, nullable=False)
+    timestamp = Column(DateTime, nullable=False)
     temperature = Column(Float, nullable=False)
     pressure = Column(Float, nullable=False)
     humidity = Column(Float, nullable=False)
+
+    # Los indices (timestamp) y (sensor_id, timestamp) estan en cada particion.
+    __table_args__ = {"info": {"is_view": True}}
+
+
+class SensorReadingRollup(Base):
+    """
+    Agregado de las lecturas de un sensor dentro de un intervalo de tiempo (bucket).
+
+    Se mantiene de forma incremental al insertar lecturas, para servir series
+    temporales sin recorrer la tabla 'sensor_readings'.
+
+    Atributos:
+        sensor_id (Integer): Identificador del sensor.
+        bucket (String): Tamano del intervalo ('1m', '5m', '1h' o '1d').
+        bucket_start (Integer): Inicio del intervalo en segundos Unix.
+        count (Integer): Cantidad de lecturas en el intervalo.
+        <metrica>_sum/_min/_max (Float): Suma, minimo y maximo de cada metrica.
+    """
+    __tablename__ = "sensor_reading_rollups"
+
+    sensor_id = Column(Integer, primary_key=True)
+    bucket = Column(String(4), primary_key=True)
+    bucket_start = Column(Integer, primary_key=True)
+    count = Column(Integer, nullable=False)
+    temperature_sum = Column(Float, nullable=False)
+    temperature_min = Column(Float, nullable=False)
+    temperature_max = Column(Float, nullable=False)
+    pressure_sum = Column(Float, nullable=False)
+    pressure_min = Column(Float, nullable=False)
+    pressure_max = Column(Float, nullable=False)
+    humidity_sum = Column(Float, nullable=False)
+    humidity_min = Column(Float, nullable=False)
+    humidity_max = Column(Float, nullable=False)
+
+    __table_args__ = (
+        Index("ix_rollups_bucket_start", "bucket", "bucket_start"),
+    )
+
+
+class SensorReadingBlock(Base):
+    """
+    Lecturas archivadas de un sensor en un dia, comprimidas en columnas (ver archive.py).
+
+    La fila guarda una cabecera con la que las consultas descartan el bloque sin
+    descomprimirlo, o responden estadisticas si el bloque cae entero en los filtros.
+
+    Atributos:
+        sensor_id (Integer): Identificador del sensor.
+        day (Integer): Inicio del dia en segundos Unix.
+        count (Integer): Cantidad de lecturas del bloque.
+        first_timestamp, last_timestamp (DateTime): Lecturas mas antigua y mas reciente.
+        <metrica>_min/_max/_mean/_m2 (Float): Minimo, maximo, media y suma de los
+            cuadrados de las diferencias con la media (M2) de cada metrica.
+        data (LargeBinary): Ids y timestamps con delta-of-delta y metricas con XOR.
+    """
+    __tablename__ = "sensor_reading_blocks"
+
+    sensor_id = Column(Integer, primary_key=True)
+    day = Column(Integer, primary_key=True)
+    count = Column(Integer, nullable=False)
+    first_timestamp = Column(DateTime, nullable=False)
+    last_timestamp = Column(DateTime, nullable=False)
+    temperature_min = Column(Float, nullable=False)
+    temperature_max = Column(Float, nullable=False)
+    temperature_mean = Column(Float, nullable=False)
+    temperature_m2 = Column(Float, nullable=False)
+    pressure_min = Column(Float, nullable=False)
+    pressure_max = Column(Float, nullable=False)
+    pressure_mean = Column(Float, nullable=False)
+    pressure_m2 = Column(Float, nullable=False)
+    humidity_min = Column(Float, nullable=False)
+    humidity_max = Column(Float, nullable=False)
+    humidity_mean = Column(Float, nullable=False)
+    humidity_m2 = Column(Float, nullable=False)
+    data = Column(LargeBinary, nullable=False)
+
+    __table_args__ = (
+        Index("ix_blocks_last_timestamp", "last_timestamp"),
+        Index("ix_blocks_day", "day"),
+    )
+
+
+class SensorState(Base):
+    """
+    Estado materializado de un sensor: su ultima lectura y estadisticas de toda
+    su historia. Se actualiza en la misma transaccion que cada insercion, asi
+    GET /sensors no recorre la tabla 'sensor_readings'.
+
+    Atributos:
+        sensor_id (Integer): Identificador del sensor.
+        count (Integer): Cantidad de lecturas.
+        first_timestamp (DateTime): Fecha y hora de la lectura mas antigua.
+        last_id, last_timestamp, last_<metrica>: La lectura mas reciente.
+        <metrica>_min/_max (Float): Minimo y maximo de cada metrica.
+        <metrica>_mean/_m2 (Float): Media y suma de cuadrados de las diferencias
+            con la media (Welford), de donde sale la varianza.
+    """
+    __tablename__ = "sensor_state"
+
+    sensor_id = Column(Integer, primary_key=True)
+    count = Column(Integer, nullable=False)
+    first_timestamp = Column(DateTime, nullable=False)
+    last_id = Column(Integer, nullable=False)
+    last_timestamp = Column(DateTime, nullable=False)
+    last_temperature = Column(Float, nullable=False)
+    last_pressure = Column(Float, nullable=False)
+    last_humidity = Column(Float, nullable=False)
+    temperature_min = Column(Float, nullable=False)
+    temperature_max = Column(Float, nullable=False)
+    temperature_mean = Column(Float, nullable=False)
+    temperature_m2 = Column(Float, nullable=False)
+    pressure_min = Column(Float, nullable=False)
+    pressure_max = Column(Float, nullable=False)
+    pressure_mean = Column(Float, nullable=False)
+    pressure_m2 = Column(Float, nullable=False)
+    humidity_min = Column(Float, nullable=False)
+    humidity_max = Column(Float, nullable=False)
+    humidity_mean = Column(Float, nullable=False)
+    humidity_m2 = Column(Float, nullable=False)
+
+
+class AlertRule(Base):
+    """
+    Regla de alerta que el servidor evalua al guardar cada lectura (ver alerts.py).
+
+    Atributos:
+        id (Integer): Primary key auto-incremental.
+        sensor_id (Integer): Sensor al que aplica; NULL = todos los sensores.
+        kind (String): 'range' (fuera de [min_value, max_value]), 'rate' (cambio
+            mayor a max_rate unidades por segundo) o 'stale' (sin lecturas por timeout_s segundos).
+        metric (String): 'temperature', 'pressure' o 'humidity' (no aplica a 'stale').
+        violations, window (Integer): La alerta se abre con `violations` lecturas
+            fuera de la regla entre las ultimas `window`, y se cierra cuando las
+            ultimas `window` lecturas la cumplen.
+    """
+    __tablename__ = "alert_rules"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    sensor_id = Column(Integer, nullable=True)
+    kind = Column(String(8), nullable=False)
+    metric = Column(String(16), nullable=True)
+    min_value = Column(Float, nullable=True)
+    max_value = Column(Float, nullable=True)
+    max_rate = Column(Float, nullable=True)
+    violations = Column(Integer, nullable=False, default=1)
+    window = Column(Integer, nullable=False, default=1)
+    timeout_s = Column(Float, nullable=True)
+
+
+class Alert(Base):
+    """
+    Alerta abierta por una regla para un sensor. Sigue abierta (closed_at NULL)
+    hasta que el sensor vuelve a cumplir la regla.
+
+    Atributos:
+        id (Integer): Primary key auto-incremental.
+        rule_id (Integer): Regla que la abrio.
+        sensor_id (Integer): Sensor afectado.
+        opened_at, closed_at (DateTime): Hora de la lectura que la abrio y de la que
+            la cerro (para 'stale', la hora del servidor).
+        reading_id (Integer): Lectura que la abrio (NULL para 'stale').
+        value (Float): Valor que violo la regla (para 'rate', el cambio por segundo).
+        message (String): Descripcion legible.
+    """
+    __tablename__ = "alerts"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    rule_id = Column(Integer, nullable=False)
+    sensor_id = Column(Integer, nullable=False)
+    opened_at = Column(DateTime, nullable=False)
+    closed_at = Column(DateTime, nullable=True)
+    reading_id = Column(Integer, nullable=True)
+    value = Column(Float, nullable=True)
+    message = Column(String, nullable=False)
+
+    __table_args__ = (
+        Index("ix_alerts_sensor_opened", "sensor_id", "opened_at"),
+        # Una sola alerta abierta por regla y sensor, aunque la abran varios workers a la vez
+        Index("ix_alerts_open", "rule_id", "sensor_id", unique=True, sqlite_where=closed_at.is_(None)),
+    )
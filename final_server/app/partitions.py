@@ -0,0 +1,226 @@
+# Particionado de lecturas por mes
+# Cada mes se guarda en su propia tabla (sensor_readings_pYYYYMM) con sus indices.
+# 'sensor_readings' pasa a ser una vista UNION ALL de todas las particiones, asi
+# las consultas ORM existentes siguen funcionando; las consultas con rango de
+# fechas usan readings_source() para leer solo las particiones que se solapan,
+# y la retencion borra meses completos con DROP TABLE en vez de fila por fila.
+import os
+from datetime import datetime, timezone
+from typing import Optional
+from sqlalchemy import Column, DateTime, Float, Index, Integer, MetaData, Table, insert, select, text, union_all
+from sqlalchemy.orm import Session, aliased
+from . import models
+
+PARTITION_PREFIX = "sensor_readings_p"
+TEMPLATE_TABLE = "sensor_readings_template"
+VIEW_NAME = models.SensorReadings.__tablename__
+COLUMNS = ("id", "sensor_id", "timestamp", "temperature", "pressure", "humidity")
+
+# Meses de lecturas crudas que se conservan (None = sin limite).
+# Los rollups no se borran: las series de meses antiguos siguen disponibles.
+RETENTION_MONTHS = int(os.environ["READINGS_RETENTION_MONTHS"]) if os.getenv("READINGS_RETENTION_MONTHS") else None
+# Cada cuanto se revisa la retencion mientras corre el servidor.
+RETENTION_INTERVAL_S = 3600
+
+_metadata = MetaData()
+_tables = {}
+
+
+def partition_name(ts: datetime) -> str:
+    return f"{PARTITION_PREFIX}{ts.year:04d}{ts.month:02d}"
+
+
+def _month_key(name: str) -> int:
+    # 'sensor_readings_p202610' -> 2026 * 12 + 9
+    suffix = name[len(PARTITION_PREFIX):]
+    return int(suffix[:4]) * 12 + int(suffix[4:]) - 1
+
+
+def _id_base(name: str) -> int:
+    # Los ids de cada particion empiezan en mes << 32, asi son unicos entre
+    # particiones sin un contador compartido (y caben en un entero de JavaScript).
+    return _month_key(name) << 32
+
+
+def _table(name: str) -> Table:
+    table = _tables.get(name)
+    if table is None:
+        table = Table(name, _metadata,
+                      Column("id", Integer, primary_key=True),
+                      Column("sensor_id", Integer, nullable=False),
+                      Column("timestamp", DateTime, nullable=False),
+                      Column("temperature", Float, nullable=False),
+                      Column("pressure", Float, nullable=False),
+                      Column("humidity", Float, nullable=False),
+                      Index(f"ix_{name}_timestamp", "timestamp"),
+                      Index(f"ix_{name}_sensor_id_timestamp", "sensor_id", "timestamp"),
+                      sqlite_autoincrement=True)
+        _tables[name] = table
+    return table
+
+
+def list_partitions(db) -> list[str]:
+    # Se consulta el esquema cada vez: otro worker puede haber creado o borrado particiones.
+    rows = db.execute(text("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE :prefix"),
+                      {"prefix": PARTITION_PREFIX + "%"})
+    return sorted(row[0] for row in rows)
+
+
+def rebuild_view(db):
+    parts = [TEMPLATE_TABLE] + list_partitions(db)
+    columns = ", ".join(COLUMNS)
+    body = " UNION ALL ".join(f"SELECT {columns} FROM {name}" for name in parts)
+    db.execute(text(f"DROP VIEW IF EXISTS {VIEW_NAME}"))
+    db.execute(text(f"CREATE VIEW {VIEW_NAME} AS {body}"))
+
+
+def ensure_partition(db, name: str, update_view: bool = True) -> Table:
+    """
+    Crea la particion si no existe (con su secuencia de ids) y actualiza la vista.
+    No hace commit.
+    """
+    table = _table(name)
+    exists = db.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                        {"name": name}).first()
+    if exists is None:
+        table.create(db.connection() if isinstance(db, Session) else db, checkfirst=True)
+        db.execute(text("INSERT INTO sqlite_sequence (name, seq) "
+                        "SELECT :name, :base WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = :name)"),
+                   {"name": name, "base": _id_base(name)})
+        if update_view:
+            rebuild_view(db)
+    return table
+
+
+def insert_rows(db: Session, rows: list[dict]) -> list[int]:
+    # Inserta cada lectura en la particion de su mes y devuelve los ids en el orden recibido.
+    by_partition = {}
+    for index, row in enumerate(rows):
+        by_partition.setdefault(partition_name(row["timestamp"]), []).append(index)
+
+    ids = [None] * len(rows)
+    for name, indexes in by_partition.items():
+        table = ensure_partition(db, name)
+        stmt = insert(table).returning(table.c.id, sort_by_parameter_order=True)
+        new_ids = db.scalars(stmt, [rows[i] for i in indexes]).all()
+        for i, reading_id in zip(indexes, new_ids):
+            ids[i] = reading_id
+    return ids
+
+
+def copy_rows(db, name: str, source: str) -> int:
+    """
+    Copia todas las filas de la tabla `source` (columnas de COLUMNS sin el id)
+    a la particion `name`, en el orden en que estan guardadas, con un solo
+    INSERT ... SELECT. Se usa para cargas masivas. No hace commit.
+    """
+    ensure_partition(db, name)
+    columns = ", ".join(COLUMNS[1:])
+    return db.execute(text(f"INSERT INTO {name} ({columns}) SELECT {columns} FROM {source}")).rowcount
+
+
+def _month_of(ts: Optional[datetime]) -> Optional[int]:
+    return ts.year * 12 + ts.month - 1 if ts is not None else None
+
+
+def partitions_in_range(db,
+                        start_date: Optional[datetime] = None,
+                        end_date: Optional[datetime] = None) -> list[str]:
+    # Particiones cuyo mes se solapa con [start_date, end_date], de la mas antigua a la mas nueva.
+    low, high = _month_of(start_date), _month_of(end_date)
+    return [name for name in list_partitions(db)
+            if (low is None or _month_key(name) >= low) and (high is None or _month_key(name) <= high)]
+
+
+def partition_table(name: str) -> Table:
+    # Tabla de Core de una particion (para INSERT/DELETE sin pasar por el ORM).
+    return _table(name)
+
+
+def partition_entity(name: str):
+    # Entidad ORM sobre una sola particion; devuelve objetos models.SensorReadings.
+    return aliased(models.SensorReadings, _table(name), name=name, adapt_on_names=True)
+
+
+def readings_source(db: Session,
+                    start_date: Optional[datetime] = None,
+                    end_date: Optional[datetime] = None):
+    """
+    Entidad a consultar para un rango de fechas: la vista completa si no hay
+    rango, o un UNION ALL solo de las particiones que se solapan con el rango.
+    Se usa igual que models.SensorReadings (mismas columnas).
+    """
+    if start_date is None and end_date is None:
+        return models.SensorReadings
+
+    names = partitions_in_range(db, start_date, end_date)
+    if len(names) == 1:
+        return partition_entity(names[0])
+    # Ninguna particion en el rango: se consulta la plantilla vacia
+    selects = [select(*(_table(name).c[column] for column in COLUMNS)) for name in names or [TEMPLATE_TABLE]]
+    source = selects[0] if len(selects) == 1 else union_all(*selects)
+    return aliased(models.SensorReadings, source.subquery(VIEW_NAME), adapt_on_names=True)
+
+
+def drop_partitions_before(db, cutoff: datetime) -> list[str]:
+    # Borra las particiones de meses anteriores al de `cutoff`. No hace commit.
+    limit = _month_of(cutoff)
+    dropped = [name for name in list_partitions(db) if _month_key(name) < limit]
+    for name in dropped:
+        db.execute(text(f"DROP TABLE IF EXISTS {name}"))
+        db.execute(text("DELETE FROM sqlite_sequence WHERE name = :name"), {"name": name})
+    if dropped:
+        rebuild_view(db)
+    return dropped
+
+
+def drop_all_partitions(db):
+    # Vacia todas las lecturas crudas. No hace commit.
+    for name in list_partitions(db):
+        db.execute(text(f"DROP TABLE IF EXISTS {name}"))
+        db.execute(text("DELETE FROM sqlite_sequence WHERE name = :name"), {"name": name})
+    rebuild_view(db)
+
+
+def utcnow() -> datetime:
+    # Hora actual como la guardan las lecturas (UTC sin zona horaria)
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def retention_cutoff(now: Optional[datetime] = None) -> Optional[datetime]:
+    # Inicio del mes mas antiguo que se conserva (None = sin retencion).
+    if RETENTION_MONTHS is None:
+        return None
+    month = _month_of(now or utcnow()) - (RETENTION_MONTHS - 1)
+    return datetime(month // 12, month % 12 + 1, 1)
+
+
+def apply_retention(db, now: Optional[datetime] = None) -> list[str]:
+    # Conserva los ultimos RETENTION_MONTHS meses (incluido el actual).
+    cutoff = retention_cutoff(now)
+    if cutoff is None:
+        return []
+    return drop_partitions_before(db, cutoff)
+
+
+def setup(conn):
+    """
+    Prepara el esquema particionado. Si existe la tabla 'sensor_readings' de
+    versiones anteriores, mueve sus filas (con sus ids) a las particiones
+    mensuales y la reemplaza por la vista.
+    """
+    _table(TEMPLATE_TABLE).create(conn, checkfirst=True)
+
+    legacy = conn.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                          {"name": VIEW_NAME}).first()
+    if legacy is not None:
+        months = conn.execute(text(f"SELECT DISTINCT strftime('%Y%m', timestamp) FROM {VIEW_NAME}")).all()
+        columns = ", ".join(COLUMNS)
+        for (month,) in months:
+            name = PARTITION_PREFIX + month
+            ensure_partition(conn, name, update_view=False)
+            conn.execute(text(f"INSERT INTO {name} ({columns}) SELECT {columns} FROM {VIEW_NAME} "
+                              f"WHERE strftime('%Y%m', timestamp) = :month"), {"month": month})
+        conn.execute(text(f"DROP TABLE {VIEW_NAME}"))
+
+    rebuild_view(conn)
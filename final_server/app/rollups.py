@@ -0,0 +1,154 @@
+# Tablas de agregados por intervalo de tiempo (rollups)
+# Cada insercion de lecturas actualiza, en la misma transaccion, un agregado por
+# sensor y por tamano de intervalo. Las series del dashboard se leen de aqui:
+# un grafico de 30 dias con bucket=1h son 720 filas, no un recorrido de la tabla.
+import calendar
+from datetime import datetime, timezone
+from typing import Optional
+from sqlalchemy import Integer, cast, func, insert, literal, literal_column, select, text, true
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+from . import archive, models
+
+# Tamanos de intervalo soportados, en segundos.
+BUCKETS = {"1m": 60, "5m": 300, "1h": 3600, "1d": 86400}
+
+METRICS = ("temperature", "pressure", "humidity")
+
+Rollup = models.SensorReadingRollup
+
+
+def to_epoch(ts: datetime) -> int:
+    # SQLite guarda la hora "de pared" del datetime sin la zona horaria,
+    # asi que se interpreta igual aqui para coincidir con rebuild_rollups().
+    return calendar.timegm(ts.replace(tzinfo=None).timetuple())
+
+
+def from_epoch(seconds: int) -> datetime:
+    return datetime.fromtimestamp(seconds, tz=timezone.utc).replace(tzinfo=None)
+
+
+def _upsert_statement():
+    return _on_conflict(sqlite_insert(Rollup))
+
+
+def _on_conflict(stmt):
+    # Si el agregado ya existe, suma las cantidades y combina minimos y maximos.
+    excluded = stmt.excluded
+    set_ = {"count": Rollup.count + excluded.count}
+    for metric in METRICS:
+        set_[f"{metric}_sum"] = getattr(Rollup, f"{metric}_sum") + getattr(excluded, f"{metric}_sum")
+        set_[f"{metric}_min"] = func.min(getattr(Rollup, f"{metric}_min"), getattr(excluded, f"{metric}_min"))
+        set_[f"{metric}_max"] = func.max(getattr(Rollup, f"{metric}_max"), getattr(excluded, f"{metric}_max"))
+    return stmt.on_conflict_do_update(index_elements=["sensor_id", "bucket", "bucket_start"], set_=set_)
+
+
+def update_rollups(db: Session, readings: list):
+    """
+    Suma las lecturas a sus agregados. No hace commit: debe llamarse dentro de
+    la misma transaccion que inserta las lecturas.
+
+    `readings` puede contener diccionarios o esquemas SensorReadingCreate.
+    """
+    partial = {}
+    for reading in readings:
+        if not isinstance(reading, dict):
+            reading = reading.model_dump()
+        epoch = to_epoch(reading["timestamp"])
+        for bucket, size in BUCKETS.items():
+            key = (reading["sensor_id"], bucket, epoch - epoch % size)
+            row = partial.get(key)
+            if row is None:
+                row = {"sensor_id": key[0], "bucket": bucket, "bucket_start": key[2], "count": 0}
+                for metric in METRICS:
+                    row[f"{metric}_sum"] = 0.0
+                    row[f"{metric}_min"] = reading[metric]
+                    row[f"{metric}_max"] = reading[metric]
+                partial[key] = row
+            row["count"] += 1
+            for metric in METRICS:
+                value = reading[metric]
+                row[f"{metric}_sum"] += value
+                if value < row[f"{metric}_min"]:
+                    row[f"{metric}_min"] = value
+                if value > row[f"{metric}_max"]:
+                    row[f"{metric}_max"] = value
+
+    if partial:
+        db.execute(_upsert_statement(), list(partial.values()))
+
+
+def rebuild_rollups(db: Session):
+    # Recalcula todos los agregados desde la tabla de lecturas con INSERT ... SELECT
+    # y les suma los de las lecturas archivadas.
+    db.query(Rollup).delete()
+    epoch = cast(func.strftime('%s', models.SensorReadings.timestamp), Integer)
+    for bucket, size in BUCKETS.items():
+        start = (epoch // size) * size
+        columns = [models.SensorReadings.sensor_id, literal(bucket), start, func.count()]
+        names = ["sensor_id", "bucket", "bucket_start", "count"]
+        for metric in METRICS:
+            col = getattr(models.SensorReadings, metric)
+            columns += [func.sum(col), func.min(col), func.max(col)]
+            names += [f"{metric}_sum", f"{metric}_min", f"{metric}_max"]
+        sel = select(*columns).group_by(models.SensorReadings.sensor_id, start)
+        db.execute(insert(Rollup).from_select(names, sel))
+    for rows in archive.rollup_rows(db, BUCKETS):
+        db.execute(_upsert_statement(), rows)
+    db.commit()
+
+
+def merge_rollups(db, source: str):
+    """
+    Suma a los agregados los de la tabla `source` (mismas columnas que
+    sensor_reading_rollups, calculados fuera, p. ej. en una carga masiva)
+    con un solo INSERT ... SELECT ... ON CONFLICT. No hace commit.
+    """
+    names = [column.name for column in Rollup.__table__.columns]
+    # SQLite exige un WHERE en el SELECT de un upsert para no confundir ON CONFLICT con un JOIN
+    sel = select(*[literal_column(name) for name in names]).select_from(text(source)).where(true())
+    db.execute(_on_conflict(sqlite_insert(Rollup).from_select(names, sel)))
+
+
+def ensure_rollups(db: Session):
+    # Bases de datos creadas antes de los rollups tienen lecturas pero no agregados.
+    if db.query(Rollup.sensor_id).first() is None and (db.query(models.SensorReadings.id).first() is not None
+                                                       or db.query(models.SensorReadingBlock.sensor_id).first() is not None):
+        rebuild_rollups(db)
+
+
+def get_series(db: Session, bucket: str,
+               sensor_id: Optional[int] = None,
+               start_date: Optional[datetime] = None,
+               end_date: Optional[datetime] = None) -> list[dict]:
+    """
+    Devuelve un punto por intervalo con count y min/max/avg de cada metrica.
+    Sin sensor_id, los intervalos combinan todos los sensores.
+    """
+    size = BUCKETS[bucket]
+    total = func.sum(Rollup.count)
+    columns = [Rollup.bucket_start, total.label("count")]
+    for metric in METRICS:
+        columns += [func.min(getattr(Rollup, f"{metric}_min")).label(f"{metric}_min"),
+                    func.max(getattr(Rollup, f"{metric}_max")).label(f"{metric}_max"),
+                    (func.sum(getattr(Rollup, f"{metric}_sum")) / total).label(f"{metric}_avg")]
+
+    query = select(*columns).where(Rollup.bucket == bucket)
+    if sensor_id is not None:
+        query = query.where(Rollup.sensor_id == sensor_id)
+    if start_date is not None:
+        start = to_epoch(start_date)
+        query = query.where(Rollup.bucket_start >= start - start % size)
+    if end_date is not None:
+        query = query.where(Rollup.bucket_start <= to_epoch(end_date))
+    query = query.group_by(Rollup.bucket_start).order_by(Rollup.bucket_start)
+
+    points = []
+    for row in db.execute(query):
+        point = {"bucket_start": from_epoch(row.bucket_start), "count": row.count}
+        for metric in METRICS:
+            point[metric] = {"min": getattr(row, f"{metric}_min"),
+                             "max": getattr(row, f"{metric}_max"),
+                             "avg": getattr(row, f"{metric}_avg")}
+        points.append(point)
+    return points
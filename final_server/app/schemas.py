@@ -1,4 +1,5 @@
-from pydantic import BaseModel, ConfigDict
+from typing import Literal, Optional
+from pydantic import BaseModel, ConfigDict, Field, model_validator
 from datetime import datetime
 
 
@@ -15,4 +16,87 @@ class SensorReadingCreate(SensorReadingBase):
 class SensorReading(SensorReadingBase):
     id: int
 
-    model_config = ConfigDict(from_attributes=True)
\ No newline at end of file
+    model_config = ConfigDict(from_attributes=True)
+
+class SensorReadingBatchItem(BaseModel):
+    index: int
+    status: str  # "ok" | "error"
+    id: Optional[int] = None
+    error: Optional[str] = None
+
+class SensorReadingBatchResult(BaseModel):
+    inserted: int
+    failed: int
+    results: list[SensorReadingBatchItem]
+
+
+class MetricAggregate(BaseModel):
+    min: float
+    max: float
+    avg: float
+
+class SeriesPoint(BaseModel):
+    bucket_start: datetime
+    count: int
+    temperature: MetricAggregate
+    pressure: MetricAggregate
+    humidity: MetricAggregate
+
+
+class MetricState(BaseModel):
+    min: float
+    max: float
+    mean: float
+    std: Optional[float] = None  # desviacion estandar muestral; None con una sola lectura
+
+class SensorState(BaseModel):
+    sensor_id: int
+    count: int
+    first_timestamp: datetime
+    last_reading: SensorReading
+    temperature: MetricState
+    pressure: MetricState
+    humidity: MetricState
+
+
+class AlertRuleCreate(BaseModel):
+    sensor_id: Optional[int] = None  # None = todos los sensores
+    kind: Literal["range", "rate", "stale"]
+    metric: Optional[Literal["temperature", "pressure", "humidity"]] = None
+    min_value: Optional[float] = None
+    max_value: Optional[float] = None
+    max_rate: Optional[float] = Field(default=None, gt=0)  # unidades por segundo
+    violations: int = Field(default=1, ge=1)
+    window: int = Field(default=1, ge=1, le=64)
+    timeout_s: Optional[float] = Field(default=None, gt=0)
+
+    @model_validator(mode="after")
+    def check_kind(self):
+        if self.kind != "stale" and self.metric is None:
+            raise ValueError(f"'{self.kind}' rules require a metric")
+        if self.kind == "range" and self.min_value is None and self.max_value is None:
+            raise ValueError("'range' rules require min_value and/or max_value")
+        if self.kind == "rate" and self.max_rate is None:
+            raise ValueError("'rate' rules require max_rate")
+        if self.kind == "stale" and self.timeout_s is None:
+            raise ValueError("'stale' rules require timeout_s")
+        if self.violations > self.window:
+            raise ValueError("violations cannot be greater than window")
+        return self
+
+class AlertRule(AlertRuleCreate):
+    id: int
+
+    model_config = ConfigDict(from_attributes=True)
+
+class Alert(BaseModel):
+    id: int
+    rule_id: int
+    sensor_id: int
+    opened_at: datetime
+    closed_at: Optional[datetime] = None
+    reading_id: Optional[int] = None
+    value: Optional[float] = None
+    message: str
+
+    model_config = ConfigDict(from_attributes=True)
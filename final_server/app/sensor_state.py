@@ -0,0 +1,170 @@
+# Estado materializado por sensor (tabla sensor_state)
+# Cada insercion actualiza, en la misma transaccion, la ultima lectura del sensor
+# y sus estadisticas de toda la historia: cantidad, minimo, maximo, y media y
+# varianza con el metodo de Welford (media y M2 se combinan lote a lote sin
+# volver a leer lecturas anteriores). GET /sensors y GET /sensors/{id} leen una
+# fila por sensor. Tras cargas masivas que no pasan por crud se recalcula con
+# rebuild_state() (python rebuild_sensor_state.py).
+#
+# Son estadisticas de todas las lecturas recibidas: la retencion de particiones
+# no las modifica (igual que los rollups), pero rebuild_state() solo ve las que siguen
+# guardadas, en las particiones o en el archivo comprimido.
+import math
+from typing import Optional
+from sqlalchemy import and_, case, func, insert, or_, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+from . import archive, models
+
+METRICS = ("temperature", "pressure", "humidity")
+
+State = models.SensorState
+
+
+def _upsert_statement():
+    # Si el sensor ya tiene estado se combinan los dos conjuntos (Chan et al.):
+    # con d = media_lote - media, la media se mueve d * n_lote / n y M2 suma
+    # ademas d^2 * n * n_lote / n. Las expresiones usan los valores anteriores de la fila.
+    stmt = sqlite_insert(State)
+    excluded = stmt.excluded
+    total = State.count + excluded.count
+    newer = or_(excluded.last_timestamp > State.last_timestamp,
+                and_(excluded.last_timestamp == State.last_timestamp, excluded.last_id > State.last_id))
+    set_ = {"count": total,
+            "first_timestamp": func.min(State.first_timestamp, excluded.first_timestamp)}
+    for column in ["last_id", "last_timestamp"] + [f"last_{metric}" for metric in METRICS]:
+        set_[column] = case((newer, getattr(excluded, column)), else_=getattr(State, column))
+    for metric in METRICS:
+        mean, m2 = getattr(State, f"{metric}_mean"), getattr(State, f"{metric}_m2")
+        delta = getattr(excluded, f"{metric}_mean") - mean
+        set_[f"{metric}_min"] = func.min(getattr(State, f"{metric}_min"), getattr(excluded, f"{metric}_min"))
+        set_[f"{metric}_max"] = func.max(getattr(State, f"{metric}_max"), getattr(excluded, f"{metric}_max"))
+        set_[f"{metric}_mean"] = mean + delta * excluded.count / total
+        set_[f"{metric}_m2"] = m2 + getattr(excluded, f"{metric}_m2") + delta * delta * State.count * excluded.count / total
+    return stmt.on_conflict_do_update(index_elements=["sensor_id"], set_=set_)
+
+
+def update_state(db: Session, readings: list[dict]):
+    """
+    Suma las lecturas (diccionarios con su id) al estado de sus sensores. No hace
+    commit: debe llamarse dentro de la misma transaccion que inserta las lecturas.
+    """
+    partial = {}
+    for reading in readings:
+        # Hora de pared sin zona horaria, como se guarda: un lote puede mezclar
+        # timestamps con y sin zona, que no se pueden comparar entre si
+        timestamp = reading["timestamp"].replace(tzinfo=None)
+        row = partial.get(reading["sensor_id"])
+        if row is None:
+            row = {"sensor_id": reading["sensor_id"], "count": 0,
+                   "first_timestamp": timestamp,
+                   "last_id": reading["id"], "last_timestamp": timestamp}
+            for metric in METRICS:
+                row[f"last_{metric}"] = reading[metric]
+                row[f"{metric}_min"] = reading[metric]
+                row[f"{metric}_max"] = reading[metric]
+                row[f"{metric}_mean"] = 0.0
+                row[f"{metric}_m2"] = 0.0
+            partial[reading["sensor_id"]] = row
+        row["count"] += 1
+        count = row["count"]
+        if timestamp < row["first_timestamp"]:
+            row["first_timestamp"] = timestamp
+        if (timestamp, reading["id"]) > (row["last_timestamp"], row["last_id"]):
+            row["last_id"], row["last_timestamp"] = reading["id"], timestamp
+            for metric in METRICS:
+                row[f"last_{metric}"] = reading[metric]
+        for metric in METRICS:
+            value = reading[metric]
+            # Welford: media y M2 en una sola pasada
+            delta = value - row[f"{metric}_mean"]
+            row[f"{metric}_mean"] += delta / count
+            row[f"{metric}_m2"] += delta * (value - row[f"{metric}_mean"])
+            if value < row[f"{metric}_min"]:
+                row[f"{metric}_min"] = value
+            if value > row[f"{metric}_max"]:
+                row[f"{metric}_max"] = value
+
+    if partial:
+        db.execute(_upsert_statement(), list(partial.values()))
+
+
+def rebuild_state(db: Session):
+    # Recalcula el estado de todos los sensores desde las lecturas con INSERT ... SELECT.
+    # M2 se calcula en dos pasadas, como suma de (x - media)^2 con la media del sensor:
+    # sum(x^2) - sum(x)^2 / n pierde casi toda la precision con valores como la presion (~1013).
+    db.query(State).delete()
+    readings = models.SensorReadings
+    columns = [readings.sensor_id, func.count().label("count"), func.min(readings.timestamp).label("first_timestamp")]
+    for metric in METRICS:
+        col = getattr(readings, metric)
+        columns += [func.min(col).label(f"{metric}_min"),
+                    func.max(col).label(f"{metric}_max"),
+                    func.avg(col).label(f"{metric}_mean")]
+    means = select(*columns).group_by(readings.sensor_id).subquery()
+    m2s = []
+    for metric in METRICS:
+        delta = getattr(readings, metric) - means.c[f"{metric}_mean"]
+        m2s.append(func.sum(delta * delta).label(f"{metric}_m2"))
+    aggregates = select(means, *m2s)\
+        .join(readings, readings.sensor_id == means.c.sensor_id)\
+        .group_by(means.c.sensor_id).subquery()
+
+    # Ultima lectura de cada sensor, con el mismo orden que /readings/ (timestamp desc, id desc)
+    position = func.row_number().over(partition_by=readings.sensor_id,
+                                      order_by=(readings.timestamp.desc(), readings.id.desc()))
+    last = select(readings.sensor_id, readings.id, readings.timestamp,
+                  *(getattr(readings, metric) for metric in METRICS),
+                  position.label("position")).subquery()
+
+    names = ["sensor_id", "count", "first_timestamp", "last_id", "last_timestamp"]
+    selected = [aggregates.c.sensor_id, aggregates.c.count, aggregates.c.first_timestamp, last.c.id, last.c.timestamp]
+    for metric in METRICS:
+        names.append(f"last_{metric}")
+        selected.append(last.c[metric])
+    for metric in METRICS:
+        for suffix in ("min", "max", "mean", "m2"):
+            names.append(f"{metric}_{suffix}")
+            selected.append(aggregates.c[f"{metric}_{suffix}"])
+    sel = select(*selected)\
+        .join(last, and_(last.c.sensor_id == aggregates.c.sensor_id, last.c.position == 1))
+    db.execute(insert(State).from_select(names, sel))
+    # Las lecturas archivadas se combinan con el mismo upsert que las nuevas
+    archived = archive.state_rows(db)
+    if archived:
+        db.execute(_upsert_statement(), archived)
+    db.commit()
+
+
+def ensure_state(db: Session):
+    # Bases de datos creadas antes de sensor_state tienen lecturas pero no estado.
+    if db.query(State.sensor_id).first() is None and (db.query(models.SensorReadings.id).first() is not None
+                                                      or db.query(models.SensorReadingBlock.sensor_id).first() is not None):
+        rebuild_state(db)
+
+
+def _to_dict(state: models.SensorState) -> dict:
+    result = {"sensor_id": state.sensor_id,
+              "count": state.count,
+              "first_timestamp": state.first_timestamp,
+              "last_reading": {"id": state.last_id,
+                               "sensor_id": state.sensor_id,
+                               "timestamp": state.last_timestamp,
+                               **{metric: getattr(state, f"last_{metric}") for metric in METRICS}}}
+    for metric in METRICS:
+        m2 = getattr(state, f"{metric}_m2")
+        result[metric] = {"min": getattr(state, f"{metric}_min"),
+                          "max": getattr(state, f"{metric}_max"),
+                          "mean": getattr(state, f"{metric}_mean"),
+                          # Desviacion muestral (ddof=1), igual que /readings/stats/
+                          "std": math.sqrt(max(m2, 0.0) / (state.count - 1)) if state.count > 1 else None}
+    return result
+
+
+def get_states(db: Session) -> list[dict]:
+    return [_to_dict(state) for state in db.query(State).order_by(State.sensor_id)]
+
+
+def get_state(db: Session, sensor_id: int) -> Optional[dict]:
+    state = db.get(State, sensor_id)
+    return _to_dict(state) if state is not None else None
@@ -0,0 +1,212 @@
+# Estadisticas de lecturas calculadas en la base de datos
+# count/mean/min/max/std salen de una consulta de agregacion sobre todo el conjunto
+# filtrado (std en dos pasadas, con las desviaciones a la media); los percentiles se
+# aproximan con un muestreo de reservorio de tamano acotado, asi la memoria no
+# depende de cuantas filas coinciden ni de cuantos grupos hay.
+# Las lecturas archivadas (archive.py) se combinan con los mismos totales y muestras.
+import math
+import random
+from typing import Optional
+from sqlalchemy import func, select, true
+from sqlalchemy.orm import Session
+from . import archive, crud, models, partitions
+
+METRICS = ("temperature", "pressure", "humidity")
+
+# Tamano del reservorio por metrica (y por sensor si se agrupa).
+# Con menos filas que esto los percentiles son exactos.
+SAMPLE_SIZE = 10000
+# Valores muestreados por metrica entre todos los grupos: al agrupar por sensor cada
+# reservorio se achica para no pasar de esto, sin bajar de SAMPLE_MIN_SIZE.
+SAMPLE_TOTAL = 200000
+SAMPLE_MIN_SIZE = 100
+# Filas traidas por vuelta al recorrer el resultado para los percentiles.
+STREAM_CHUNK = 5000
+
+PERCENTILES = {"25%": 0.25, "50%": 0.50, "75%": 0.75}
+
+
+class ReservoirSample:
+    """
+    Muestra uniforme de tamano acotado sobre un flujo de valores (algoritmo R).
+
+    Usa una semilla fija para que la misma consulta devuelva los mismos percentiles.
+    """
+
+    def __init__(self, size: int = SAMPLE_SIZE, seed: int = 0):
+        self.size = size
+        self.seen = 0
+        self.values = []
+        self._rng = random.Random(seed)
+
+    def add(self, value: float):
+        self.seen += 1
+        if len(self.values) < self.size:
+            self.values.append(value)
+        else:
+            j = self._rng.randrange(self.seen)
+            if j < self.size:
+                self.values[j] = value
+
+    def quantile(self, q: float) -> Optional[float]:
+        # Interpolacion lineal entre los valores vecinos, igual que pandas.describe()
+        if not self.values:
+            return None
+        ordered = sorted(self.values)
+        pos = (len(ordered) - 1) * q
+        low = math.floor(pos)
+        high = math.ceil(pos)
+        return ordered[low] + (ordered[high] - ordered[low]) * (pos - low)
+
+
+class Totals:
+    """
+    Cantidad y media, M2 (suma de los cuadrados de las desviaciones a la media),
+    minimo y maximo de cada metrica de un conjunto de lecturas. Los totales de
+    distintas fuentes (las particiones y los bloques archivados) se combinan con
+    la formula de Chan et al. antes de calcular las estadisticas.
+    """
+    __slots__ = ("count", "means", "m2s", "mins", "maxs")
+
+    def __init__(self):
+        self.count = 0
+        self.means = [0.0] * len(METRICS)
+        self.m2s = [0.0] * len(METRICS)
+        self.mins = [math.inf] * len(METRICS)
+        self.maxs = [-math.inf] * len(METRICS)
+
+    def add(self, count: int, means, m2s, mins, maxs):
+        if not count:
+            return
+        total = self.count + count
+        for i in range(len(METRICS)):
+            delta = means[i] - self.means[i]
+            self.means[i] += delta * count / total
+            self.m2s[i] += m2s[i] + delta * delta * self.count * count / total
+            self.mins[i] = min(self.mins[i], mins[i])
+            self.maxs[i] = max(self.maxs[i], maxs[i])
+        self.count = total
+
+    def add_row(self, row):
+        # Fila de la consulta de _aggregate_statement
+        self.add(row.count,
+                 [getattr(row, f"{metric}_mean") for metric in METRICS],
+                 [getattr(row, f"{metric}_m2") for metric in METRICS],
+                 [getattr(row, f"{metric}_min") for metric in METRICS],
+                 [getattr(row, f"{metric}_max") for metric in METRICS])
+
+    def stats(self) -> dict:
+        count = self.count
+        stats = {}
+        for i, metric in enumerate(METRICS):
+            std = None
+            if count > 1:
+                # Desviacion estandar muestral (ddof=1)
+                std = math.sqrt(max(self.m2s[i], 0.0) / (count - 1))
+            stats[metric] = {"count": count,
+                             "mean": self.means[i],
+                             "std": std,
+                             "min": self.mins[i],
+                             "max": self.maxs[i]}
+        return stats
+
+
+def _aggregate_statement(source, conditions: list, group_by_sensor: bool):
+    # Primera pasada: cantidad, minimo, maximo y media de cada grupo. La segunda suma
+    # (x - media)^2 uniendo las filas con su grupo: sum(x^2) - sum(x)^2 / n pierde casi
+    # toda la precision con valores como la presion (~1013).
+    keys = [source.sensor_id] if group_by_sensor else []
+    columns = [func.count().label("count")]
+    for metric in METRICS:
+        col = getattr(source, metric)
+        columns += [func.min(col).label(f"{metric}_min"),
+                    func.max(col).label(f"{metric}_max"),
+                    func.avg(col).label(f"{metric}_mean")]
+    means = select(*keys, *columns).where(*conditions).group_by(*keys).subquery()
+    m2s = []
+    for metric in METRICS:
+        delta = getattr(source, metric) - means.c[f"{metric}_mean"]
+        m2s.append(func.sum(delta * delta).label(f"{metric}_m2"))
+    if not group_by_sensor:
+        return select(means, *m2s).select_from(means.join(source, true())).where(*conditions)
+    return select(means, *m2s)\
+        .select_from(means.join(source, source.sensor_id == means.c.sensor_id))\
+        .where(*conditions)\
+        .group_by(means.c.sensor_id)
+
+
+def _add_percentiles(db: Session, source, conditions: list, groups: dict, group_by_sensor: bool,
+                     archived: Optional["archive.BlockSelection"] = None):
+    # Recorre el conjunto filtrado por bloques, alimentando un reservorio por metrica.
+    columns = [getattr(source, metric) for metric in METRICS]
+    if group_by_sensor:
+        columns.insert(0, source.sensor_id)
+    stmt = select(*columns).where(*conditions)
+
+    size = min(SAMPLE_SIZE, max(SAMPLE_MIN_SIZE, SAMPLE_TOTAL // len(groups)))
+    samples = {key: [ReservoirSample(size) for _ in METRICS] for key in groups}
+    result = db.execute(stmt.execution_options(yield_per=STREAM_CHUNK))
+    for row in result:
+        key = row[0] if group_by_sensor else None
+        values = row[1:] if group_by_sensor else row
+        for sample, value in zip(samples[key], values):
+            sample.add(value)
+    if archived is not None:
+        for key, values in archived.values(group_by_sensor):
+            for sample, column in zip(samples[key], values):
+                for value in column:
+                    sample.add(value)
+
+    for key, stats in groups.items():
+        for metric, sample in zip(METRICS, samples[key]):
+            for label, q in PERCENTILES.items():
+                stats[metric][label] = sample.quantile(q)
+
+
+def get_reading_stats(db: Session, conditions: list,
+                      group_by_sensor: bool = False,
+                      percentiles: bool = True,
+                      source=models.SensorReadings,
+                      archived: Optional["archive.BlockSelection"] = None) -> dict:
+    """
+    Calcula count/mean/std/min/max (y opcionalmente percentiles) de las lecturas
+    que cumplen las condiciones, con el mismo formato que pandas.describe().
+
+    Con group_by_sensor=True devuelve ademas las estadisticas de cada sensor,
+    calculadas en la misma consulta con GROUP BY. `source` debe ser la misma
+    entidad sobre la que se construyeron las condiciones; `archived` son los
+    bloques archivados que cumplen los mismos filtros (archive.select_blocks).
+    """
+    totals = {}
+    for row in db.execute(_aggregate_statement(source, conditions, group_by_sensor)):
+        if row.count:
+            totals.setdefault(row.sensor_id if group_by_sensor else None, Totals()).add_row(row)
+    if archived is not None:
+        for key, *parts in archived.totals(group_by_sensor):
+            totals.setdefault(key, Totals()).add(*parts)
+
+    keys = sorted(totals) if group_by_sensor else list(totals)
+    groups = {key: totals[key].stats() for key in keys}
+    if percentiles and groups:
+        _add_percentiles(db, source, conditions, groups, group_by_sensor, archived)
+    if group_by_sensor:
+        return {"count": sum(totals[key].count for key in keys),
+                "groups": [{"sensor_id": key, "count": totals[key].count, "stats": groups[key]}
+                           for key in keys]}
+    if not groups:
+        return {"count": 0, "stats": {}}
+    return {"count": totals[None].count, "stats": groups[None]}
+
+
+def get_filtered_stats(db: Session, filters: dict,
+                       group_by_sensor: bool = False,
+                       percentiles: bool = True) -> dict:
+    # Igual que get_reading_stats, a partir de los filtros de la API (argumentos de
+    # crud.reading_filters); con rango de fechas solo se leen las particiones que lo cubren,
+    # y de las lecturas archivadas solo los bloques que la cabecera no descarta.
+    source = partitions.readings_source(db, filters.get("start_date"), filters.get("end_date"))
+    return get_reading_stats(db, crud.reading_filters(**filters, source=source),
+                             group_by_sensor=group_by_sensor,
+                             percentiles=percentiles,
+                             source=source,
+                             archived=archive.select_blocks(db, filters))
@@ -0,0 +1,112 @@
+# Escritor unico de lecturas
+# Todas las inserciones de la API pasan por una tarea asyncio que las serializa
+# y agrupa: las peticiones que esperan mientras se escribe un lote entran juntas
+# en la siguiente transaccion (un solo commit/fsync para todas). Los lectores
+# usan sus propias conexiones y no esperan a esta cola.
+import asyncio
+import time
+from typing import Optional
+from . import crud, metrics, schemas
+from .database import AsyncSessionLocal
+
+# Maximo de lecturas agrupadas en una transaccion.
+WRITE_MAX_BATCH = 5000
+# Peticiones esperando en la cola como maximo: con la cola llena submit() espera,
+# asi la ingesta se frena si la base de datos no alcanza en vez de acumular memoria.
+WRITE_MAX_PENDING = 1000
+
+
+class ReadingWriter:
+    def __init__(self, session_factory=AsyncSessionLocal, max_batch: int = WRITE_MAX_BATCH,
+                 max_pending: int = WRITE_MAX_PENDING):
+        self.session_factory = session_factory
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self.queue: Optional[asyncio.Queue] = None
+        self.task: Optional[asyncio.Task] = None
+        # Estadisticas: transacciones hechas y lecturas escritas
+        self.transactions = 0
+        self.written = 0
+
+    def start(self):
+        self.queue = asyncio.Queue(maxsize=self.max_pending)
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def submit(self, readings: list[schemas.SensorReadingCreate]) -> list[int]:
+        """
+        Encola lecturas para escribirlas y espera a que se confirmen.
+        Devuelve los ids asignados, en el mismo orden.
+        """
+        if not readings:
+            return []
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((readings, future))
+        return await future
+
+    async def _write(self, readings: list) -> list[int]:
+        start = time.perf_counter()
+        try:
+            async with self.session_factory() as db:
+                return await db.run_sync(crud.create_readings_bulk, readings)
+        except Exception:
+            metrics.WRITE_ERRORS.inc()
+            raise
+        finally:
+            metrics.DB_INSERT_SECONDS.observe(time.perf_counter() - start)
+
+    async def _run(self):
+        while True:
+            pending = [await self.queue.get()]
+            count = len(pending[0][0])
+            # Agrupa lo que ya esta en cola, sin esperar a que llegue mas.
+            while count < self.max_batch and not self.queue.empty():
+                item = self.queue.get_nowait()
+                pending.append(item)
+                count += len(item[0])
+
+            readings = [reading for request, _ in pending for reading in request]
+            try:
+                ids = await self._write(readings)
+            except Exception as error:
+                if len(pending) == 1:
+                    _, future = pending[0]
+                    if not future.done():
+                        future.set_exception(error)
+                    continue
+                # Un error en el grupo no debe hacer fallar a las demas peticiones:
+                # se reintenta cada una por separado.
+                for request, future in pending:
+                    try:
+                        result = await self._write(request)
+                    except Exception as e:
+                        if not future.done():
+                            future.set_exception(e)
+                    else:
+                        self._done(len(request))
+                        if not future.done():
+                            future.set_result(result)
+                continue
+
+            self._done(len(readings))
+            offset = 0
+            for request, future in pending:
+                if not future.done():
+                    future.set_result(ids[offset:offset + len(request)])
+                offset += len(request)
+
+    def _done(self, count: int):
+        self.transactions += 1
+        self.written += count
+        metrics.READINGS_INSERTED.inc(count)
+
+
+writer = ReadingWriter()
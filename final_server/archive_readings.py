@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+"""
+Moves readings older than a number of days from the monthly partitions into
+compressed per-sensor, per-day blocks (see app/archive.py).
+
+The server does this on its own when ARCHIVE_AFTER_DAYS is set; run this to
+archive on demand, e.g. right after loading a large history. Queries and
+exports return the same results before and after archiving.
+"""
+
+import argparse
+import time
+from datetime import timedelta
+from app.database import SessionLocal, engine
+from app import archive, migrations, partitions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--days", type=int, default=archive.ARCHIVE_AFTER_DAYS or 30,
+                        help="Keep this many days of readings in the partitions (default: %(default)s)")
+    args = parser.parse_args()
+
+    migrations.init_db(engine)
+    start = time.perf_counter()
+    with SessionLocal() as db:
+        moved = archive.archive_readings(db, partitions.utcnow() - timedelta(days=args.days))
+        summary = archive.summary(db)
+    print(f"Archived {moved} readings in {time.perf_counter() - start:.1f}s")
+    if summary["readings"]:
+        print(f"Archive: {summary['readings']} readings in {summary['blocks']} blocks, "
+              f"{summary['bytes_per_reading']:.1f} bytes per reading")
@@ -1,27 +1,52 @@
 #!/usr/bin/env python3
 """
 Script to populate the database with dummy sensor data for testing purposes.
+
+The default mode creates a small dataset (5 sensors x 30 days). --generate
+builds large synthetic histories (millions to hundreds of millions of rows)
+with NumPy; --summary prints what is in the database.
 """
 
+import argparse
+import os
 import random
-from datetime import datetime, timedelta
+import sqlite3
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import text
 from sqlalchemy.orm import Session
-from app.database import SessionLocal, engine
-from app import models, schemas
+from app.database import DATABASE_PATH, SessionLocal, engine
+from app import crud, migrations, models, partitions, rollups, schemas, sensor_state
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional: only needed for --generate
+    np = None
+
+# Sensors listed one by one in --summary.
+SUMMARY_MAX_SENSORS = 50
+
+# Rows generated and written per chunk by --generate (bounds memory per process).
+# Chunks hold whole days, so no rollup bucket is split between two chunks.
+GENERATE_CHUNK_ROWS = 200_000
+
+ROLLUP_COLUMNS = [column.name for column in models.SensorReadingRollup.__table__.columns]
 
 def create_dummy_data():
     """
     Creates dummy sensor readings for testing.
     Generates data for 5 different sensors over the last 30 days.
     """
-    # Create database tables
-    models.Base.metadata.create_all(bind=engine)
+    # Create database tables (and the monthly reading partitions)
+    migrations.init_db(engine)
 
     db = SessionLocal()
 
     try:
         # Clear existing data (optional - remove if you want to keep existing data)
-        db.query(models.SensorReadings).delete()
+        partitions.drop_all_partitions(db)
+        db.query(models.SensorReadingRollup).delete()
         db.commit()
 
         # Configuration for dummy data
@@ -40,6 +65,9 @@ def create_dummy_data():
             base_pressure = 1000 + (sensor_id * 5)  # 1005, 1010, 1015, 1020, 1025
             base_humidity = 40 + (sensor_id * 8)  # 48, 56, 64, 72, 80
 
+            # Readings for this sensor, inserted together through the bulk write path
+            sensor_readings = []
+
             # Generate readings for the last 'days_back' days
             for day in range(days_back):
                 date = datetime.now() - timedelta(days=day)
@@ -61,11 +89,10 @@ def create_dummy_data():
                         humidity=round(humidity, 2)
                     )
 
-                    db_reading = models.SensorReadings(**reading_data.model_dump())
-                    db.add(db_reading)
+                    sensor_readings.append(reading_data)
 
-            # Commit after each sensor to avoid memory issues
-            db.commit()
+            # One bulk insert (and commit) per sensor, same path as POST /readings/batch
+            crud.create_readings_bulk(db, sensor_readings)
 
         # Count total readings
         total_readings = db.query(models.SensorReadings).count()
@@ -89,39 +116,213 @@ def create_dummy_data():
     finally:
         db.close()
 
+
+def _month_ranges(start: datetime, end: datetime):
+    """
+    Splits [start, end) into (partition name, month start, month end) pieces,
+    one per monthly partition.
+    """
+    current = start
+    while current < end:
+        next_month = datetime(current.year + current.month // 12, current.month % 12 + 1, 1)
+        piece_end = min(next_month, end)
+        yield partitions.partition_name(current), current, piece_end
+        current = piece_end
+
+
+def _chunk_rollups(sensors, chunk, values: dict) -> list:
+    """
+    Rollup rows (in ROLLUP_COLUMNS order) of one chunk, for every bucket size.
+    `chunk` holds sorted epoch seconds and each array in `values` is shaped
+    (timestamps, sensors), so each bucket is a run of consecutive array rows.
+    """
+    rows = []
+    for bucket, size in rollups.BUCKETS.items():
+        starts = chunk - chunk % size
+        first = np.flatnonzero(np.r_[True, starts[1:] != starts[:-1]])
+        counts = np.diff(np.r_[first, len(chunk)])
+        # Sensor-major output (transposed), the order of the rollups primary key
+        columns = [np.repeat(sensors, len(first)),
+                   np.full(len(first) * len(sensors), bucket),
+                   np.tile(starts[first], len(sensors)),
+                   np.tile(counts, len(sensors))]
+        for metric in rollups.METRICS:
+            columns += [np.add.reduceat(values[metric], first).T.ravel(),
+                        np.minimum.reduceat(values[metric], first).T.ravel(),
+                        np.maximum.reduceat(values[metric], first).T.ravel()]
+        rows.extend(zip(*(column.tolist() for column in columns)))
+    return rows
+
+
+def _fill_month(path: str, month_start: datetime, month_end: datetime,
+                first_sensor: int, num_sensors: int, interval_s: int, seed: int) -> int:
+    """
+    Generates every reading of one month, and its rollups, into a fresh staging
+    SQLite file with two plain tables: readings and rollups.
+
+    Values are computed for a whole chunk at once with NumPy: a per-sensor base,
+    a daily cycle and noise. Rows are time-major (all sensors for one timestamp,
+    then the next), so each partition is written in timestamp order. Runs in a
+    worker process when --workers > 1.
+    """
+    rng = np.random.default_rng(seed)
+    sensors = np.arange(first_sensor, first_sensor + num_sensors)
+    # Per-sensor base values come from their own generator so they are the same in every month.
+    base_rng = np.random.default_rng(first_sensor)
+    base = {"temperature": base_rng.uniform(15, 30, num_sensors),
+            "pressure": base_rng.uniform(1000, 1025, num_sensors),
+            "humidity": base_rng.uniform(45, 75, num_sensors)}
+
+    first = -(-int(month_start.replace(tzinfo=timezone.utc).timestamp()) // interval_s) * interval_s
+    last = int(month_end.replace(tzinfo=timezone.utc).timestamp())
+    times = np.arange(first, last, interval_s, dtype=np.int64)
+    days_per_chunk = max(1, GENERATE_CHUNK_ROWS * interval_s // (num_sensors * 86400))
+    chunk_of = (times - times[:1] // 86400 * 86400) // (days_per_chunk * 86400)
+    chunks = np.split(times, np.flatnonzero(np.diff(chunk_of)) + 1)
+
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute("CREATE TABLE readings (sensor_id INTEGER, timestamp DATETIME, "
+                 "temperature FLOAT, pressure FLOAT, humidity FLOAT)")
+    conn.execute(f"CREATE TABLE rollups ({', '.join(ROLLUP_COLUMNS)})")
+    total = 0
+    for chunk in chunks:
+        shape = (len(chunk), num_sensors)
+        phase = (2 * np.pi * (chunk % 86400) / 86400)[:, None]
+        values = {"temperature": np.round(base["temperature"] + 5 * np.sin(phase) + rng.normal(0, 0.8, shape), 2),
+                  "pressure": np.round(base["pressure"] + 2 * np.cos(phase) + rng.normal(0, 1.5, shape), 2),
+                  "humidity": np.round(np.clip(base["humidity"] - 10 * np.sin(phase) + rng.normal(0, 3, shape),
+                                               0, 100), 2)}
+        # Same text format SQLAlchemy uses for DateTime columns, converted once per timestamp
+        stamps = np.char.replace(np.datetime_as_string(chunk.astype("datetime64[s]").astype("datetime64[us]")),
+                                 "T", " ")
+        rows = zip(np.tile(sensors, len(chunk)).tolist(),
+                   np.repeat(stamps, num_sensors).tolist(),
+                   *(values[metric].ravel().tolist() for metric in rollups.METRICS))
+        conn.executemany("INSERT INTO readings VALUES (?, ?, ?, ?, ?)", rows)
+        conn.executemany(f"INSERT INTO rollups VALUES ({', '.join('?' * len(ROLLUP_COLUMNS))})",
+                         _chunk_rollups(sensors, chunk, values))
+        total += shape[0] * shape[1]
+    conn.commit()
+    conn.close()
+    return total
+
+
+def _merge_month(name: str, path: str) -> int:
+    """
+    Copies a generated month into its partition and adds its rollups, in one
+    transaction. The staging file is attached so both steps are INSERT ... SELECT.
+    """
+    with engine.connect() as conn:
+        conn.execute(text("ATTACH DATABASE :path AS staging"), {"path": path})
+        try:
+            rollups.merge_rollups(conn, "staging.rollups")
+            count = partitions.copy_rows(conn, name, "staging.readings")
+            conn.commit()
+        finally:
+            conn.execute(text("DETACH DATABASE staging"))
+    return count
+
+
+def generate_history(num_sensors: int = 1000,
+                     days: int = 30,
+                     interval_s: int = 60,
+                     first_sensor: int = 1,
+                     workers: int = 1,
+                     append: bool = False,
+                     seed: int = 0):
+    """
+    Generates num_sensors x days x (86400 / interval_s) readings ending now.
+
+    Each month is generated into a staging file (in parallel with --workers)
+    and merged into its partition as soon as it is ready. Writes to the main
+    database are serialized, since SQLite has a single writer.
+    """
+    if np is None:
+        raise SystemExit("--generate requires NumPy: pip install numpy")
+
+    migrations.init_db(engine)
+    if not append:
+        with SessionLocal() as db:
+            partitions.drop_all_partitions(db)
+            db.query(models.SensorReadingRollup).delete()
+            db.commit()
+
+    end = datetime.now(timezone.utc).replace(tzinfo=None, second=0, microsecond=0)
+    months = list(_month_ranges(end - timedelta(days=days), end))
+    expected = num_sensors * days * 86400 // interval_s
+    print(f"Generating ~{expected:,} readings for {num_sensors} sensors over {days} days "
+          f"({len(months)} partitions, {workers} worker(s))...")
+
+    staging_dir = tempfile.mkdtemp(prefix="populate_", dir=os.path.dirname(DATABASE_PATH))
+    jobs = {name: (os.path.join(staging_dir, f"{name}.db"), month_start, month_end,
+                   first_sensor, num_sensors, interval_s, seed + index)
+            for index, (name, month_start, month_end) in enumerate(months)}
+    started = datetime.now()
+    total = 0
+
+    def merge(name):
+        nonlocal total
+        path = jobs[name][0]
+        total += _merge_month(name, path)
+        os.remove(path)
+        elapsed = (datetime.now() - started).total_seconds()
+        print(f"  {name}: {total:,} readings ({total / elapsed:,.0f} rows/s)")
+
+    try:
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = {pool.submit(_fill_month, *args): name for name, args in jobs.items()}
+                for future in as_completed(futures):
+                    future.result()
+                    merge(futures[future])
+        else:
+            for name, args in jobs.items():
+                _fill_month(*args)
+                merge(name)
+    finally:
+        for leftover in os.listdir(staging_dir):
+            os.remove(os.path.join(staging_dir, leftover))
+        os.rmdir(staging_dir)
+
+    # The bulk load bypasses crud, so the per-sensor state is recomputed from history
+    print("Rebuilding sensor state...")
+    with SessionLocal() as db:
+        sensor_state.rebuild_state(db)
+
+    print(f"Successfully generated {total:,} readings.")
+
+
 def show_data_summary():
     """
     Shows a summary of the current data in the database.
+    Everything comes from the sensor_state table (one row per sensor).
     """
     db = SessionLocal()
     try:
-        total_readings = db.query(models.SensorReadings).count()
-        if total_readings == 0:
+        per_sensor = db.query(models.SensorState).order_by(models.SensorState.sensor_id).all()
+        if not per_sensor:
             print("No sensor readings found in database.")
             return
 
+        total_readings = sum(state.count for state in per_sensor)
+        oldest = min(state.first_timestamp for state in per_sensor)
+        newest = max(state.last_timestamp for state in per_sensor)
+
         print(f"\nDatabase Summary:")
         print(f"Total readings: {total_readings}")
+        print(f"Sensors: {len(per_sensor)} ({per_sensor[0].sensor_id} to {per_sensor[-1].sensor_id})")
+        print(f"Date range: {oldest.date()} to {newest.date()}")
 
-        # Get unique sensor IDs
-        sensor_ids = db.query(models.SensorReadings.sensor_id).distinct().all()
-        sensor_ids = [sid[0] for sid in sensor_ids]
-        print(f"Sensors: {sorted(sensor_ids)}")
-
-        # Get date range
-        oldest = db.query(models.SensorReadings).order_by(models.SensorReadings.timestamp.asc()).first()
-        newest = db.query(models.SensorReadings).order_by(models.SensorReadings.timestamp.desc()).first()
-
-        if oldest and newest:
-            print(f"Date range: {oldest.timestamp.date()} to {newest.timestamp.date()}")
-
-        # Show readings per sensor
+        # Show readings per sensor (the first ones, with thousands of sensors)
         print("\nReadings per sensor:")
-        for sensor_id in sorted(sensor_ids):
-            count = db.query(models.SensorReadings)\
-                .filter(models.SensorReadings.sensor_id == sensor_id)\
-                .count()
-            print(f"  Sensor {sensor_id}: {count} readings")
+        for state in per_sensor[:SUMMARY_MAX_SENSORS]:
+            print(f"  Sensor {state.sensor_id}: {state.count} readings "
+                  f"({state.first_timestamp.date()} to {state.last_timestamp.date()}), "
+                  f"last temperature {state.last_temperature:.2f}")
+        if len(per_sensor) > SUMMARY_MAX_SENSORS:
+            print(f"  ... and {len(per_sensor) - SUMMARY_MAX_SENSORS} more sensors")
 
     except Exception as e:
         print(f"Error showing summary: {e}")
@@ -129,10 +330,25 @@ def show_data_summary():
         db.close()
 
 if __name__ == "__main__":
-    import sys
+    parser = argparse.ArgumentParser(description="Populate the database with dummy sensor data")
+    parser.add_argument("--summary", action="store_true", help="Show a summary of the current data")
+    parser.add_argument("--generate", action="store_true",
+                        help="Generate a large synthetic history with NumPy instead of the small default dataset")
+    parser.add_argument("--sensors", type=int, default=1000, help="Sensors to generate (--generate)")
+    parser.add_argument("--days", type=int, default=30, help="Days of history ending now (--generate)")
+    parser.add_argument("--interval", type=int, default=60, help="Seconds between readings of a sensor (--generate)")
+    parser.add_argument("--first-sensor", type=int, default=1, help="sensor_id of the first sensor (--generate)")
+    parser.add_argument("--workers", type=int, default=1, help="Processes generating months in parallel (--generate)")
+    parser.add_argument("--append", action="store_true", help="Keep existing readings (--generate)")
+    args = parser.parse_args()
 
-    if len(sys.argv) > 1 and sys.argv[1] == "--summary":
+    if args.summary:
         show_data_summary()
+    elif args.generate:
+        generate_history(num_sensors=args.sensors, days=args.days, interval_s=args.interval,
+                         first_sensor=args.first_sensor, workers=args.workers, append=args.append)
+        print("\nTo see a summary of the data, run:")
+        print("python populate_dummy_data.py --summary")
     else:
         print("Creating dummy sensor data...")
         create_dummy_data()
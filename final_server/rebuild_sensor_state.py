@@ -0,0 +1,20 @@
+#!/usr/bin/env python3
+"""
+Recomputes the per-sensor state (last reading, count, min/max, mean/std) from
+the stored readings.
+
+The API keeps sensor_state up to date on every insert; run this after loading
+readings by other means (e.g. copying partitions or bulk imports).
+"""
+
+import time
+from app.database import SessionLocal, engine
+from app import migrations, sensor_state
+
+if __name__ == "__main__":
+    migrations.init_db(engine)
+    start = time.perf_counter()
+    with SessionLocal() as db:
+        sensor_state.rebuild_state(db)
+        sensors = db.query(sensor_state.State).count()
+    print(f"Rebuilt state of {sensors} sensors in {time.perf_counter() - start:.1f}s")
@@ -0,0 +1,36 @@
+# Pruebas de GET /readings/ contra una base de datos temporal
+# Ejecutar desde final_server/: python -m pytest tests
+import os
+import sys
+import tempfile
+
+# La base de datos se elige al importar app.database
+os.environ["DATABASE_PATH"] = os.path.join(tempfile.mkdtemp(), "test.db")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient
+from app.final_server import app
+
+
+def _reading(sensor_id: int, second: int) -> dict:
+    return {"sensor_id": sensor_id, "timestamp": f"2026-01-01T00:00:{second:02d}",
+            "temperature": 20.0 + second, "pressure": 1013.0, "humidity": 50.0}
+
+
+def test_cursor_with_timezone_aware_end_date():
+    with TestClient(app) as client:
+        response = client.post("/readings/batch", json=[_reading(7, second) for second in range(10)])
+        assert response.status_code < 300
+
+        params = {"sensor_id": 7, "end_date": "2026-01-01T00:00:08Z", "limit": 3}
+        first = client.get("/readings/", params=params)
+        assert first.status_code == 200
+        assert [reading["timestamp"] for reading in first.json()] == \
+            ["2026-01-01T00:00:08", "2026-01-01T00:00:07", "2026-01-01T00:00:06"]
+
+        # end_date con zona horaria y cursor (naive) en la misma consulta
+        second = client.get("/readings/", params={**params, "cursor": first.headers["X-Next-Cursor"]})
+        assert second.status_code == 200
+        assert [reading["timestamp"] for reading in second.json()] == \
+            ["2026-01-01T00:00:05", "2026-01-01T00:00:04", "2026-01-01T00:00:03"]
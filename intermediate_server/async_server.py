@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import metrics
+
+log = logging.getLogger(__name__)
+
+#Límite de conexiones pendientes en la cola de accept().
+#Con decenas de miles de sensores conviene un backlog alto para absorber reconexiones masivas.
+ASYNC_BACKLOG = 4096
+
+#Tamaño máximo del buffer de lectura por conexión (bytes).
+#Es suficiente para varios paquetes; evita que un sensor acapare memoria si el servidor se atrasa.
+ASYNC_READ_LIMIT = 64 * 1024
+
+#Servidor de ingesta basado en asyncio.
+#A diferencia de ThreadingTCPServer, no crea un hilo del sistema operativo por conexión:
+#cada sensor es una corrutina, por lo que miles de sensores inactivos cuestan solo unos KB cada uno.
+#Las conexiones se mantienen abiertas y se lee un flujo ilimitado de paquetes v1 o frames v2.
+class AsyncSensorServer:
+
+    def __init__(self, host, port, prefijo_size, longitud_restante, procesar_paquete, reuse_port=False,
+                 captura=None):
+        self.host = host
+        self.port = port
+        #Con SO_REUSEPORT varios procesos worker escuchan el mismo puerto y el kernel reparte las conexiones.
+        self.reuse_port = reuse_port
+        #Cada paquete se lee en dos pasos: un prefijo de tamaño fijo y luego los bytes que
+        #indique longitud_restante(prefijo) (lanza ValueError si el prefijo no es válido).
+        self.prefijo_size = prefijo_size
+        self.longitud_restante = longitud_restante
+        #Función que procesa un paquete completo (prefijo y resto).
+        self.procesar_paquete = procesar_paquete
+        #Captura opcional de los bytes recibidos (capture.Captura).
+        self.captura = captura
+        self.conexiones_activas = 0
+
+    #Se ejecuta una vez por conexión de sensor y procesa paquetes hasta que el sensor cierre.
+    async def manejar_conexion(self, reader, writer):
+        peer = writer.get_extra_info('peername')
+        self.conexiones_activas += 1
+        log.info("Conexión recibida de %s:%s", peer[0], peer[1])
+        conexion = self.captura.abrir_conexion(peer) if self.captura else None
+
+        try:
+            while True:
+                #readexactly reensambla lecturas parciales internamente en el buffer del StreamReader.
+                try:
+                    prefijo = await reader.readexactly(self.prefijo_size)
+                except asyncio.IncompleteReadError as e:
+                    #Si hay bytes parciales, el sensor cerró a mitad de un paquete.
+                    if e.partial:
+                        self._capturar(conexion, e.partial)
+                        self._incompleto(e.expected, len(e.partial))
+                    break
+
+                try:
+                    restante = self.longitud_restante(prefijo)
+                except ValueError as e:
+                    self._capturar(conexion, prefijo)
+                    metrics.FRAMES_INVALID.inc()
+                    log.warning("%s. Se cierra la conexión.", e)
+                    break
+
+                try:
+                    data = prefijo + await reader.readexactly(restante)
+                except asyncio.IncompleteReadError as e:
+                    self._capturar(conexion, prefijo + e.partial)
+                    self._incompleto(self.prefijo_size + restante, self.prefijo_size + len(e.partial))
+                    break
+
+                self._capturar(conexion, data)
+
+                #El procesamiento no bloquea (el reenvío HTTP solo encola), así que se ejecuta
+                #directamente en el loop, preservando el orden de los paquetes de cada sensor.
+                self.procesar_paquete(data)
+
+        except (ConnectionResetError, BrokenPipeError) as e:
+            log.warning("Conexión interrumpida por el sensor: %s", e)
+        except Exception as e:
+            log.exception("Ocurrió un error inesperado durante la conexión: %s", e)
+        finally:
+            if conexion:
+                self.captura.cerrar_conexion(conexion)
+            self.conexiones_activas -= 1
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except Exception:
+                pass
+            log.info("Conexión con %s:%s cerrada.", peer[0], peer[1])
+
+    #Con captura, guarda los bytes tal como llegaron, antes de validarlos.
+    def _capturar(self, conexion, data):
+        if conexion:
+            self.captura.frame(conexion, data)
+
+    @staticmethod
+    def _incompleto(esperados, recibidos):
+        metrics.PACKETS_INCOMPLETE.inc()
+        log.warning("Paquete incompleto, se esperaban %d bytes, se recibieron %d. (Descartando...)",
+                    esperados, recibidos)
+
+    async def serve_forever(self):
+        server = await asyncio.start_server(self.manejar_conexion,
+                                            self.host,
+                                            self.port,
+                                            backlog=ASYNC_BACKLOG,
+                                            limit=ASYNC_READ_LIMIT,
+                                            reuse_port=self.reuse_port or None)
+        async with server:
+            await server.serve_forever()
+
+#Punto de entrada bloqueante, equivalente a server.serve_forever() del servidor con hilos.
+def run_async_server(host, port, prefijo_size, longitud_restante, procesar_paquete, reuse_port=False,
+                     captura=None):
+    servidor = AsyncSensorServer(host, port, prefijo_size, longitud_restante, procesar_paquete,
+                                 reuse_port=reuse_port, captura=captura)
+    asyncio.run(servidor.serve_forever())
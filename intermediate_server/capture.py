@@ -0,0 +1,191 @@
+import itertools
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+#Captura de los bytes crudos que recibe el servidor de ingesta, para volver a enviarlos con
+#benchmark/replay.py (por ejemplo para reproducir una ráfaga real contra una versión nueva).
+#Cada proceso escribe archivos de tamaño fijo, preasignados y mapeados en memoria como los del
+#spool: guardar un frame es copiar sus bytes al mapa y escribir su cabecera, sin llamadas al sistema.
+#Al llenarse un archivo se pasa al siguiente y, si el directorio supera el límite de disco,
+#se borra el más antiguo.
+
+#Directorio por defecto de las capturas (cada worker usa un subdirectorio worker-N).
+CAPTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "capturas")
+
+#Tamaño de cada archivo de captura (se preasigna y se recorta al cerrarlo).
+CAPTURE_SEGMENT_SIZE = 64 * 1024 * 1024
+#Uso máximo de disco del directorio. Al superarlo se borra el archivo más antiguo.
+CAPTURE_MAX_BYTES = 1024 * 1024 * 1024
+
+#Cabecera de cada archivo: magic, versión, PID y hora de inicio de la captura (ns).
+#PID e inicio identifican la sesión; el número de conexión solo es único dentro de ella.
+MAGIC = b"SCAP"
+VERSION = 1
+FILE_HEADER = struct.Struct('<4sHxxIQ')
+
+#Cada registro: hora de llegada (ns desde epoch, UTC), número de conexión, largo de los datos
+#y tipo, seguido de los datos. Un tipo FIN marca el final (el archivo se crea lleno de ceros).
+RECORD_HEADER = struct.Struct('<QIHBx')
+FIN = 0
+CONEXION = 1  # conexión nueva; datos: "ip:puerto" del sensor
+DATOS = 2     # bytes recibidos: un paquete v1, un frame v2 o lo que llegó antes de cerrarse la conexión
+CIERRE = 3    # conexión cerrada; sin datos
+
+
+#Escritor de capturas de un proceso. Lo comparten todas las conexiones (hilos o corrutinas).
+class Captura:
+
+    def __init__(self, directory=CAPTURE_DIR, segment_size=CAPTURE_SEGMENT_SIZE, max_bytes=CAPTURE_MAX_BYTES):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_bytes = max(max_bytes, segment_size)
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        self.inicio = time.time_ns()
+        self._numeros = itertools.count(1)
+        self._seq = 0
+        self._map = None
+        self._ruta = None
+        self._pos = 0
+        #Estadísticas
+        self.conexiones = 0
+        self.frames = 0
+        self.bytes = 0
+
+        os.makedirs(self.directory, exist_ok=True)
+        with self.lock:
+            self._rotar()
+
+    #Registra una conexión nueva y devuelve su número, que se pasa a frame() y cerrar_conexion().
+    def abrir_conexion(self, peer):
+        conexion = next(self._numeros)
+        self._registrar(conexion, CONEXION, f"{peer[0]}:{peer[1]}".encode())
+        return conexion
+
+    #Guarda los bytes recibidos tal como llegaron, antes de validarlos.
+    #Es el camino de cada paquete, así que repite _registrar sin llamadas intermedias.
+    def frame(self, conexion, data):
+        largo = len(data)
+        with self.lock:
+            inicio = self._pos + RECORD_HEADER.size
+            if self._map is None or inicio + largo + RECORD_HEADER.size > self.segment_size:
+                self._registrar_con_lock(conexion, DATOS, data)
+                return
+            self._map[inicio:inicio + largo] = data
+            RECORD_HEADER.pack_into(self._map, self._pos, time.time_ns(), conexion, largo, DATOS)
+            self._pos = inicio + largo
+            self.frames += 1
+            self.bytes += largo
+
+    def cerrar_conexion(self, conexion):
+        self._registrar(conexion, CIERRE, b"")
+
+    def stats(self):
+        return {"conexiones": self.conexiones, "frames": self.frames, "bytes": self.bytes,
+                "archivo": self._ruta}
+
+    #Cierra el archivo actual recortándolo a lo escrito. Los registros posteriores se ignoran.
+    def close(self):
+        with self.lock:
+            self._cerrar()
+        log.info("[CAPTURA] %d conexiones y %d frames (%d bytes) en %s",
+                 self.conexiones, self.frames, self.bytes, self.directory)
+
+    #--- Funciones internas (_registrar_con_lock, _rotar y siguientes se llaman con self.lock tomado) ---
+
+    def _registrar(self, conexion, tipo, datos):
+        with self.lock:
+            self._registrar_con_lock(conexion, tipo, datos)
+
+    def _registrar_con_lock(self, conexion, tipo, datos):
+        if self._map is None:
+            return
+        #Se deja espacio para el marcador de fin.
+        if self._pos + 2 * RECORD_HEADER.size + len(datos) > self.segment_size:
+            self._rotar()
+        #Primero los datos y luego la cabecera: un registro a medio escribir queda invisible.
+        inicio = self._pos + RECORD_HEADER.size
+        self._map[inicio:inicio + len(datos)] = datos
+        RECORD_HEADER.pack_into(self._map, self._pos, time.time_ns(), conexion, len(datos), tipo)
+        self._pos = inicio + len(datos)
+        if tipo == DATOS:
+            self.frames += 1
+            self.bytes += len(datos)
+        elif tipo == CONEXION:
+            self.conexiones += 1
+
+    #Pasa a un archivo nuevo.
+    def _rotar(self):
+        self._cerrar()
+        self._seq += 1
+        #El nombre ordena los archivos por sesión y secuencia.
+        self._ruta = os.path.join(self.directory, f"cap-{self.inicio}-{self.pid}-{self._seq:05d}.cap")
+        with open(self._ruta, "w+b") as f:
+            f.truncate(self.segment_size)
+            self._map = mmap.mmap(f.fileno(), self.segment_size, access=mmap.ACCESS_WRITE)
+        FILE_HEADER.pack_into(self._map, 0, MAGIC, VERSION, self.pid, self.inicio)
+        self._pos = FILE_HEADER.size
+        self._limitar()
+
+    def _cerrar(self):
+        if self._map is None:
+            return
+        self._map.flush()
+        self._map.close()
+        self._map = None
+        os.truncate(self._ruta, self._pos)
+
+    #Borra los archivos más antiguos del directorio mientras se supere el límite de disco.
+    def _limitar(self):
+        archivos = sorted(os.path.join(self.directory, nombre) for nombre in os.listdir(self.directory)
+                          if nombre.startswith("cap-") and nombre.endswith(".cap"))
+        tamanos = [os.path.getsize(archivo) for archivo in archivos]
+        total = sum(tamanos)
+        for archivo, tamano in zip(archivos, tamanos):
+            if total <= self.max_bytes or archivo == self._ruta:
+                break
+            os.remove(archivo)
+            total -= tamano
+            log.warning("[CAPTURA] Límite de disco alcanzado, se borra %s", archivo)
+
+
+#Archivos de captura de las rutas dadas (archivos o directorios, que se recorren completos).
+def archivos_captura(rutas):
+    archivos = []
+    for ruta in rutas:
+        if os.path.isdir(ruta):
+            for directorio, _, nombres in os.walk(ruta):
+                archivos += [os.path.join(directorio, nombre) for nombre in nombres
+                             if nombre.startswith("cap-") and nombre.endswith(".cap")]
+        else:
+            archivos.append(ruta)
+    return sorted(archivos, key=os.path.basename)
+
+
+#Recorre los registros de un archivo de captura: (llegada_ns, clave de conexión, tipo, datos).
+#El archivo se mapea en memoria y los datos son memoryviews sobre el mapa, sin copiarlos.
+#La clave (pid, inicio, conexión) distingue conexiones de distintos procesos y sesiones.
+def leer_captura(ruta):
+    if os.path.getsize(ruta) < FILE_HEADER.size:
+        return
+    with open(ruta, "rb") as f:
+        m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, pid, inicio = FILE_HEADER.unpack_from(m)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{ruta} no es un archivo de captura (versión {VERSION})")
+    vista = memoryview(m)
+    pos = FILE_HEADER.size
+    while pos + RECORD_HEADER.size <= len(m):
+        llegada, conexion, largo, tipo = RECORD_HEADER.unpack_from(m, pos)
+        inicio_datos = pos + RECORD_HEADER.size
+        #Un archivo que no se cerró (el proceso terminó de golpe) sigue lleno de ceros.
+        if tipo == FIN or inicio_datos + largo > len(m):
+            break
+        yield llegada, (pid, inicio, conexion), tipo, vista[inicio_datos:inicio_datos + largo]
+        pos = inicio_datos + largo
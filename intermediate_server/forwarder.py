@@ -0,0 +1,270 @@
+import logging
+import queue
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+import metrics
+
+log = logging.getLogger(__name__)
+
+#Capacidad de la cola en memoria entre los manejadores de sockets y el reenvío HTTP.
+#Si se llena, las lecturas nuevas se descartan en vez de bloquear la ingesta.
+FORWARD_QUEUE_SIZE = 10000
+
+#Un lote se envía cuando alcanza este tamaño (no debe superar MAX_BATCH_SIZE del servidor final)...
+FORWARD_BATCH_SIZE = 100
+#...o cuando pasa este tiempo (segundos) desde que llegó su primera lectura.
+FORWARD_LINGER_S = 0.05
+
+#Hilos que envían lotes en paralelo, cada uno reutiliza conexiones keep-alive del pool.
+FORWARD_WORKERS = 2
+
+#Reintentos por lote con backoff exponencial: 0.5s, 1s, 2s, ... hasta FORWARD_BACKOFF_MAX_S.
+FORWARD_MAX_RETRIES = 5
+FORWARD_BACKOFF_S = 0.5
+FORWARD_BACKOFF_MAX_S = 10.0
+FORWARD_TIMEOUT_S = 5
+
+#Con spool activo se reintenta menos: tras fallar, el lote va al disco y la cola sigue fluyendo.
+FORWARD_SPOOL_RETRIES = 1
+
+#Tamaño de los lotes al vaciar el spool (no debe superar MAX_BATCH_SIZE del servidor final)
+#y espera entre intentos mientras el servidor final siga caído.
+SPOOL_DRAIN_BATCH = 5000
+SPOOL_DRAIN_INTERVAL_S = 1.0
+
+#Cada cuántos segundos se imprimen las estadísticas del reenvío (0 para desactivar).
+FORWARD_STATS_INTERVAL_S = 30
+
+#Etapa de reenvío desacoplada de la ingesta.
+#Los manejadores de sockets solo encolan (enviar() nunca bloquea); unos pocos hilos
+#agrupan las lecturas en lotes por tamaño o tiempo y las envían al servidor final
+#por una sesión HTTP con pool de conexiones persistentes.
+#Si se entrega un spool, las lecturas que no se pueden enviar (servidor final caído o lento,
+#cola llena) se guardan en disco y un hilo aparte las reenvía cuando el servidor se recupera.
+class Forwarder:
+
+    def __init__(self, url, workers=FORWARD_WORKERS, queue_size=FORWARD_QUEUE_SIZE,
+                 batch_size=FORWARD_BATCH_SIZE, linger_s=FORWARD_LINGER_S, spool=None):
+        self.url = url
+        self.spool = spool
+        #Falso mientras el servidor final no responda; los lotes van directo al spool.
+        self.servidor_ok = True
+        self.workers = workers
+        self.batch_size = batch_size
+        self.linger_s = linger_s
+        self.cola = queue.Queue(maxsize=queue_size)
+
+        #Sesión compartida: requests.Session es seguro entre hilos para peticiones simples,
+        #y el adaptador mantiene hasta pool_maxsize conexiones abiertas al servidor final
+        #(una por hilo de envío más la del vaciado del spool).
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers + 1)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        #Estadísticas para ajustar el tamaño de la cola y de los lotes.
+        self._stats_lock = threading.Lock()
+        self.encoladas = 0
+        self.descartadas = 0
+        self.enviadas = 0
+        self.fallidas = 0
+        self.rechazadas = 0
+        self.reintentos = 0
+        self.al_spool = 0
+        self.desde_spool = 0
+        self.lotes = 0
+        self.lecturas_en_lotes = 0
+        self.lote_max = 0
+        self.profundidad_max = 0
+
+    #Inicia los hilos de envío (y el de estadísticas, si está activo).
+    def start(self):
+        for i in range(self.workers):
+            hilo = threading.Thread(target=self._worker, name=f"forwarder-{i}", daemon=True)
+            hilo.start()
+        if self.spool is not None:
+            hilo = threading.Thread(target=self._vaciar_spool, name="forwarder-spool", daemon=True)
+            hilo.start()
+        if FORWARD_STATS_INTERVAL_S > 0:
+            hilo = threading.Thread(target=self._reportar_stats, name="forwarder-stats", daemon=True)
+            hilo.start()
+
+    #Encola una lectura para reenviarla. Si la cola está llena va al spool;
+    #sin spool se descarta y se devuelve False.
+    def enviar(self, payload):
+        try:
+            self.cola.put_nowait(payload)
+        except queue.Full:
+            if self._a_spool([payload]):
+                return True
+            with self._stats_lock:
+                self.descartadas += 1
+            metrics.READINGS_FAILED.inc()
+            return False
+        with self._stats_lock:
+            self.encoladas += 1
+            profundidad = self.cola.qsize()
+            if profundidad > self.profundidad_max:
+                self.profundidad_max = profundidad
+        return True
+
+    #Devuelve un diccionario con el estado actual del reenvío.
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "profundidad_cola": self.cola.qsize(),
+                "capacidad_cola": self.cola.maxsize,
+                "profundidad_max": self.profundidad_max,
+                "encoladas": self.encoladas,
+                "descartadas": self.descartadas,
+                "enviadas": self.enviadas,
+                "fallidas": self.fallidas,
+                "rechazadas": self.rechazadas,
+                "reintentos": self.reintentos,
+                "al_spool": self.al_spool,
+                "desde_spool": self.desde_spool,
+                "spool": self.spool.stats() if self.spool is not None else None,
+                "lotes": self.lotes,
+                "lote_promedio": round(self.lecturas_en_lotes / self.lotes, 2) if self.lotes else 0,
+                "lote_max": self.lote_max,
+            }
+
+    #Espera la primera lectura y luego junta más hasta llenar el lote o agotar el tiempo de espera.
+    def _siguiente_lote(self):
+        lote = [self.cola.get()]
+        limite = time.monotonic() + self.linger_s
+        while len(lote) < self.batch_size:
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                break
+            try:
+                lote.append(self.cola.get(timeout=restante))
+            except queue.Empty:
+                break
+        return lote
+
+    def _worker(self):
+        while True:
+            lote = self._siguiente_lote()
+            with self._stats_lock:
+                self.lotes += 1
+                self.lecturas_en_lotes += len(lote)
+                if len(lote) > self.lote_max:
+                    self.lote_max = len(lote)
+            #Con el servidor final caído no se espera: el lote va directo al spool.
+            if not self.servidor_ok and self._a_spool(lote):
+                continue
+            try:
+                perdidas = self._enviar_con_reintentos(lote)
+            except Exception as e:
+                log.exception("Error inesperado en el reenvío: %s", e)
+                perdidas = lote
+            if perdidas and not self._a_spool(perdidas):
+                with self._stats_lock:
+                    self.fallidas += len(perdidas)
+                metrics.READINGS_FAILED.inc(len(perdidas))
+
+    #Guarda lecturas en el spool. Devuelve False si no hay spool o no se pudo escribir.
+    def _a_spool(self, lecturas):
+        if self.spool is None:
+            return False
+        try:
+            self.spool.append(lecturas)
+        except Exception as e:
+            log.error("No se pudo escribir en el spool: %s", e)
+            return False
+        with self._stats_lock:
+            self.al_spool += len(lecturas)
+        metrics.READINGS_SPOOLED.inc(len(lecturas))
+        return True
+
+    #Hilo que vacía el spool en lotes grandes. También sirve de sonda: el primer lote
+    #aceptado marca al servidor final como disponible otra vez.
+    def _vaciar_spool(self):
+        espera = SPOOL_DRAIN_INTERVAL_S
+        while True:
+            if self.spool.is_empty():
+                self.spool.flush()
+                time.sleep(SPOOL_DRAIN_INTERVAL_S)
+                continue
+            lecturas, cursor = self.spool.read_batch(SPOOL_DRAIN_BATCH)
+            try:
+                pendientes = self._enviar_lote(lecturas)
+            except requests.exceptions.RequestException:
+                pendientes = lecturas
+            except Exception as e:
+                log.exception("Error inesperado al vaciar el spool: %s", e)
+                pendientes = lecturas
+            if pendientes:
+                self.servidor_ok = False
+                time.sleep(espera)
+                espera = min(espera * 2, FORWARD_BACKOFF_MAX_S)
+                continue
+            self.spool.commit(cursor)
+            self.servidor_ok = True
+            espera = SPOOL_DRAIN_INTERVAL_S
+            with self._stats_lock:
+                self.desde_spool += len(lecturas)
+
+    #Envía un lote reintentando con backoff exponencial ante errores de red o respuestas 5xx.
+    #Devuelve las lecturas que no se pudieron entregar tras agotar los reintentos.
+    def _enviar_con_reintentos(self, lote):
+        backoff = FORWARD_BACKOFF_S
+        max_reintentos = FORWARD_SPOOL_RETRIES if self.spool is not None else FORWARD_MAX_RETRIES
+        for intento in range(max_reintentos + 1):
+            if intento > 0:
+                with self._stats_lock:
+                    self.reintentos += 1
+                time.sleep(backoff)
+                backoff = min(backoff * 2, FORWARD_BACKOFF_MAX_S)
+            try:
+                #Solo se reintentan las lecturas que no se aceptaron.
+                lote = self._enviar_lote(lote)
+            except requests.exceptions.RequestException as e:
+                log.error("No se pudo conectar con el servidor final. (Error: %s)", e)
+                continue
+            if not lote:
+                self.servidor_ok = True
+                return []
+        self.servidor_ok = False
+        if self.spool is not None:
+            log.warning("Servidor final no disponible. %d lecturas enviadas al spool.", len(lote))
+        else:
+            log.error("Se descartan %d lecturas tras %d reintentos.", len(lote), max_reintentos)
+        return lote
+
+    #Envía el lote completo en una sola petición a POST /readings/batch por la conexión persistente
+    #y devuelve las lecturas que deben reintentarse.
+    #Un 5xx reintenta el lote entero; las lecturas rechazadas individualmente (o un 4xx) no se reintentan.
+    def _enviar_lote(self, lote):
+        inicio = time.perf_counter()
+        respuesta = self.session.post(self.url, json=lote, timeout=FORWARD_TIMEOUT_S)
+        metrics.FORWARD_SECONDS.observe(time.perf_counter() - inicio)
+
+        if respuesta.status_code >= 500:
+            log.warning("Error del servidor final (Código: %d). Reintentando lote...", respuesta.status_code)
+            return lote
+        if not 200 <= respuesta.status_code < 300:
+            with self._stats_lock:
+                self.rechazadas += len(lote)
+            metrics.READINGS_FAILED.inc(len(lote))
+            log.error("Error del servidor final (Código: %d): %s", respuesta.status_code, respuesta.text)
+            return []
+
+        resultado = respuesta.json()
+        with self._stats_lock:
+            self.enviadas += resultado["inserted"]
+            self.rechazadas += resultado["failed"]
+        metrics.READINGS_FORWARDED.inc(resultado["inserted"])
+        if resultado["failed"]:
+            metrics.READINGS_FAILED.inc(resultado["failed"])
+            errores = [r for r in resultado["results"] if r["status"] != "ok"]
+            log.warning("El servidor final rechazó %d lecturas: %s", resultado["failed"], errores[:3])
+        return []
+
+    def _reportar_stats(self):
+        while True:
+            time.sleep(FORWARD_STATS_INTERVAL_S)
+            log.info("[FORWARD] %s", self.stats())
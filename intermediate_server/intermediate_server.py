@@ -1,13 +1,22 @@
+import argparse
+import os
 import socketserver
 import struct
-import hmac
-import hashlib
 import json
-import requests
+import logging
 import threading
 import time
 from datetime import datetime, timezone
 import modbus_server
+import async_server
+import forwarder
+import spool
+import key_registry
+import workers
+import metrics
+import capture
+
+log = logging.getLogger(__name__)
 
 #Direccion y puerto donde el servidor intermedio escuchará las conexiones TCP del sensor C++
 LISTEN_HOST = "0.0.0.0"  # Escuchar en todas las interfaces de red disponibles
@@ -15,10 +24,23 @@ LISTEN_PORT = 8080
 
 #URL del Servidor Final (FastAPI) al que se reenviarán los datos
 FINAL_SERVER_URL = "http://localhost:8000/readings/"
+#Endpoint de inserción por lotes usado por el Forwarder
+FINAL_SERVER_BATCH_URL = "http://localhost:8000/readings/batch"
+
+#Etapa de reenvío por lotes hacia el servidor final. Se crea al iniciar el servidor.
+FORWARDER = None
+
+#Captura de los bytes recibidos (--captura). Se crea al iniciar el servidor si se pidió.
+CAPTURA = None
 
 #Clave secreta compartida para la verificación HMAC. Misma que en el cliente C++.
+#Se usa para todos los sensores solo si no existe el archivo de claves por sensor (key_registry.KEYS_FILE).
 HMAC_KEY = b"clave_secreta_1111"
 
+#Registro de claves por sensor y ventana anti-repetición. Se crean al iniciar el servidor.
+CLAVES = None
+VENTANA_REPLAY = None
+
 #Definición del formato del paquete binario y su tamaño.
 PACKET_FORMAT = '<hQfff32s'
 #Corresponde a la struct SensorPacket de C++: <h Q f f f 32s>
@@ -33,94 +55,354 @@ PACKET_FORMAT = '<hQfff32s'
 #Definición del tamaño del paquete binario .
 PACKET_SIZE = struct.calcsize(PACKET_FORMAT) # Debería ser 54 bytes
 
+#Campos firmados (todo menos la firma), precompilados para desempaquetar sin copiar.
+CAMPOS = struct.Struct('<hQfff')
+MESSAGE_SIZE = CAMPOS.size # 22 bytes; la firma ocupa el resto del paquete
+
+#Protocolo v2: un frame con varias lecturas de un mismo sensor y una sola firma.
+# Cabecera '<2sBhH' (7 bytes): MAGIC_V2, versión, sensor_id, cantidad de registros N
+# N registros '<Qfff' (20 bytes c/u): timestamp_ms, temperatura, presión, humedad
+# Firma HMAC-SHA256 (32 bytes) de la cabecera y los registros
+#Los dos protocolos se aceptan en el mismo puerto y se distinguen por los primeros bytes:
+#MAGIC_V2 leído como sensor_id de un paquete v1 (int16 little-endian) es -1371, un id reservado.
+MAGIC_V2 = b"\xa5\xfa"
+VERSION_V2 = 2
+CABECERA_V2 = struct.Struct('<2sBhH')
+REGISTRO_V2 = struct.Struct('<Qfff')
+FIRMA_SIZE = 32
+#Máximo de registros por frame. Una cabecera fuera de rango cierra la conexión.
+MAX_REGISTROS_V2 = 1024
+
+#Bytes que se leen primero de cada paquete o frame para saber su protocolo y su largo.
+PREFIJO_SIZE = CABECERA_V2.size
+
+#Devuelve cuántos bytes faltan leer después del prefijo.
+#Lanza ValueError si es una cabecera v2 inválida: el flujo ya no se puede resincronizar.
+def longitud_restante(prefijo):
+    if prefijo[:2] != MAGIC_V2:
+        return PACKET_SIZE - PREFIJO_SIZE
+    _, version, _, cantidad = CABECERA_V2.unpack(prefijo)
+    if version != VERSION_V2 or not 0 < cantidad <= MAX_REGISTROS_V2:
+        raise ValueError(f"Cabecera v2 inválida (versión {version}, {cantidad} registros)")
+    return cantidad * REGISTRO_V2.size + FIRMA_SIZE
+
+#Lee exactamente n bytes del socket, reensamblando lecturas parciales.
+#Devuelve menos de n bytes solo si el cliente cerró la conexión a mitad de camino.
+def recibir_exacto(sock, n):
+    buffer = bytearray()
+    while len(buffer) < n:
+        fragmento = sock.recv(n - len(buffer))
+        if not fragmento:
+            break
+        buffer += fragmento
+    return bytes(buffer)
+
+#Procesa un paquete binario completo de PACKET_SIZE bytes: verifica la firma,
+#actualiza Modbus y reenvía la lectura al servidor final.
+#Es compartido por el servidor con hilos y por el servidor asyncio.
+def procesar_paquete(data):
+    #Cada etapa se mide con perf_counter y se registra en los histogramas de metrics.
+    inicio = time.perf_counter()
+
+    #DESEMPAQUETAR DATOS BINARIOS: Se leen los campos directamente del buffer recibido.
+    #El memoryview permite firmar y comparar las porciones del paquete sin copiarlas.
+    vista = memoryview(data)
+    sensor_id, timestamp_ms, temperature, pressure, humidity = CAMPOS.unpack_from(vista)
+    mensaje = vista[:MESSAGE_SIZE]
+    received_signature = vista[MESSAGE_SIZE:PACKET_SIZE]
+
+    t_unpack = time.perf_counter()
+    metrics.UNPACK_SECONDS.observe(t_unpack - inicio)
+    log.debug("Paquete binario desempaquetado para sensor ID: %d", sensor_id)
+
+    #VALIDAR LA FIRMA HMAC:
+    #El mensaje firmado son los bytes de todos los campos menos la firma, tal como llegaron,
+    #y se verifica con la clave de este sensor.
+    firma_valida = CLAVES.verificar(sensor_id, mensaje, received_signature)
+    t_hmac = time.perf_counter()
+    metrics.HMAC_SECONDS.observe(t_hmac - t_unpack)
+    if not firma_valida:
+        metrics.PACKETS_REJECTED_SIGNATURE.inc()
+        log.warning("ALERTA DE SEGURIDAD: Firma HMAC inválida para el sensor %d. Paquete descartado.", sensor_id)
+        return
+
+    #RECHAZAR REPETICIONES: Solo después de validar la firma, para que un paquete falso
+    #no pueda adelantar la ventana del sensor.
+    if not VENTANA_REPLAY.aceptar(sensor_id, timestamp_ms):
+        metrics.PACKETS_REJECTED_REPLAY.inc()
+        log.warning("ALERTA DE SEGURIDAD: Paquete repetido o antiguo del sensor %d (timestamp %d). Paquete descartado.",
+                    sensor_id, timestamp_ms)
+        return
+
+    #Se llama a la función del archivo modbus_server
+    t_modbus = time.perf_counter()
+    modbus_server.update_modbus_registers(sensor_id, temperature, pressure, humidity)
+    metrics.MODBUS_SECONDS.observe(time.perf_counter() - t_modbus)
+
+    reenviar_lectura(sensor_id, timestamp_ms, temperature, pressure, humidity)
+
+#Convierte una lectura válida a JSON y la encola para el servidor final.
+#La usan los paquetes v1 y cada registro de un frame v2.
+def reenviar_lectura(sensor_id, timestamp_ms, temperature, pressure, humidity):
+    #TRANSFORMAR A JSON:
+    #Primero, convertimos el timestamp de Unix (en milisegundos) a formato ISO 8601 en UTC.
+    timestamp_dt_utc = datetime.fromtimestamp(timestamp_ms / 1000.0, tz=timezone.utc)
+    timestamp_iso = timestamp_dt_utc.isoformat().replace('+00:00', 'Z')
+
+    #Construimos el payload (cuerpo) del archivo JSON para enviar al servidor final.
+    json_payload = {
+        "sensor_id": sensor_id,
+        "timestamp": timestamp_iso,
+        "temperature": round(temperature, 2),
+        "pressure": round(pressure, 2),
+        "humidity": round(humidity, 2)
+    }
+
+    #Solo se serializa para el log si el nivel DEBUG está activo.
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("Datos transformados a JSON: %s", json.dumps(json_payload))
+
+    #REENVIAR: La lectura se encola y el Forwarder la envía en lotes al servidor final,
+    #sin bloquear el manejo del socket mientras se espera la respuesta HTTP.
+    t_enviar = time.perf_counter()
+    encolada = FORWARDER.enviar(json_payload)
+    metrics.ENQUEUE_SECONDS.observe(time.perf_counter() - t_enviar)
+    metrics.PACKETS_ACCEPTED.inc()
+    if not encolada:
+        #Con la cola llena esto pasa en cada paquete: queda en las métricas y en el resumen [FORWARD].
+        log.debug("Cola de reenvío llena. Lectura del sensor %d descartada.", sensor_id)
+
+#Procesa un frame v2: verifica una sola firma para todo el lote y reenvía cada lectura.
+#Los registros se recorren con iter_unpack sobre un memoryview, sin copiar el buffer.
+def procesar_frame_v2(data):
+    inicio = time.perf_counter()
+    vista = memoryview(data)
+    _, _, sensor_id, cantidad = CABECERA_V2.unpack_from(vista)
+    fin_registros = CABECERA_V2.size + cantidad * REGISTRO_V2.size
+    firma = vista[fin_registros:]
+
+    t_unpack = time.perf_counter()
+    metrics.UNPACK_SECONDS.observe(t_unpack - inicio)
+    metrics.FRAMES_V2.inc()
+
+    #La firma cubre la cabecera y todos los registros.
+    firma_valida = CLAVES.verificar(sensor_id, vista[:fin_registros], firma)
+    metrics.HMAC_SECONDS.observe(time.perf_counter() - t_unpack)
+    if not firma_valida:
+        metrics.PACKETS_REJECTED_SIGNATURE.inc(cantidad)
+        log.warning("ALERTA DE SEGURIDAD: Firma HMAC inválida en un frame v2 del sensor %d (%d lecturas). Frame descartado.",
+                    sensor_id, cantidad)
+        return
+
+    #Solo se aceptan registros en orden creciente de timestamp_ms; la ventana anti-repetición
+    #descarta además los que no son posteriores al último aceptado del sensor.
+    registros = []
+    ultimo = -1
+    for registro in REGISTRO_V2.iter_unpack(vista[CABECERA_V2.size:fin_registros]):
+        if registro[0] > ultimo:
+            registros.append(registro)
+            ultimo = registro[0]
+    repetidos = cantidad - len(registros)
+    if registros:
+        descartar = VENTANA_REPLAY.aceptar_lote(sensor_id, [registro[0] for registro in registros])
+        registros = registros[descartar:]
+        repetidos += descartar
+    if repetidos:
+        metrics.PACKETS_REJECTED_REPLAY.inc(repetidos)
+        log.warning("ALERTA DE SEGURIDAD: %d lecturas repetidas o desordenadas en un frame del sensor %d. Descartadas.",
+                    repetidos, sensor_id)
+    if not registros:
+        return
+
+    #Los registros Modbus muestran la última lectura, así que basta con publicar la más reciente.
+    t_modbus = time.perf_counter()
+    modbus_server.update_modbus_registers(sensor_id, *registros[-1][1:])
+    metrics.MODBUS_SECONDS.observe(time.perf_counter() - t_modbus)
+
+    for timestamp_ms, temperature, pressure, humidity in registros:
+        reenviar_lectura(sensor_id, timestamp_ms, temperature, pressure, humidity)
+
+#Procesa un paquete v1 o un frame v2 completo, según sus primeros bytes.
+def procesar_frame(data):
+    if data[:2] == MAGIC_V2:
+        procesar_frame_v2(data)
+    else:
+        procesar_paquete(data)
+
 #Manejador de peticiones para nuestro servidor.
 #Se creará una instancia de esta clase por cada conexión entrante.
 class SensorTCPHandler(socketserver.BaseRequestHandler):
 
     #Este método se ejecuta para cada conexión de un cliente sensor.
+    #La conexión se mantiene abierta y se procesan paquetes hasta que el sensor la cierre.
     def handle(self):
-        print(f"\n[+] Conexión recibida de {self.client_address[0]}:{self.client_address[1]}")
-        
+        log.info("Conexión recibida de %s:%s", self.client_address[0], self.client_address[1])
+        conexion = CAPTURA.abrir_conexion(self.client_address) if CAPTURA else None
+
         try:
-            #RECIBIR DATOS BINARIOS: Leemos el número de bytes esperado para un paquete completo.
-            data = self.request.recv(PACKET_SIZE)
-            
-            #Si no se recibe el tamaño esperado, el paquete es inválido o la conexión se cerró.
-            if len(data) < PACKET_SIZE:
-                print(f"[!] Paquete incompleto, se esperaban {PACKET_SIZE} bytes, se recibieron {len(data)}. (Descartando...)")
-                return
-
-            #DESEMPAQUETAR DATOS BINARIOS: Usamos struct.unpack para convertir los bytes en tipos de datos de Python.
-            datos_desempaquetados = struct.unpack(PACKET_FORMAT, data)
-            
-            sensor_id = datos_desempaquetados[0]             # 'h'
-            timestamp_ms = datos_desempaquetados[1]          # 'Q'
-            temperature = datos_desempaquetados[2]           # 'f'
-            pressure = datos_desempaquetados[3]              # 'f'
-            humidity = datos_desempaquetados[4]              # 'f'
-            received_signature = datos_desempaquetados[5]    # '32s'
-
-            print(f"[*] Paquete binario desempaquetado para sensor ID: {sensor_id}")
-
-            #VALIDAR LA FIRMA HMAC:
-            #Para validar, debemos recrear el mensaje original que fue firmado.
-            #El mensaje incluye todos los campos menos la firma.
-            data_to_verify = struct.pack('<hQfff', sensor_id, timestamp_ms, temperature, pressure, humidity)
-
-            #Calculamos la firma HMAC-SHA256 con la clave secreta compartida.
-            calculated_signature = hmac.new(HMAC_KEY, data_to_verify, hashlib.sha256).digest()
-
-            #Comparamos las firmas de forma segura, para evitar ataques de temporización.
-            if not hmac.compare_digest(calculated_signature, received_signature):
-                print(f"[!!] ALERTA DE SEGURIDAD: Firma HMAC inválida para el sensor {sensor_id}. Paquete descartado.")
-                return
-            
-            print(f"[OK] Firma HMAC verificada exitosamente.")
-            
-            #Se llama a la función del archivo modbus_server
-            print("[*] Actualizando registros Modbus...")
-            modbus_server.update_modbus_registers(sensor_id, temperature, pressure, humidity)
-
-            #TRANSFORMAR A JSON:
-            #Primero, convertimos el timestamp de Unix (en milisegundos) a formato ISO 8601 en UTC.
-            timestamp_dt_utc = datetime.fromtimestamp(timestamp_ms / 1000.0, tz=timezone.utc)
-            timestamp_iso = timestamp_dt_utc.isoformat().replace('+00:00', 'Z')
-
-            #Construimos el payload (cuerpo) del archivo JSON para enviar al servidor final.
-            json_payload = {
-                "sensor_id": sensor_id,
-                "timestamp": timestamp_iso,
-                "temperature": round(temperature, 2),
-                "pressure": round(pressure, 2),
-                "humidity": round(humidity, 2)
-            }
-            
-            print(f"[*] Datos transformados a JSON: {json.dumps(json_payload)}")
-
-            #IMPLEMENTAR CLIENTE HTTP PARA REENVIAR: Enviamos el payload JSON al servidor final mediante una petición POST.
-            try:
-                print(f"[*] Reenviando datos al servidor final en {FINAL_SERVER_URL}...")
-                respuesta = requests.post(FINAL_SERVER_URL, json=json_payload, timeout=5)
-                
-                #Se verifica la respuesta del servidor final.
-                if 200 <= respuesta.status_code < 300: #Códigos de exito en HTTP (200-299)
-                    print(f"[OK] Servidor final respondió con éxito (Código: {respuesta.status_code})")
-                else:
-                    print(f"[!] Error del servidor final (Código: {respuesta.status_code}): {respuesta.text}")
-
-            except requests.exceptions.RequestException as e:
-                #Esta excepción capturará errores de red, por ejemplo, si el servidor final no está disponible.
-                print(f"[!!] ERROR: No se pudo conectar con el servidor final. (Error: {e})")
+            while True:
+                #RECIBIR DATOS BINARIOS: Primero el prefijo, que indica si es un paquete v1 o un frame v2
+                #y cuántos bytes faltan; luego el resto del paquete o frame.
+                data = recibir_exacto(self.request, PREFIJO_SIZE)
+
+                #Conexión cerrada limpiamente entre paquetes.
+                if not data:
+                    break
+
+                esperado = PACKET_SIZE
+                if len(data) == PREFIJO_SIZE:
+                    try:
+                        restante = longitud_restante(data)
+                    except ValueError as e:
+                        if conexion:
+                            CAPTURA.frame(conexion, data)
+                        metrics.FRAMES_INVALID.inc()
+                        log.warning("%s. Se cierra la conexión.", e)
+                        break
+                    esperado = PREFIJO_SIZE + restante
+                    data += recibir_exacto(self.request, restante)
+
+                #Con --captura se guardan los bytes tal como llegaron, incluso si están incompletos.
+                if conexion:
+                    CAPTURA.frame(conexion, data)
+
+                #Si no se recibe el tamaño esperado, la conexión se cerró a mitad de un paquete.
+                if len(data) < esperado:
+                    metrics.PACKETS_INCOMPLETE.inc()
+                    log.warning("Paquete incompleto, se esperaban %d bytes, se recibieron %d. (Descartando...)",
+                                esperado, len(data))
+                    break
+
+                procesar_frame(data)
 
         except Exception as e:
-            print(f"[!] Ocurrió un error inesperado durante la conexión: {e}")
+            log.exception("Ocurrió un error inesperado durante la conexión: %s", e)
         finally:
-            print(f"[-] Conexión con {self.client_address[0]}:{self.client_address[1]} cerrada.")
+            if conexion:
+                CAPTURA.cerrar_conexion(conexion)
+            log.info("Conexión con %s:%s cerrada.", self.client_address[0], self.client_address[1])
+
+
+#Servidor con hilos que comparte el puerto con otros procesos worker (SO_REUSEPORT).
+class ReusePortTCPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_port = True
+
+
+#Crea el Forwarder (y su spool en disco) del proceso actual.
+def iniciar_reenvio(args, spool_dir=spool.SPOOL_DIR):
+    global FORWARDER
+
+    #Spool en disco para no perder lecturas si el servidor final está caído o lento.
+    spool_disco = None
+    if not args.sin_spool:
+        spool_disco = spool.Spool(directory=spool_dir, max_bytes=args.spool_max_mb * 1024 * 1024)
+        log.info("[SPOOL] %d lecturas pendientes en %s", spool_disco.stats()['pendientes'], spool_disco.directory)
+
+    #Se inicia la etapa de reenvío por lotes hacia el servidor final.
+    FORWARDER = forwarder.Forwarder(FINAL_SERVER_BATCH_URL, spool=spool_disco)
+    FORWARDER.start()
+
+
+#Carga las claves HMAC por sensor; se recargan en caliente cuando cambia el archivo.
+def iniciar_claves(args):
+    global CLAVES
+    CLAVES = key_registry.KeyRegistry(args.claves, default_key=HMAC_KEY)
+    CLAVES.iniciar_recarga()
+
+
+#Con --captura, guarda los bytes que reciba este proceso en `directorio` (ver capture.py).
+def iniciar_captura(args, directorio):
+    global CAPTURA
+    if args.captura:
+        CAPTURA = capture.Captura(directorio, max_bytes=args.captura_max_mb * 1024 * 1024)
+        log.info("[CAPTURA] Guardando los frames recibidos en %s", CAPTURA.directory)
+
+
+#Cierra el archivo de captura actual (si hay captura).
+def detener_captura():
+    if CAPTURA:
+        CAPTURA.close()
+
+
+#Atiende conexiones de sensores en el modo elegido hasta que se detenga el proceso.
+def servir(modo, reuse_port=False):
+    if modo == "async":
+        #Servidor asyncio: soporta decenas de miles de sensores con conexiones persistentes sin un hilo por sensor.
+        async_server.run_async_server(LISTEN_HOST, LISTEN_PORT, PREFIJO_SIZE, longitud_restante, procesar_frame,
+                                      reuse_port=reuse_port, captura=CAPTURA)
+    else:
+        #Se inicia el servidor TCP usando ThreadingTCPServer, para que cada cliente sea manejado en su propio hilo.
+        #Esto permite al servidor manejar múltiples sensores concurrentemente.
+        clase_servidor = ReusePortTCPServer if reuse_port else socketserver.ThreadingTCPServer
+        with clase_servidor((LISTEN_HOST, LISTEN_PORT), SensorTCPHandler) as server:
+            #Inicia el servidor y lo mantiene corriendo hasta que se detenga manualmente (con Ctrl+C).
+            server.serve_forever()
+
+
+#Punto de entrada de cada proceso worker (modo --workers N).
+#Cada worker tiene sus propias claves, Forwarder, spool (spool/worker-N) y captura; los registros Modbus
+#y la ventana anti-repetición los hereda en memoria compartida del proceso principal.
+def ejecutar_worker(numero, args):
+    #Cada worker escribe sus métricas en su propia fila de la memoria compartida.
+    metrics.usar_fila(numero + 1)
+    try:
+        iniciar_claves(args)
+        iniciar_reenvio(args, os.path.join(spool.SPOOL_DIR, f"worker-{numero}"))
+        if args.captura:
+            iniciar_captura(args, os.path.join(args.captura, f"worker-{numero}"))
+        servir(args.modo, reuse_port=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        detener_captura()
 
 
 if __name__ == "__main__":
-    #Se inicializa el datastore del servidor Modbus.
+    #Se elige el modo de ingesta al iniciar: con hilos (uno por conexión) o asyncio (una corrutina por conexión).
+    parser = argparse.ArgumentParser(description="Servidor Intermedio de sensores")
+    parser.add_argument("--modo", choices=["hilos", "async"], default="hilos",
+                        help="Modo del servidor de ingesta TCP (por defecto: hilos)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Procesos de ingesta que comparten el puerto con SO_REUSEPORT "
+                             f"(por defecto: 1, máximo: {metrics.MAX_PROCESOS - 1})")
+    parser.add_argument("--sin-spool", action="store_true",
+                        help="No guardar en disco las lecturas que no se puedan reenviar")
+    parser.add_argument("--claves", default=key_registry.KEYS_FILE,
+                        help="Archivo JSON con las claves HMAC por sensor (se recarga al modificarse)")
+    parser.add_argument("--metrics-port", type=int, default=metrics.METRICS_PORT,
+                        help="Puerto del endpoint Prometheus /metrics (0 para desactivarlo)")
+    parser.add_argument("--log-level", default=os.environ.get("LOG_LEVEL", "INFO").upper(), type=str.upper,
+                        choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+                        help="Nivel de log; DEBUG muestra cada paquete (lento con mucha carga)")
+    parser.add_argument("--captura", nargs="?", const=capture.CAPTURE_DIR, metavar="DIR",
+                        help="Guardar los frames recibidos, con su hora de llegada, para reproducirlos con "
+                             "benchmark/replay.py (por defecto en intermediate_server/capturas)")
+    parser.add_argument("--captura-max-mb", type=int, default=capture.CAPTURE_MAX_BYTES // (1024 * 1024),
+                        help="Uso máximo de disco de la captura en MB (se borran los archivos más antiguos)")
+    parser.add_argument("--spool-max-mb", type=int, default=spool.SPOOL_MAX_BYTES // (1024 * 1024),
+                        help="Uso máximo de disco del spool en MB")
+    args = parser.parse_args()
+    #Cada worker escribe sus métricas en su fila de los arreglos compartidos (1..MAX_PROCESOS-1).
+    if not 1 <= args.workers <= metrics.MAX_PROCESOS - 1:
+        parser.error(f"--workers debe estar entre 1 y {metrics.MAX_PROCESOS - 1}")
+
+    logging.basicConfig(level=args.log_level,
+                        format="%(asctime)s %(levelname)s [%(processName)s] %(message)s")
+
+    multiproceso = args.workers > 1
+
+    #Se inicializa el datastore del servidor Modbus (en memoria compartida, la heredan los workers).
     modbus_server.initialize_datastore()
+
+    if multiproceso:
+        #La ventana anti-repetición se comparte: un sensor que se reconecta puede caer en otro worker.
+        VENTANA_REPLAY = key_registry.SharedReplayWindow()
+        #Los workers se crean antes de iniciar hilos en este proceso (fork solo copia el hilo actual).
+        pool = workers.WorkerPool(args.workers, lambda numero: ejecutar_worker(numero, args))
+        pool.iniciar()
+    else:
+        VENTANA_REPLAY = key_registry.ReplayWindow()
+        iniciar_claves(args)
     
     #Se crea y se inicia el hilo del servidor Modbus.
     modbus_thread = threading.Thread(target=modbus_server.run_modbus_server_thread)
@@ -128,17 +410,31 @@ if __name__ == "__main__":
     modbus_thread.start()
     time.sleep(1)
 
-    
-    #Se inicia el servidor TCP usando ThreadingTCPServer, para que cada cliente sea manejado en su propio hilo.
-    #Esto permite al servidor manejar múltiples sensores concurrentemente.
-    with socketserver.ThreadingTCPServer((LISTEN_HOST, LISTEN_PORT), SensorTCPHandler) as server:
-        print("===================================================")
-        print("     Servidor Intermedio Iniciado")
-        print(f"    Escuchando conexiones en {LISTEN_HOST}:{LISTEN_PORT}")
-        print(f"    Escuchando Modbus TCP en el puerto {modbus_server.MODBUS_PORT}")
-        print("===================================================")
-        print("Esperando datos binarios de los sensores...")
-        
-        #Inicia el servidor y lo mantiene corriendo hasta que se detenga manualmente (con Ctrl+C).
-        server.serve_forever()
-      
+    if not multiproceso:
+        iniciar_reenvio(args)
+        iniciar_captura(args, args.captura)
+
+    #Endpoint de métricas en el proceso principal (suma las de todos los workers).
+    if args.metrics_port:
+        metrics.iniciar_servidor(port=args.metrics_port)
+
+    print("===================================================")
+    print("     Servidor Intermedio Iniciado")
+    print(f"    Modo de ingesta: {args.modo}" + (f" ({args.workers} workers)" if multiproceso else ""))
+    print(f"    Escuchando conexiones en {LISTEN_HOST}:{LISTEN_PORT}")
+    print(f"    Escuchando Modbus TCP en el puerto {modbus_server.MODBUS_PORT}")
+    if args.metrics_port:
+        print(f"    Métricas en http://{LISTEN_HOST}:{args.metrics_port}/metrics")
+    if args.captura:
+        print(f"    Capturando frames en {args.captura}")
+    print("===================================================")
+    print("Esperando datos binarios de los sensores...")
+
+    if multiproceso:
+        #El proceso principal solo atiende Modbus y reinicia los workers que fallen.
+        pool.supervisar()
+    else:
+        try:
+            servir(args.modo)
+        finally:
+            detener_captura()
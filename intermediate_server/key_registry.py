@@ -0,0 +1,167 @@
+import bisect
+import hashlib
+import hmac
+import json
+import logging
+import multiprocessing
+import os
+import threading
+
+log = logging.getLogger(__name__)
+
+#Archivo con las claves HMAC de cada sensor. Si no existe, todos los sensores usan la clave por defecto.
+#Formato (JSON):
+#  {
+#    "default": "clave_secreta_1111",
+#    "sensors": {"1": "clave_sensor_1", "2": ["clave_nueva_2", "clave_vieja_2"]}
+#  }
+# "default" es opcional: sin ella, los sensores que no están en "sensors" se rechazan.
+# Un sensor puede tener una lista de claves para aceptar la nueva y la anterior mientras se rota.
+KEYS_FILE = os.environ.get("SENSOR_KEYS_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "sensor_keys.json"))
+
+#Cada cuántos segundos se revisa si el archivo de claves cambió (rotación sin reiniciar).
+KEYS_RELOAD_INTERVAL_S = 5
+
+
+#Crea el estado HMAC-SHA256 ya inicializado con la clave.
+#Por paquete solo se copia (copy()), sin recalcular el relleno de la clave.
+def _contexto(clave):
+    return hmac.new(clave.encode() if isinstance(clave, str) else clave, digestmod=hashlib.sha256)
+
+
+#Registro de claves HMAC por sensor_id.
+#Las tablas se reemplazan completas al recargar, así los hilos que verifican nunca
+#ven un registro a medio actualizar y no necesitan tomar un lock.
+class KeyRegistry:
+
+    def __init__(self, path=KEYS_FILE, default_key=None):
+        self.path = path
+        #Clave usada si no existe el archivo (compatibilidad con la clave única anterior).
+        self.default_key = default_key
+        self._contextos = {}
+        self._por_defecto = []
+        self._mtime = None
+        self.recargar()
+
+    #Vuelve a leer el archivo de claves. Si el archivo tiene errores se mantienen las claves actuales.
+    def recargar(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+
+        if mtime is None:
+            contextos = {}
+            por_defecto = [_contexto(self.default_key)] if self.default_key else []
+        else:
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    config = json.load(f)
+                contextos = {int(sensor_id): [_contexto(clave) for clave in self._lista(claves)]
+                             for sensor_id, claves in config.get("sensors", {}).items()}
+                por_defecto = [_contexto(clave) for clave in self._lista(config.get("default"))]
+            except (OSError, ValueError, TypeError, AttributeError) as e:
+                log.error("Error leyendo el archivo de claves %s: %s. Se mantienen las claves actuales.", self.path, e)
+                return False
+
+        self._contextos, self._por_defecto = contextos, por_defecto
+        self._mtime = mtime
+        log.info("[CLAVES] %d sensores con clave propia, %s", len(contextos),
+                 "clave por defecto activa" if por_defecto else "sensores desconocidos rechazados")
+        return True
+
+    @staticmethod
+    def _lista(claves):
+        if claves is None:
+            return []
+        return [claves] if isinstance(claves, str) else list(claves)
+
+    #Verifica la firma de `mensaje` (bytes o memoryview) con la clave del sensor.
+    def verificar(self, sensor_id, mensaje, firma):
+        for contexto in self._contextos.get(sensor_id, self._por_defecto):
+            h = contexto.copy()
+            h.update(mensaje)
+            #Comparación en tiempo constante, para evitar ataques de temporización.
+            if hmac.compare_digest(h.digest(), firma):
+                return True
+        return False
+
+    #Hilo que recarga las claves cuando cambia el archivo.
+    def iniciar_recarga(self, intervalo=KEYS_RELOAD_INTERVAL_S):
+        def vigilar():
+            evento = threading.Event()
+            while not evento.wait(intervalo):
+                try:
+                    mtime = os.stat(self.path).st_mtime_ns
+                except FileNotFoundError:
+                    mtime = None
+                if mtime != self._mtime:
+                    self.recargar()
+
+        hilo = threading.Thread(target=vigilar, daemon=True)
+        hilo.start()
+        return hilo
+
+
+#Rechaza paquetes repetidos: el timestamp_ms de cada sensor debe ser estrictamente
+#mayor que el último aceptado. Es una consulta y una asignación en un diccionario (O(1)).
+class ReplayWindow:
+
+    def __init__(self):
+        self._ultimo = {}
+        #Los manejadores con hilos pueden recibir el mismo sensor por dos conexiones a la vez.
+        self._lock = threading.Lock()
+        self.rechazados = 0
+
+    #Devuelve True y registra el timestamp si el paquete es nuevo.
+    def aceptar(self, sensor_id, timestamp_ms):
+        with self._lock:
+            if timestamp_ms <= self._ultimo.get(sensor_id, -1):
+                self.rechazados += 1
+                return False
+            self._ultimo[sensor_id] = timestamp_ms
+            return True
+
+    #Versión por lotes para los frames v2: `timestamps` debe ser estrictamente creciente.
+    #Devuelve cuántos de los primeros timestamps son repetidos (se descartan); el resto se acepta.
+    def aceptar_lote(self, sensor_id, timestamps):
+        with self._lock:
+            repetidos = bisect.bisect_right(timestamps, self._ultimo.get(sensor_id, -1))
+            if repetidos < len(timestamps):
+                self._ultimo[sensor_id] = timestamps[-1]
+            self.rechazados += repetidos
+            return repetidos
+
+
+#Ventana anti-repetición compartida entre procesos worker (modo --workers).
+#Un sensor que se reconecta puede caer en otro worker, así que el último timestamp
+#aceptado de cada sensor vive en memoria compartida: un entero por cada sensor_id posible.
+#Los locks se reparten por sensor para que los workers casi nunca se esperen entre sí.
+class SharedReplayWindow(ReplayWindow):
+
+    NUM_LOCKS = 16
+
+    def __init__(self):
+        #Debe crearse antes de iniciar los workers, que la heredan.
+        self._ultimo = multiprocessing.RawArray('Q', 1 << 16)
+        self._locks = [multiprocessing.Lock() for _ in range(self.NUM_LOCKS)]
+        #Contador por proceso
+        self.rechazados = 0
+
+    def aceptar(self, sensor_id, timestamp_ms):
+        indice = sensor_id & 0xFFFF
+        with self._locks[indice % self.NUM_LOCKS]:
+            if timestamp_ms <= self._ultimo[indice]:
+                self.rechazados += 1
+                return False
+            self._ultimo[indice] = timestamp_ms
+            return True
+
+    def aceptar_lote(self, sensor_id, timestamps):
+        indice = sensor_id & 0xFFFF
+        with self._locks[indice % self.NUM_LOCKS]:
+            repetidos = bisect.bisect_right(timestamps, self._ultimo[indice])
+            if repetidos < len(timestamps):
+                self._ultimo[indice] = timestamps[-1]
+            self.rechazados += repetidos
+            return repetidos
@@ -0,0 +1,160 @@
+import bisect
+import multiprocessing
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+#Métricas del servidor intermedio en formato de texto de Prometheus.
+#Los valores viven en memoria compartida (RawArray) con una fila por proceso: cada worker
+#escribe solo en su fila y el endpoint /metrics del proceso principal suma todas.
+#Como se reservan al importar el módulo, los workers creados con fork las heredan.
+
+#Puerto HTTP del endpoint /metrics (0 para desactivarlo).
+METRICS_PORT = 9100
+
+#Procesos que pueden reportar métricas: el principal (fila 0) y hasta 64 workers.
+MAX_PROCESOS = 65
+
+#Límites de los buckets de los histogramas de latencia (segundos).
+#Van de 1 µs (desempaquetar un paquete) a varios segundos (un POST lento al servidor final).
+BUCKETS_S = (0.000001, 0.0000025, 0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025,
+             0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+#Fila del proceso actual. Los workers la cambian con usar_fila() al iniciar.
+_fila = 0
+_metricas = []
+
+
+#Selecciona la fila de este proceso (1..MAX_PROCESOS-1 para los workers).
+def usar_fila(numero):
+    global _fila
+    _fila = numero
+
+
+def _etiquetas(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels.items()) + "}"
+
+
+#Contador monotónico.
+class Counter:
+    tipo = "counter"
+
+    def __init__(self, name, help, labels=None):
+        self.name = name
+        self.help = help
+        self.labels = labels or {}
+        self._valores = multiprocessing.RawArray('d', MAX_PROCESOS)
+        #Los manejadores con hilos comparten la fila del proceso.
+        self._lock = threading.Lock()
+        _metricas.append(self)
+
+    def inc(self, cantidad=1):
+        with self._lock:
+            self._valores[_fila] += cantidad
+
+    def value(self):
+        return sum(self._valores)
+
+    def lineas(self):
+        return [f"{self.name}{_etiquetas(self.labels)} {self.value():g}"]
+
+
+#Histograma de duraciones con buckets fijos (BUCKETS_S).
+class Histogram:
+    tipo = "histogram"
+
+    def __init__(self, name, help, labels=None, buckets=BUCKETS_S):
+        self.name = name
+        self.help = help
+        self.labels = labels or {}
+        self.buckets = buckets
+        #Por fila: un contador por bucket, el bucket +Inf, la suma y la cantidad.
+        self._ancho = len(buckets) + 3
+        self._valores = multiprocessing.RawArray('d', MAX_PROCESOS * self._ancho)
+        self._lock = threading.Lock()
+        _metricas.append(self)
+
+    def observe(self, segundos):
+        base = _fila * self._ancho
+        with self._lock:
+            self._valores[base + bisect.bisect_left(self.buckets, segundos)] += 1
+            self._valores[base + self._ancho - 2] += segundos
+            self._valores[base + self._ancho - 1] += 1
+
+    def lineas(self):
+        totales = [0.0] * self._ancho
+        for fila in range(MAX_PROCESOS):
+            base = fila * self._ancho
+            for i in range(self._ancho):
+                totales[i] += self._valores[base + i]
+
+        lineas = []
+        acumulado = 0.0
+        for limite, cantidad in zip(self.buckets + ("+Inf",), totales):
+            acumulado += cantidad
+            labels = dict(self.labels, le=limite if isinstance(limite, str) else f"{limite:g}")
+            lineas.append(f"{self.name}_bucket{_etiquetas(labels)} {acumulado:g}")
+        lineas.append(f"{self.name}_sum{_etiquetas(self.labels)} {totales[-2]:.9g}")
+        lineas.append(f"{self.name}_count{_etiquetas(self.labels)} {totales[-1]:g}")
+        return lineas
+
+
+#Texto de todas las métricas en el formato de exposición de Prometheus.
+def render():
+    lineas = []
+    vistas = set()
+    for metrica in _metricas:
+        if metrica.name not in vistas:
+            vistas.add(metrica.name)
+            lineas.append(f"# HELP {metrica.name} {metrica.help}")
+            lineas.append(f"# TYPE {metrica.name} {metrica.tipo}")
+        lineas.extend(metrica.lineas())
+    return "\n".join(lineas) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        cuerpo = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, format, *args):
+        pass
+
+
+#Inicia el endpoint HTTP /metrics en un hilo aparte.
+def iniciar_servidor(host="0.0.0.0", port=METRICS_PORT):
+    servidor = ThreadingHTTPServer((host, port), _MetricsHandler)
+    hilo = threading.Thread(target=servidor.serve_forever, daemon=True)
+    hilo.start()
+    return servidor
+
+
+#Métricas del servidor intermedio
+UNPACK_SECONDS = Histogram("intermediate_unpack_seconds", "Tiempo de desempaquetar un paquete binario")
+HMAC_SECONDS = Histogram("intermediate_hmac_verify_seconds", "Tiempo de verificar la firma HMAC de un paquete")
+MODBUS_SECONDS = Histogram("intermediate_modbus_update_seconds", "Tiempo de publicar una lectura en los registros Modbus")
+ENQUEUE_SECONDS = Histogram("intermediate_forward_enqueue_seconds", "Tiempo de encolar una lectura para el reenvío")
+FORWARD_SECONDS = Histogram("intermediate_forward_batch_seconds", "Duración de cada POST de un lote al servidor final")
+
+PACKETS_ACCEPTED = Counter("intermediate_packets_accepted_total",
+                           "Lecturas válidas procesadas (paquetes v1 o registros de frames v2)")
+FRAMES_V2 = Counter("intermediate_frames_v2_total", "Frames v2 (lotes de lecturas) recibidos")
+FRAMES_INVALID = Counter("intermediate_frames_invalid_total", "Cabeceras v2 inválidas (se cierra la conexión)")
+PACKETS_REJECTED_SIGNATURE = Counter("intermediate_packets_rejected_total", "Paquetes descartados",
+                                     labels={"reason": "signature"})
+PACKETS_REJECTED_REPLAY = Counter("intermediate_packets_rejected_total", "Paquetes descartados",
+                                  labels={"reason": "replay"})
+PACKETS_INCOMPLETE = Counter("intermediate_packets_incomplete_total", "Conexiones cerradas a mitad de un paquete")
+READINGS_FORWARDED = Counter("intermediate_readings_forwarded_total", "Lecturas aceptadas por el servidor final")
+READINGS_SPOOLED = Counter("intermediate_readings_spooled_total", "Lecturas guardadas en el spool en disco")
+READINGS_FAILED = Counter("intermediate_readings_failed_total",
+                          "Lecturas perdidas (cola llena, reintentos agotados o rechazadas por el servidor final)")
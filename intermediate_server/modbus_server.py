@@ -1,48 +1,130 @@
-import threading
+import logging
+import multiprocessing
+import os
+import struct
+import time
 from pymodbus.server import StartTcpServer
 from pymodbus.datastore import ModbusSequentialDataBlock, ModbusSlaveContext, ModbusServerContext
 
+log = logging.getLogger(__name__)
+
 #Direccion y puerto donde el servidor Modbus escuchará
 MODBUS_HOST = "0.0.0.0"
 MODBUS_PORT = 502           #Puerto estándar para Modbus TCP
 
 #Contexto de Modbus que contiene los registros
 MODBUS_CONTEXT = None
-#Lock para garantizar acceso seguro entre hilos
-MODBUS_LOCK = threading.Lock()
+
+#Mapa de registros: un bloque de tamaño fijo por sensor.
+#Bloque 0 (direcciones 0-7): la última lectura recibida de cualquier sensor.
+#Sensor N: direcciones 8*(N+1) a 8*(N+1)+7.
+#Dentro de cada bloque:
+# +0      sensor_id
+# +1      contador de actualizaciones (uint16, da la vuelta; 0 = sin datos)
+# +2,+3   temperatura (float32 IEEE-754, palabra alta primero)
+# +4,+5   presión     (float32)
+# +6,+7   humedad     (float32)
+#Un poller lee muchos sensores por petición (hasta 125 registros = 15 sensores).
+MODBUS_BLOCK_SIZE = 8
+#Sensores con bloque propio (sensor_id de 0 a MODBUS_MAX_SENSORS - 1). Máximo 8191 (65536 registros).
+MODBUS_MAX_SENSORS = min(int(os.environ.get("MODBUS_MAX_SENSORS", 4096)), 8191)
+
+#Valores de un bloque en el orden del mapa, convertidos a registros de 16 bits big-endian.
+BLOQUE = struct.Struct('>HHfff')
+REGISTROS_BLOQUE = struct.Struct('>8H')
+
+#Locks de escritura repartidos por bloque. Solo los escritores los toman; los lectores Modbus no.
+NUM_LOCKS_ESCRITURA = 16
+
+#Banco de registros en memoria compartida (RawArray), así funciona igual con un proceso
+#o con varios workers (se crea antes del fork y lo heredan).
+#Cada bloque tiene una versión tipo seqlock: impar mientras se escribe, par cuando está completo.
+#Los lectores copian sin bloquear y reintentan si la versión cambió durante la copia.
+class RegisterBank:
+
+    def __init__(self, max_sensores=MODBUS_MAX_SENSORS):
+        self.bloques = max_sensores + 1
+        self.registros = multiprocessing.RawArray('H', self.bloques * MODBUS_BLOCK_SIZE)
+        self.versiones = multiprocessing.RawArray('L', self.bloques)
+        self.locks = [multiprocessing.Lock() for _ in range(NUM_LOCKS_ESCRITURA)]
+        #Lecturas de sensores sin bloque propio (sensor_id fuera de rango). Contador por proceso.
+        self.fuera_de_rango = 0
+
+    def _escribir_bloque(self, bloque, sensor_id, temperature, pressure, humidity):
+        inicio = bloque * MODBUS_BLOCK_SIZE
+        with self.locks[bloque % NUM_LOCKS_ESCRITURA]:
+            contador = (self.registros[inicio + 1] % 0xFFFF) + 1
+            valores = REGISTROS_BLOQUE.unpack(BLOQUE.pack(sensor_id & 0xFFFF, contador, temperature, pressure, humidity))
+            self.versiones[bloque] += 1
+            self.registros[inicio:inicio + MODBUS_BLOCK_SIZE] = valores
+            self.versiones[bloque] += 1
+
+    #Publica la lectura en el bloque del sensor y en el bloque de la última lectura.
+    def publicar(self, sensor_id, temperature, pressure, humidity):
+        self._escribir_bloque(0, sensor_id, temperature, pressure, humidity)
+        if 0 <= sensor_id < self.bloques - 1:
+            self._escribir_bloque(sensor_id + 1, sensor_id, temperature, pressure, humidity)
+        else:
+            self.fuera_de_rango += 1
+
+    #Copia `count` registros desde `address` sin bloquear a los escritores.
+    def leer(self, address, count):
+        primero = address // MODBUS_BLOCK_SIZE
+        ultimo = (address + count - 1) // MODBUS_BLOCK_SIZE + 1
+        while True:
+            antes = self.versiones[primero:ultimo]
+            valores = self.registros[address:address + count]
+            if self.versiones[primero:ultimo] == antes and not any(v & 1 for v in antes):
+                return valores
+            #Un escritor estaba a mitad de un bloque: se le cede el turno y se vuelve a copiar.
+            time.sleep(0)
+
+    def cantidad_registros(self):
+        return self.bloques * MODBUS_BLOCK_SIZE
+
+
+#Bloque de datos de pymodbus que responde desde el RegisterBank.
+#Empieza en la dirección 1 porque ModbusSlaveContext suma 1 a la dirección pedida por el cliente.
+#Es de solo lectura: los valores los escriben únicamente los sensores.
+class RegisterBankBlock(ModbusSequentialDataBlock):
+
+    def __init__(self, banco):
+        super().__init__(1, [0])
+        self.banco = banco
+
+    def validate(self, address, count=1):
+        return address >= 1 and count >= 1 and address - 1 + count <= self.banco.cantidad_registros()
+
+    def getValues(self, address, count=1):
+        return self.banco.leer(address - 1, count)
+
+    def setValues(self, address, values):
+        pass
+
+
+#Banco de registros por sensor. Se crea en initialize_datastore().
+BANCO = None
 
 #Se crea el almacén de datos para Modbus.
+#Debe llamarse antes de crear los procesos worker para que estos hereden el banco de registros.
 def initialize_datastore():
     #Inicializa y devuelve el contexto del servidor Modbus.
-    global MODBUS_CONTEXT
-    
-    #Se usan "Input Registers". Tamaño: 10 registros.
-    #Se inicializan los registros a 0.
-    data_block = ModbusSequentialDataBlock(0, [0] * 10)
-    #Se crea un contexto esclavo.
-    slave_context = ModbusSlaveContext(ir=data_block)
+    global MODBUS_CONTEXT, BANCO
+
+    BANCO = RegisterBank()
+    bloque = RegisterBankBlock(BANCO)
+    #El mismo banco se expone como Input Registers (FC 4) y Holding Registers (FC 3).
+    slave_context = ModbusSlaveContext(ir=bloque, hr=bloque)
     #Se define el contexto global del servidor.
     MODBUS_CONTEXT = ModbusServerContext(slaves=slave_context, single=True)
-    print("[MODBUS] Almacén de datos (datastore) inicializado.")
+    log.info("[MODBUS] Almacén de datos (datastore) inicializado: %d sensores, %d registros.",
+             BANCO.bloques - 1, BANCO.cantidad_registros())
 
-#Función para actualizar de forma segura los registros del servidor Modbus.
+#Publica la lectura de un sensor en su bloque de registros (valores float32 sin escalar).
 def update_modbus_registers(sensor_id: int, temperature: float, pressure: float, humidity: float):
-    with MODBUS_LOCK:
-        #Se los convierten los floats multiplicando, porque los registros Modbus son enteros. 
-        temp_scaled = int(temperature * 100)
-        press_scaled = int(pressure * 10)
-        hum_scaled = int(humidity * 100)
-
-        #Se crea una lista de valores a escribir
-        values = [sensor_id, temp_scaled, press_scaled, hum_scaled]
-        
-        # El primer argumento 3 se refiere a Holding Registers.
-        # El segundo argumento es la dirección de inicio.
-        MODBUS_CONTEXT[0].setValues(3, 0, values) # 3 = Holding, 4 = Input
-        
-        print(f"[MODBUS] Registros actualizados: ID={values[0]}, Temp={values[1]}, Press={values[2]}, Hum={values[3]}")
+    BANCO.publicar(sensor_id, temperature, pressure, humidity)
 
 #Función que se ejecuta en un hilo para iniciar el servidor
 def run_modbus_server_thread():
-    print(f"[MODBUS] Iniciando servidor Modbus en {MODBUS_HOST}:{MODBUS_PORT}")
+    log.info("[MODBUS] Iniciando servidor Modbus en %s:%s", MODBUS_HOST, MODBUS_PORT)
     StartTcpServer(context=MODBUS_CONTEXT, address=(MODBUS_HOST, MODBUS_PORT))
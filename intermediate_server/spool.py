@@ -0,0 +1,246 @@
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import metrics
+
+log = logging.getLogger(__name__)
+
+#Directorio donde se guardan los segmentos del spool y el archivo de offsets.
+SPOOL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "spool")
+
+#Tamaño fijo de cada segmento (se preasigna y se mapea en memoria).
+SPOOL_SEGMENT_SIZE = 8 * 1024 * 1024
+#Uso máximo de disco. Al superarlo se descarta el segmento más antiguo.
+SPOOL_MAX_BYTES = 512 * 1024 * 1024
+
+#Cada registro es: longitud (uint32 little-endian) + lectura en JSON compacto.
+#Una longitud 0 marca el final de los datos escritos (el segmento se crea lleno de ceros).
+RECORD_HEADER = struct.Struct('<I')
+#Offset de lectura persistido: número de segmento + posición dentro del segmento.
+OFFSETS_FORMAT = struct.Struct('<QQ')
+OFFSETS_FILE = "offsets"
+
+#Spool en disco de solo-anexado, formado por segmentos mapeados en memoria.
+#El Forwarder escribe aquí las lecturas que no puede entregar al servidor final y las
+#vacía en lotes grandes cuando este se recupera. El offset de lectura se persiste tras
+#cada lote confirmado, de modo que un reinicio continúa donde quedó sin duplicar ni perder datos.
+class Spool:
+
+    def __init__(self, directory=SPOOL_DIR, segment_size=SPOOL_SEGMENT_SIZE, max_bytes=SPOOL_MAX_BYTES):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_segments = max(2, max_bytes // segment_size)
+        self.lock = threading.Lock()
+        #Mapas abiertos por número de segmento (el de escritura y el de lectura).
+        self._maps = {}
+        self.descartadas = 0
+
+        os.makedirs(self.directory, exist_ok=True)
+        segmentos = self._listar_segmentos()
+
+        #Se recupera el offset de lectura persistido (si existe).
+        self.read_seg, self.read_pos = self._cargar_offsets()
+        if segmentos and self.read_seg < segmentos[0]:
+            self.read_seg, self.read_pos = segmentos[0], 0
+
+        #La escritura continúa en el último segmento, después del último registro completo.
+        if segmentos:
+            self.write_seg = segmentos[-1]
+            self.write_pos = self._buscar_fin(self.write_seg)
+        else:
+            self.write_seg = max(self.read_seg, 1)
+            self.write_pos = 0
+            self._abrir(self.write_seg)
+            self.read_seg, self.read_pos = self.write_seg, 0
+
+        #Registros pendientes (se recalcula al iniciar recorriendo los segmentos).
+        self.pendientes = self._contar_pendientes()
+
+    #Anexa lecturas al spool. Nunca bloquea por el servidor final, solo por el disco.
+    def append(self, payloads):
+        with self.lock:
+            for payload in payloads:
+                datos = json.dumps(payload, separators=(',', ':')).encode()
+                tam = RECORD_HEADER.size + len(datos)
+                if tam > self.segment_size:
+                    raise ValueError("Registro más grande que un segmento del spool")
+                #Se deja espacio para el marcador de fin (longitud 0).
+                if self.write_pos + tam + RECORD_HEADER.size > self.segment_size:
+                    self._rotar()
+                m = self._abrir(self.write_seg)
+                #Primero los datos y luego la longitud: un registro a medio escribir queda invisible.
+                inicio = self.write_pos + RECORD_HEADER.size
+                m[inicio:inicio + len(datos)] = datos
+                RECORD_HEADER.pack_into(m, self.write_pos, len(datos))
+                self.write_pos += tam
+                self.pendientes += 1
+
+    #Lee hasta max_records lecturas desde el offset actual sin consumirlas.
+    #Devuelve (lecturas, cursor); el cursor se pasa a commit() cuando el lote fue entregado.
+    def read_batch(self, max_records):
+        with self.lock:
+            seg, pos = self.read_seg, self.read_pos
+            lecturas = []
+            while len(lecturas) < max_records:
+                m = self._abrir(seg)
+                longitud = 0
+                if pos + RECORD_HEADER.size <= self.segment_size:
+                    longitud = RECORD_HEADER.unpack_from(m, pos)[0]
+                if longitud == 0:
+                    #Fin del segmento: se avanza al siguiente solo si ya existe uno más nuevo.
+                    if seg < self.write_seg:
+                        seg, pos = seg + 1, 0
+                        continue
+                    break
+                inicio = pos + RECORD_HEADER.size
+                lecturas.append(json.loads(m[inicio:inicio + longitud]))
+                pos = inicio + longitud
+            return lecturas, (seg, pos, len(lecturas))
+
+    #Confirma un lote leído con read_batch: avanza y persiste el offset y borra los segmentos ya consumidos.
+    def commit(self, cursor):
+        seg, pos, cantidad = cursor
+        with self.lock:
+            #Si el segmento fue descartado por el límite de disco mientras se enviaba, no se retrocede.
+            if (seg, pos) < (self.read_seg, self.read_pos):
+                return
+            for viejo in range(self.read_seg, seg):
+                self._borrar(viejo)
+            self.read_seg, self.read_pos = seg, pos
+            self.pendientes = max(0, self.pendientes - cantidad)
+            self._guardar_offsets()
+
+    def is_empty(self):
+        with self.lock:
+            return self.pendientes == 0
+
+    #Fuerza la escritura a disco de los segmentos abiertos.
+    def flush(self):
+        with self.lock:
+            for m in self._maps.values():
+                m.flush()
+
+    def stats(self):
+        with self.lock:
+            segmentos = self.write_seg - self.read_seg + 1
+            return {
+                "pendientes": self.pendientes,
+                "segmentos": segmentos,
+                "bytes_disco": segmentos * self.segment_size,
+                "descartadas": self.descartadas,
+            }
+
+    def close(self):
+        with self.lock:
+            for m in self._maps.values():
+                m.flush()
+                m.close()
+            self._maps.clear()
+            self._guardar_offsets()
+
+    #--- Funciones internas (se llaman con self.lock tomado) ---
+
+    def _ruta(self, seg):
+        return os.path.join(self.directory, f"seg-{seg:010d}.spool")
+
+    def _listar_segmentos(self):
+        segmentos = []
+        for nombre in os.listdir(self.directory):
+            if nombre.startswith("seg-") and nombre.endswith(".spool"):
+                segmentos.append(int(nombre[4:-6]))
+        return sorted(segmentos)
+
+    #Abre (o crea y preasigna) un segmento y lo mapea en memoria.
+    def _abrir(self, seg):
+        m = self._maps.get(seg)
+        if m is None:
+            ruta = self._ruta(seg)
+            with open(ruta, "a+b") as f:
+                if os.path.getsize(ruta) < self.segment_size:
+                    f.truncate(self.segment_size)
+                m = mmap.mmap(f.fileno(), self.segment_size, access=mmap.ACCESS_WRITE)
+            self._maps[seg] = m
+        return m
+
+    def _cerrar(self, seg):
+        m = self._maps.pop(seg, None)
+        if m is not None:
+            m.flush()
+            m.close()
+
+    def _borrar(self, seg):
+        self._cerrar(seg)
+        try:
+            os.remove(self._ruta(seg))
+        except FileNotFoundError:
+            pass
+
+    #Pasa a un segmento nuevo. Si se supera el límite de disco, se descarta el más antiguo.
+    def _rotar(self):
+        if self.write_seg != self.read_seg:
+            self._cerrar(self.write_seg)
+        else:
+            self._maps[self.write_seg].flush()
+        self.write_seg += 1
+        self.write_pos = 0
+        self._abrir(self.write_seg)
+
+        while self.write_seg - self.read_seg + 1 > self.max_segments:
+            perdidas = self._contar_registros(self.read_seg, self.read_pos)
+            self.descartadas += perdidas
+            self.pendientes = max(0, self.pendientes - perdidas)
+            metrics.READINGS_FAILED.inc(perdidas)
+            log.error("[SPOOL] Límite de disco alcanzado, se descartan %d lecturas antiguas.", perdidas)
+            self._borrar(self.read_seg)
+            self.read_seg, self.read_pos = self.read_seg + 1, 0
+            self._guardar_offsets()
+
+    #Recorre los registros de un segmento desde pos y devuelve la posición final.
+    def _buscar_fin(self, seg, pos=0):
+        m = self._abrir(seg)
+        while pos + RECORD_HEADER.size <= self.segment_size:
+            longitud = RECORD_HEADER.unpack_from(m, pos)[0]
+            if longitud == 0 or pos + RECORD_HEADER.size + longitud > self.segment_size:
+                break
+            pos += RECORD_HEADER.size + longitud
+        return pos
+
+    def _contar_registros(self, seg, pos=0):
+        m = self._abrir(seg)
+        cantidad = 0
+        while pos + RECORD_HEADER.size <= self.segment_size:
+            longitud = RECORD_HEADER.unpack_from(m, pos)[0]
+            if longitud == 0:
+                break
+            pos += RECORD_HEADER.size + longitud
+            cantidad += 1
+        return cantidad
+
+    def _contar_pendientes(self):
+        total = 0
+        for seg in range(self.read_seg, self.write_seg + 1):
+            if os.path.exists(self._ruta(seg)):
+                total += self._contar_registros(seg, self.read_pos if seg == self.read_seg else 0)
+                if seg not in (self.read_seg, self.write_seg):
+                    self._cerrar(seg)
+        return total
+
+    def _cargar_offsets(self):
+        try:
+            with open(os.path.join(self.directory, OFFSETS_FILE), "rb") as f:
+                return OFFSETS_FORMAT.unpack(f.read(OFFSETS_FORMAT.size))
+        except (FileNotFoundError, struct.error):
+            return 0, 0
+
+    #Escritura atómica del offset: archivo temporal + os.replace.
+    def _guardar_offsets(self):
+        ruta = os.path.join(self.directory, OFFSETS_FILE)
+        temporal = ruta + ".tmp"
+        with open(temporal, "wb") as f:
+            f.write(OFFSETS_FORMAT.pack(self.read_seg, self.read_pos))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporal, ruta)
@@ -0,0 +1,61 @@
+import logging
+import multiprocessing
+import os
+import signal
+import time
+
+log = logging.getLogger(__name__)
+
+#Cada cuántos segundos el proceso principal revisa que los workers sigan vivos.
+WORKERS_CHECK_INTERVAL_S = 1.0
+
+#Supervisor de procesos worker para el modo multi-núcleo.
+#Cada worker es un proceso independiente (con su propio GIL) que abre el puerto de ingesta
+#con SO_REUSEPORT; el kernel reparte las conexiones nuevas entre ellos.
+#Los procesos se crean con fork para que hereden la memoria compartida (registros Modbus,
+#ventana anti-repetición) creada antes de llamar a iniciar().
+class WorkerPool:
+
+    def __init__(self, cantidad, target):
+        #target(numero) se ejecuta en cada worker y no debería retornar.
+        self.cantidad = cantidad
+        self.target = target
+        self.contexto = multiprocessing.get_context("fork")
+        self.procesos = {}
+        self.detenido = False
+
+    def iniciar(self):
+        for numero in range(self.cantidad):
+            self._lanzar(numero)
+
+    def _lanzar(self, numero):
+        proceso = self.contexto.Process(target=self.target, args=(numero,),
+                                        name=f"worker-{numero}", daemon=True)
+        proceso.start()
+        self.procesos[numero] = proceso
+        log.info("[WORKERS] Worker %d iniciado (PID %d)", numero, proceso.pid)
+
+    #Bloquea el proceso principal y reinicia los workers que terminen inesperadamente.
+    def supervisar(self):
+        signal.signal(signal.SIGTERM, lambda *_: self.detener())
+        try:
+            while not self.detenido:
+                time.sleep(WORKERS_CHECK_INTERVAL_S)
+                for numero, proceso in list(self.procesos.items()):
+                    if not proceso.is_alive() and not self.detenido:
+                        log.error("Worker %d terminó (código %s). Reiniciando...", numero, proceso.exitcode)
+                        self._lanzar(numero)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.detener()
+
+    def detener(self):
+        self.detenido = True
+        for proceso in self.procesos.values():
+            if proceso.is_alive():
+                os.kill(proceso.pid, signal.SIGINT)
+        for proceso in self.procesos.values():
+            proceso.join(timeout=5)
+            if proceso.is_alive():
+                proceso.terminate()
@@ -1,7 +1,9 @@
 import asyncio
+import json
 import aiohttp
-from pydantic import BaseModel, ValidationError
+from pydantic import BaseModel, TypeAdapter, ValidationError
 from datetime import datetime
+from typing import Optional
 
 #Se define el esquema localmente.
 class SensorReadingCreate(BaseModel):
@@ -11,71 +13,207 @@ class SensorReadingCreate(BaseModel):
     pressure: float
     humidity: float
 
+# Lectura ya guardada, como la devuelve GET /readings/ (con su id).
+class SensorReading(SensorReadingCreate):
+    id: int
+
+# Valida la respuesta completa de una vez, directo desde los bytes JSON,
+# en vez de recorrer la lista con model_validate item por item.
+LECTURAS = TypeAdapter(list[SensorReading])
+
+SERVER_URL = "http://localhost:8000"
+# Sensores a seguir; cada uno se consulta en paralelo. Vacio = todas las lecturas.
+SENSORES = []
+# Lecturas por pagina al consultar las nuevas.
+PAGE_SIZE = 100
+
 TEMP_RANGE = (0,30)
 HUMI_RANGE = (40,70)
 PRES_RANGE = (980,1020)
 
-def validar_limites(reading: SensorReadingCreate):
-    temp_ok = TEMP_RANGE[0] <= reading.temperature <= TEMP_RANGE[1]
-    humi_ok = HUMI_RANGE[0] <= reading.humidity <= HUMI_RANGE[1]
-    pres_ok = PRES_RANGE[0] <= reading.pressure <= PRES_RANGE[1]
+# Los limites se evaluan en el servidor final (reglas de alerta): el cliente los
+# registra al iniciar y recibe las alertas por GET /alerts/live.
+REGLAS = [{"kind": "range", "metric": "temperature", "min_value": TEMP_RANGE[0], "max_value": TEMP_RANGE[1]},
+          {"kind": "range", "metric": "humidity", "min_value": HUMI_RANGE[0], "max_value": HUMI_RANGE[1]},
+          {"kind": "range", "metric": "pressure", "min_value": PRES_RANGE[0], "max_value": PRES_RANGE[1]}]
+
+# Identifica una regla por su sensor, tipo, metrica y limites (el servidor devuelve los limites como float).
+def _clave_regla(regla):
+    return (regla.get("sensor_id"), regla["kind"], regla.get("metric"),
+            *(None if regla.get(campo) is None else float(regla[campo]) for campo in ("min_value", "max_value")))
+
+# Crea en el servidor las reglas de REGLAS que aun no existen (para cada sensor de SENSORES,
+# o para todos los sensores), asi varios clientes no las duplican.
+async def asegurar_reglas(session):
+    async with session.get(f"{SERVER_URL}/alerts/rules") as response:
+        response.raise_for_status()
+        existentes = {_clave_regla(regla) for regla in await response.json()}
+    for sensor_id in SENSORES or [None]:
+        for regla in REGLAS:
+            regla = {**regla, "sensor_id": sensor_id}
+            if _clave_regla(regla) in existentes:
+                continue
+            async with session.post(f"{SERVER_URL}/alerts/rules", json=regla) as response:
+                response.raise_for_status()
+
+
+# Escucha las aperturas y cierres de alertas (Server-Sent Events) y reconecta si se corta.
+async def escuchar_alertas(session):
+    params = [("sensor_id", sensor_id) for sensor_id in SENSORES]
+    while True:
+        try:
+            async with session.get(f"{SERVER_URL}/alerts/live", params=params,
+                                   timeout=aiohttp.ClientTimeout(total=None, sock_read=60)) as response:
+                response.raise_for_status()
+                async for linea in response.content:
+                    linea = linea.decode().rstrip("\n")
+                    if not linea.startswith("data:"):
+                        continue
+                    alerta = json.loads(linea[5:])
+                    if alerta.get("event") == "open":
+                        print(f"ALERTA sensor {alerta['sensor_id']}: {alerta['message']} ({alerta['opened_at']})")
+                    elif alerta.get("event") == "close":
+                        print(f"Alerta cerrada sensor {alerta['sensor_id']}: {alerta['message']} ({alerta['closed_at']})")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"Stream de alertas no disponible ('{e}'). Reintentando en 5 segundos..")
+        await asyncio.sleep(5)
+
+# Sigue las lecturas de un sensor (o de todos) y en cada consulta pide solo las
+# posteriores a la ultima vista (marca de agua: su timestamp y los ids con ese
+# timestamp, porque start_date es inclusivo). El trabajo de cada consulta es
+# proporcional a las lecturas nuevas, no al tamano de pagina.
+class Seguimiento:
+    def __init__(self, sensor_id: Optional[int] = None):
+        self.sensor_id = sensor_id
+        self.desde: Optional[datetime] = None
+        self.ids_desde: set[int] = set()
+        # ETag de la ultima respuesta: si nada cambio el servidor responde 304 sin cuerpo
+        self.etag: Optional[str] = None
+
+    def marcar(self, lecturas: list[SensorReading]):
+        # Avanza la marca de agua con lecturas ya procesadas (en cualquier orden).
+        for lectura in lecturas:
+            if self.desde is None or lectura.timestamp > self.desde:
+                self.desde = lectura.timestamp
+                self.ids_desde = {lectura.id}
+            elif lectura.timestamp == self.desde:
+                self.ids_desde.add(lectura.id)
+
+    async def nuevas(self, session) -> list[SensorReading]:
+        # Devuelve las lecturas nuevas en orden cronologico.
+        # La primera vez solo trae la pagina mas reciente, no toda la historia.
+        params = {"limit": PAGE_SIZE}
+        if self.sensor_id is not None:
+            params["sensor_id"] = self.sensor_id
+        if self.desde is not None:
+            params["start_date"] = self.desde.isoformat()
+
+        lecturas = []
+        cursor = None
+        while True:
+            headers = {"If-None-Match": self.etag} if self.etag and cursor is None else {}
+            async with session.get(f"{SERVER_URL}/readings/",
+                                   params=params if cursor is None else {**params, "cursor": cursor},
+                                   headers=headers) as response:
+                if response.status == 304:
+                    return []
+                response.raise_for_status()
+                pagina = LECTURAS.validate_json(await response.read())
+                if cursor is None:
+                    self.etag = response.headers.get("ETag")
+                cursor = response.headers.get("X-Next-Cursor")
+            lecturas.extend(pagina)
+            # Sin marca de agua no se recorre la historia: basta la primera pagina
+            if cursor is None or self.desde is None:
+                break
+
+        nuevas = [lectura for lectura in reversed(lecturas)
+                  if not (lectura.timestamp == self.desde and lectura.id in self.ids_desde)]
+        self.marcar(nuevas)
+        return nuevas
 
-    checks = [temp_ok, humi_ok, pres_ok]
 
-    if not all(checks):
-        if not temp_ok:
-            print(f"Temperatura fuera de rango: {reading.temperature} C")
-            print(f"Rango permitido: {TEMP_RANGE[0]} - {TEMP_RANGE[1]} C")
-        if not humi_ok:
-            print(f"Humedad fuera de rango: {reading.humidity} %")
-            print(f"Rango permitido: {HUMI_RANGE[0]} - {HUMI_RANGE[1]} %")
-        if not pres_ok:
-            print(f"Presion fuera de rango: {reading.pressure} hPa")
-            print(f"Rango permitido: {PRES_RANGE[0]} - {PRES_RANGE[1]} hPa")
+# Escucha el stream de lecturas en vivo (Server-Sent Events) y muestra cada una apenas llega.
+# Retorna si el servidor cierra el stream; lanza aiohttp.ClientError si no esta disponible.
+async def escuchar_en_vivo(session, url, seguimientos):
+    params = [("sensor_id", sensor_id) for sensor_id in SENSORES]
+    async with session.get(url, params=params, timeout=aiohttp.ClientTimeout(total=None, sock_read=60)) as response:
+        response.raise_for_status()
+        print("Conectado al stream de lecturas en vivo")
+        evento = None
+        async for linea in response.content:
+            linea = linea.decode().rstrip("\n")
+            if linea.startswith("event:"):
+                evento = linea[6:].strip()
+            elif linea.startswith("data:"):
+                if evento == "dropped":
+                    print(f"Aviso: el servidor descarto {linea[5:].strip()} lecturas por lentitud")
+                else:
+                    try:
+                        read = SensorReading.model_validate_json(linea[5:])
+                    except ValidationError as e:
+                        print(f"Error de validacion de datos: {e}")
+                        continue
+                    # Asi, si el stream se corta, la consulta sigue desde aqui sin repetir lecturas
+                    for seguimiento in seguimientos:
+                        if seguimiento.sensor_id in (None, read.sensor_id):
+                            seguimiento.marcar([read])
+                    print(read)
+                    print("------------------------------------")
+            elif linea == "":
+                evento = None
 
-# Funcion asincrona para pedir data de un url usando aiohttp
-async def fetch_data(session, url):
 
-    async with session.get(url) as response:
+# Consulta periodica de las lecturas nuevas, usada solo si el stream en vivo no esta disponible.
+# Los sensores se consultan en paralelo sobre la misma sesion. Retorna False si se agotan los reintentos.
+async def consultar(session, seguimientos, max_retries):
+    retries = 0
+    while retries < max_retries:
         try:
-            data = await response.json()
-            if isinstance(data, list):
-                readings = [SensorReadingCreate.model_validate(item) for item in data]
-                return readings
-            reading = [SensorReadingCreate.model_validate(data)]
-            return reading
+            resultados = await asyncio.gather(*(seguimiento.nuevas(session) for seguimiento in seguimientos))
+            for readings in resultados:
+                for read in readings:
+                    print(read)
+                    print("------------------------------------")
+            return True
         except ValidationError as e:
             print(f"Error de validacion de datos: {e}")
-            return None
+            return True
+        except aiohttp.ClientError as e:
+            print(f"Request fallida: '{e}'. Reintentando..")
+            retries += 1
+            backoff = 2
+            await asyncio.sleep(backoff)
+    return False
 
 
 # Main asincrono
 async def main():
-    # URL del servidor
-    url = "http://localhost:8000/readings/?skip=0&limit=100"
+    # URL del stream en vivo; la consulta periodica usa SERVER_URL
+    live_url = f"{SERVER_URL}/readings/live"
     max_retries = 5
+    # Una marca de agua por sensor seguido (o una sola para todas las lecturas)
+    seguimientos = [Seguimiento(sensor_id) for sensor_id in SENSORES] or [Seguimiento()]
     # Crear una sesion aiohttp para hacer requests asincronas
     async with aiohttp.ClientSession() as session:
-        # Recibe datos cada 5 segundos
+        # Las alertas llegan por su propio stream, en paralelo con las lecturas
+        try:
+            await asegurar_reglas(session)
+        except aiohttp.ClientError as e:
+            print(f"No se pudieron registrar las reglas de alerta: '{e}'")
+        alertas = asyncio.create_task(escuchar_alertas(session))
         while True:
-            retries = 0
-            while retries < max_retries:
-                try:
-                    readings = await fetch_data(session, url)
-                    if readings is not None:
-                        for read in readings:
-                            print(read)
-                            validar_limites(read)
-                            print("------------------------------------")
-                    break
-                except aiohttp.ClientError as e:
-                    print(f"Request fallida: '{e}'. Reintentando..")
-                    retries += 1
-                    backoff = 2
-                    await asyncio.sleep(backoff)
-
-            else:
+            # Se prefiere el stream en vivo: cada lectura llega una sola vez, sin re-descargar
+            try:
+                await escuchar_en_vivo(session, live_url, seguimientos)
+                continue
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                print(f"Stream en vivo no disponible ('{e}'). Consultando cada 5 segundos..")
+
+            # Respaldo: un ciclo de consulta, luego se vuelve a intentar el stream
+            if not await consultar(session, seguimientos, max_retries):
                 print("Intentos maximos alcanzados. Cerrando...")
+                alertas.cancel()
                 return
             await asyncio.sleep(5)
 